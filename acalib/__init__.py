@@ -1,10 +1,41 @@
 from __future__ import absolute_import
 
-from .algorithms import *
-from .upi import *
-from .io import *
+import importlib
 
 import warnings
 from astropy.utils.exceptions import AstropyWarning 
 warnings.simplefilter('ignore', category=AstropyWarning )
 warnings.filterwarnings('ignore', category=UserWarning, append=True)
+
+# Subpackages are imported on first access (PEP 562), so that "import acalib"
+# does not load matplotlib, scikit-image, pycupid, etc. The public names of
+# algorithms, upi and io are available from acalib (io first, as it used to
+# be imported last).
+_SUBPACKAGES = ('algorithms', 'core', 'io', 'synthetic', 'upi')
+_EXPORTS = ('io', 'upi', 'algorithms')
+# Submodules of upi and io that the star imports used to bring into acalib
+_SUBMODULES = {'axes': 'upi', 'flux': 'upi', 'reduction': 'upi', 'formatting': 'upi',
+               'fits': 'io', 'graph': 'io', 'container': 'io'}
+
+
+def __getattr__(name):
+    if name in _SUBPACKAGES:
+        return importlib.import_module('.' + name, __name__)
+    if name in _SUBMODULES:
+        return importlib.import_module('.{}.{}'.format(_SUBMODULES[name], name), __name__)
+    if name == '__all__':
+        names = set()
+        for sub in _EXPORTS:
+            names.update(importlib.import_module('.' + sub, __name__).__all__)
+        return sorted(names)
+    for sub in _EXPORTS:
+        module = importlib.import_module('.' + sub, __name__)
+        if name in module._LAZY:
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBPACKAGES) | set(_SUBMODULES) | set(__getattr__('__all__')))
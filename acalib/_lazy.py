@@ -0,0 +1,13 @@
+import importlib
+
+
+def submodule(package, name):
+    # Import a submodule for the __getattr__ of a lazy (PEP 562) package, so
+    # that it is reachable as an attribute. A missing submodule is reported
+    # as a missing attribute, errors inside an existing one are raised.
+    try:
+        return importlib.import_module('.' + name, package)
+    except ModuleNotFoundError as e:
+        if e.name != package + '.' + name:
+            raise
+    raise AttributeError("module {!r} has no attribute {!r}".format(package, name))
@@ -1,7 +1,26 @@
-from .fellWalker import FellWalker
-from .clumpFind import ClumpFind
-from .gms import GMS
-from .indexing import Indexing
-from .stacking import Stacking
+import importlib
 
-__all__ = ['FellWalker','Indexing', 'ClumpFind', 'Stacking', 'GMS']
+from .._lazy import submodule as _submodule
+
+# Algorithms are imported on first access (PEP 562)
+_LAZY = {'FellWalker': 'fellWalker', 'ClumpFind': 'clumpFind', 'GMS': 'gms',
+         'Indexing': 'indexing', 'Stacking': 'stacking', 'GaussClumps': 'gaussClumps',
+         'Collector': 'profiling', 'span': 'profiling', 'ResultCache': 'cache'}
+
+__all__ = ['FellWalker','Indexing', 'ClumpFind', 'Stacking', 'GMS', 'GaussClumps', 'Collector', 'span',
+           'ResultCache']
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    if not name.startswith('_'):
+        # Submodules (e.g. algorithms.fellWalker) stay reachable as attributes, as when imported eagerly
+        return _submodule(__name__, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,9 +1,62 @@
+import functools
+
+from . import profiling
+from .profiling import _NULL_SPAN, _Span
+
+
+def _cached(method, self, args, kwargs):
+    # Run through the result cache of the algorithm
+    cache = self.cache
+    key = cache.key(self, args, kwargs)
+    if key is None:
+        return method(self, *args, **kwargs)
+    found, result = cache.get(key)
+    if not found:
+        result = method(self, *args, **kwargs)
+        cache.put(key, result)
+    return result
+
+
+def _wrap_run(method, name):
+    # Wrap run() in a span and in the result cache, checking for a collector
+    # and a cache only once per call
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        collector = profiling._collector
+        if self.cache is None or not self.cacheable:
+            if collector is None:
+                return method(self, *args, **kwargs)
+            with _Span(collector, name, {}):
+                return method(self, *args, **kwargs)
+        if collector is None:
+            return _cached(method, self, args, kwargs)
+        with _Span(collector, name, {}):
+            return _cached(method, self, args, kwargs)
+    return wrapper
+
+
 class Algorithm(object):
     """
     Parent class of algorithms module. It defines the common
     interface that all algorithms should have.
+
+    The ``run`` method of every subclass is measured as the ``<Class>.run`` span,
+    and its stages can be measured with :meth:`span` (see
+    :class:`acalib.algorithms.profiling.Collector`).
+    If a :class:`acalib.algorithms.cache.ResultCache` is given (per instance, or
+    for all the algorithms through ``Algorithm.cache``), ``run`` returns the
+    stored result when called again on the same data and parameters.
     """
-    def __init__(self, params=None):
+    cache = None
+    # Algorithms whose run() updates the instance state must not be cached
+    cacheable = True
+
+    def __init_subclass__(cls, **kwargs):
+        super(Algorithm, cls).__init_subclass__(**kwargs)
+        if 'run' in cls.__dict__:
+            cls.run = _wrap_run(cls.run, cls.__name__ + '.run')
+
+    def __init__(self, params=None, cache=None):
         """
         Load default params if None given.
 
@@ -11,7 +64,11 @@ class Algorithm(object):
         ----------            
             params : dict (default = None)
                 Dictionary with algorithm's parameters
+            cache : acalib.algorithms.cache.ResultCache (default = None)
+                On-disk cache of the results of run (by default ``Algorithm.cache``).
         """
+        if cache is not None:
+            self.cache = cache
         self.config = dict()
         if params is not None:
             for key,value in params.items():
@@ -64,3 +121,17 @@ class Algorithm(object):
             dict with the current algorithm's configuration.
         """
         return self.config
+
+    def span(self, stage, **args):
+        """
+            Measure a stage of the algorithm (see :func:`acalib.algorithms.profiling.span`), named after the class.
+
+            Parameters
+            ----------
+            stage : str
+                Stage name, e.g. ``"spectra_sketch"``.
+        """
+        collector = profiling._collector
+        if collector is None:
+            return _NULL_SPAN
+        return _Span(collector, type(self).__name__ + '.' + stage, args)
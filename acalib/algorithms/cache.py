@@ -0,0 +1,233 @@
+import os
+import glob
+import json
+import hashlib
+import pickle
+import tempfile
+import zlib
+
+import numpy as np
+from astropy import log
+from astropy.nddata import NDData
+from astropy.wcs import WCS
+
+try:
+    import xxhash
+
+    def _hasher():
+        return xxhash.xxh3_128()
+except ImportError:
+    xxhash = None
+
+    def _hasher():
+        return hashlib.blake2b(digest_size=16)
+
+# Bump when the key or the stored format changes, to ignore old entries
+_FORMAT = 1
+_SUFFIX = '.pkz'
+_BLOCK = 2 ** 24
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_code = None
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _code_version():
+    # Hash of the acalib sources, so results of older code are not returned
+    global _code
+    if _code is None:
+        h = _hasher()
+        for folder, dirs, files in sorted(os.walk(_ROOT)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    with open(os.path.join(folder, name), 'rb') as f:
+                        h.update(f.read())
+        _code = h.hexdigest()
+    return _code
+
+
+def _update_wcs(h, wcs):
+    # Sliced NDData carry a high level wrapper of the WCS
+    wcs = getattr(wcs, 'low_level_wcs', wcs)
+    if not isinstance(wcs, WCS):
+        raise _Uncacheable("{} WCS are not hashed".format(type(wcs).__name__))
+    h.update(wcs.to_header_string(relax=True).encode())
+
+
+def _update_array(h, arr):
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject:
+        raise _Uncacheable("object arrays are not hashed")
+    h.update('{}{}'.format(arr.dtype.str, arr.shape).encode())
+    # non-contiguous arrays are copied once; the bytes are then hashed blockwise
+    flat = np.ascontiguousarray(arr).reshape(-1).view(np.uint8)
+    for start in range(0, flat.size, _BLOCK):
+        h.update(flat[start:start + _BLOCK].data)
+
+
+def _update(h, value):
+    # Feed an argument of run() to the hash; raise _Uncacheable for values
+    # without a stable content representation (e.g. generators).
+    if isinstance(value, NDData):
+        h.update(b'NDData')
+        _update_array(h, value.data)
+        if value.mask is not None:
+            _update_array(h, value.mask)
+        if value.wcs is not None:
+            _update_wcs(h, value.wcs)
+        h.update(str(value.unit).encode())
+    elif isinstance(value, np.ndarray):
+        _update_array(h, value)
+    elif isinstance(value, (list, tuple)):
+        h.update('{}{}'.format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _update(h, item)
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update(repr(value).encode())
+    else:
+        raise _Uncacheable("{} arguments are not hashed".format(type(value).__name__))
+
+
+class ResultCache(object):
+    """
+    On-disk cache of :meth:`Algorithm.run` results, addressed by content.
+
+    The key hashes the input arrays (blockwise, with xxhash when available and
+    BLAKE2 otherwise), their mask, WCS header and unit, the algorithm class and
+    its parameters, and the acalib sources (so entries of older code are not
+    used), so a run on unchanged inputs returns the stored result.
+    Results are stored pickled and zlib compressed (CAAs compress very well),
+    and the least recently used entries are removed when the cache grows over
+    *max_bytes*. Runs with arguments that can not be hashed (e.g. generators)
+    are not cached.
+
+    Entries are loaded with pickle, which can run arbitrary code: only use a
+    cache directory that you trust (not writable by other users).
+
+    Parameters
+    ----------
+    path : str (default = "~/.cache/acalib")
+        Cache directory (trusted, see above).
+    max_bytes : int (default = 2**30)
+        Size limit of the cache directory.
+    level : int (default = 1)
+        zlib compression level.
+
+    Examples
+    --------
+    >>> fw = FellWalker(cache=ResultCache())
+    >>> caa, clumps = fw.run(cube)   # computed
+    >>> caa, clumps = fw.run(cube)   # loaded from disk
+    """
+
+    def __init__(self, path=None, max_bytes=2 ** 30, level=1):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'acalib')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, algorithm, args, kwargs):
+        """
+            Content key of a run, or None if its arguments can not be hashed.
+
+            Parameters
+            ----------
+            algorithm : Algorithm
+                Algorithm instance (its class and parameters are part of the key).
+            args, kwargs :
+                Arguments of ``run``.
+        """
+        h = _hasher()
+        cls = type(algorithm)
+        params = json.dumps(algorithm.get_params(), sort_keys=True, default=repr)
+        h.update('{}:{}:{}.{}:{}'.format(_FORMAT, _code_version(), cls.__module__, cls.__name__, params).encode())
+        try:
+            _update(h, tuple(args))
+            _update(h, sorted(kwargs.items()))
+        except _Uncacheable:
+            return None
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + _SUFFIX)
+
+    def get(self, key):
+        """
+            Stored result for *key*.
+
+            Returns
+            -------
+            result : tuple
+                (True, result) on a hit, (False, None) otherwise.
+        """
+        filename = self._file(key)
+        try:
+            with open(filename, 'rb') as f:
+                result = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            self.misses += 1
+            return False, None
+        except Exception as e:
+            log.warning("Removing unreadable cache entry {}: {}".format(filename, e))
+            self._remove(filename)
+            self.misses += 1
+            return False, None
+        # the modification time orders the entries for the LRU eviction
+        # (the entry may already have been evicted by another process)
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        """
+            Store *result* under *key*, then evict old entries if over the size limit.
+        """
+        try:
+            blob = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), self.level)
+        except Exception as e:
+            log.warning("Result not cached: {}".format(e))
+            return
+        # atomic write, so concurrent runs never read a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, self._file(key))
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in *max_bytes*. """
+        entries = []
+        for filename in glob.glob(os.path.join(self.path, '*' + _SUFFIX)):
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+        total = sum(e[1] for e in entries)
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(filename)
+            total -= size
+
+    def clear(self):
+        """ Remove all the entries. """
+        for filename in glob.glob(os.path.join(self.path, '*' + _SUFFIX)):
+            self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
@@ -1,10 +1,15 @@
 from .. import core
 import numpy as np
-import pycupid
 
+from astropy import log
 from astropy.nddata import *
 from .algorithm import Algorithm
 
+try:
+    import pycupid
+except ImportError:
+    pycupid = None
+
 
 # storing unusable pixels for now (-1)
 def _struct_builder(caa):
@@ -44,6 +49,9 @@ def _clumpfind(data, config, wcs=None, mask=None, unit=None, rms=0.0):
             cube = data[0,:,:]
 
 
+    if pycupid is None:
+        log.error("ClumpFind requires pycupid")
+        raise ImportError("ClumpFind requires pycupid")
     ret = pycupid.clumpfind(cube, rms,config=config)
     if ret is not None:
         ret[ret == ret.min()] = 0
@@ -81,19 +89,22 @@ class ClumpFind(Algorithm):
                 raise Exception("Algorithm only support 2D and 3D Matrices")
         # if rms not in config, estimate it
         if 'RMS' not in self.config:
-            if type(data) == NDData or type(data)== NDDataRef:
-                rms = core.rms(data.data)
-            else:
-                rms = core.rms(data)
+            with self.span("rms"):
+                if type(data) == NDData or type(data)== NDDataRef:
+                    rms = core.rms(data.data)
+                else:
+                    rms = core.rms(data)
         else:
             rms = self.config['RMS']
 
         # computing the CAA through clumpfind clumping algorithm
-        caa = _clumpfind(data, self.config, rms=rms)
+        with self.span("clumpfind"):
+            caa = _clumpfind(data, self.config, rms=rms)
 
         # computing asocciated structures
         if caa is not None:
-            clumps = _struct_builder(caa.data)
+            with self.span("struct_builder"):
+                clumps = _struct_builder(caa.data)
 
             return caa,clumps
         else:
@@ -1,9 +1,16 @@
+import itertools
 import numpy as np
-import acalib
-import pycupid
+from .. import core
+from astropy import log
 from astropy.nddata import *
+from scipy import ndimage
 from .algorithm import Algorithm
 
+try:
+    import pycupid
+except ImportError:
+    pycupid = None
+
 
 # storing unusable pixels for now (-1)
 def _struct_builder(caa):
@@ -30,8 +37,7 @@ def _struct_builder(caa):
     return clumps
 
 
-@support_nddata
-def _fellwalker(data, config, wcs=None, mask=None, unit=None, rms=0.0):
+def _squeeze_cube(data):
     cube = data
     if len(data.shape) == 4:
         if data.shape[0] == 1:
@@ -41,8 +47,29 @@ def _fellwalker(data, config, wcs=None, mask=None, unit=None, rms=0.0):
     elif len(data.shape) == 3:
         if data.shape[0] == 1:
             cube = data[0,:,:]
+    return cube
+
+
+@support_nddata
+def _fellwalker(data, config, wcs=None, mask=None, unit=None, rms=0.0):
+    cube = _squeeze_cube(data)
 
-    ret = pycupid.fellwalker(cube, rms,config=config)
+    backend = config.get('BACKEND')
+    if backend not in (None, 'numpy', 'pycupid'):
+        log.error("BACKEND must be 'numpy' or 'pycupid'")
+        raise ValueError("BACKEND must be 'numpy' or 'pycupid'")
+    if backend == 'pycupid' and pycupid is None:
+        log.error("The pycupid backend requires pycupid")
+        raise ImportError("The pycupid backend requires pycupid")
+    if backend is None and pycupid is None:
+        log.warning("pycupid is not available, using the array-based FellWalker")
+        backend = 'numpy'
+
+    if backend == 'numpy':
+        ret = _fellwalker_numpy(cube, rms, config)
+    else:
+        config = {key: value for key, value in config.items() if key != 'BACKEND'}
+        ret = pycupid.fellwalker(cube, rms,config=config)
 
     if ret is not None:
         ret[ret == ret.min()] = 0
@@ -54,6 +81,257 @@ def _fellwalker(data, config, wcs=None, mask=None, unit=None, rms=0.0):
         return None
 
 
+def _offsets(ndim, half=False):
+    # Offsets to the 3^ndim - 1 neighbours of a pixel. If half is True,
+    # only one of each pair of opposite offsets is returned.
+    offs = np.array(list(itertools.product((-1, 0, 1), repeat=ndim)))
+    offs = offs[np.any(offs != 0, axis=1)]
+    if half:
+        first = offs[np.arange(len(offs)), np.argmax(offs != 0, axis=1)]
+        offs = offs[first > 0]
+    return offs
+
+
+def _overlap(shape, off):
+    # Slices of the pixels p and p + off, for all the p where both are
+    # inside an array of the given shape.
+    src = tuple(slice(max(0, -o), n - max(0, o)) for o, n in zip(off, shape))
+    dst = tuple(slice(max(0, o), n - max(0, -o)) for o, n in zip(off, shape))
+    return src, dst
+
+
+def _steepest_ascent(values, maxjump):
+    # Flat index of the next pixel of the walk from each pixel: the
+    # neighbour with the greatest (positive) gradient. Local maxima jump to
+    # the highest pixel within maxjump pixels, if it is higher. Peaks point
+    # to themselves. Unusable pixels must be -inf.
+    shape = values.shape
+    index = np.arange(values.size).reshape(shape)
+    nxt = index.copy()
+    best = np.zeros(shape)
+    strides = np.array(values.strides) // values.itemsize
+    padded = np.pad(values, 1, mode='constant', constant_values=-np.inf)
+    with np.errstate(invalid='ignore'):
+        for off in _offsets(values.ndim):
+            nb = padded[tuple(slice(1 + o, 1 + o + n) for o, n in zip(off, shape))]
+            grad = (nb - values) / np.sqrt(np.abs(off).sum())
+            better = grad > best
+            best[better] = grad[better]
+            nxt[better] = index[better] + off.dot(strides)
+    usable = np.isfinite(values)
+    nxt[~usable] = index[~usable]
+    nxt = nxt.ravel()
+
+    if maxjump > 0:
+        # A local maximum could be just a noise spike, so we check the
+        # extended neighbourhood for a higher pixel.
+        ext = ndimage.maximum_filter(values, size=2 * maxjump + 1, mode='constant', cval=-np.inf)
+        spikes = np.flatnonzero(usable & (nxt.reshape(shape) == index) & (ext > values))
+        for idx in spikes:
+            pos = np.unravel_index(idx, shape)
+            lower = [max(0, p - maxjump) for p in pos]
+            win = values[tuple(slice(l, p + maxjump + 1) for l, p in zip(lower, pos))]
+            top = np.unravel_index(np.argmax(win), win.shape)
+            nxt[idx] = np.ravel_multi_index(tuple(l + t for l, t in zip(lower, top)), shape)
+    return nxt
+
+
+def _walk_roots(nxt):
+    # Resolve the ascent chains by pointer jumping: root[p] is the peak
+    # where the walk starting at p ends.
+    root = nxt.copy()
+    while True:
+        nroot = root[root]
+        if np.array_equal(nroot, root):
+            return root
+        root = nroot
+
+
+def _walk_kept(nxt, values, flatslope):
+    # The initial section of a walk with an average gradient (over 4
+    # pixels) below flatslope is not included in the clump. A pixel is kept
+    # if it is steep, or if any walk reaches it after a steep pixel, i.e.
+    # if it is on the way up from a steep pixel. The closure is computed by
+    # pointer doubling.
+    flat = values.ravel()
+    index = np.arange(flat.size)
+    s1 = nxt
+    s2 = nxt[s1]
+    s3 = nxt[s2]
+    steps = (s1 != index).astype(int) + (s2 != s1) + (s3 != s2)
+    with np.errstate(invalid='ignore'):
+        kept = (steps > 0) & (flat[s3] - flat >= flatslope * steps)
+    jump = nxt.copy()
+    while True:
+        kept[jump[kept]] = True
+        njump = jump[jump]
+        if np.array_equal(njump, jump):
+            return kept
+        jump = njump
+
+
+def _clump_cols(labels, data):
+    # Adjacent clump pairs (lo < hi) and the col between them: the highest
+    # value of the lower pixel of any pair of touching pixels.
+    los, his, cols = [], [], []
+    for off in _offsets(labels.ndim, half=True):
+        src, dst = _overlap(labels.shape, off)
+        a = labels[src]
+        b = labels[dst]
+        sel = (a > 0) & (b > 0) & (a != b)
+        a = a[sel]
+        b = b[sel]
+        los.append(np.minimum(a, b))
+        his.append(np.maximum(a, b))
+        cols.append(np.minimum(data[src][sel], data[dst][sel]))
+    return _max_per_pair(np.concatenate(los), np.concatenate(his), np.concatenate(cols))
+
+
+def _max_per_pair(lo, hi, col):
+    if lo.size == 0:
+        return lo, hi, col
+    pairs, inv = np.unique(np.vstack((lo, hi)), axis=1, return_inverse=True)
+    top = np.full(pairs.shape[1], -np.inf)
+    np.maximum.at(top, inv.ravel(), col)
+    return pairs[0], pairs[1], top
+
+
+def _merge_clumps(labels, data, peaks, mindip):
+    # Join clumps that have a small dip between them: a clump is merged with
+    # the neighbour separated by the highest col, if its peak is less than
+    # mindip above that col. All the merges of a round whose targets are not
+    # being merged themselves are done at once, and the cols are updated on
+    # the clump graph (no pass over the cube).
+    lo, hi, col = _clump_cols(labels, data)
+    parent = np.arange(peaks.size)
+    while lo.size > 0:
+        src = np.concatenate((lo, hi))
+        dst = np.concatenate((hi, lo))
+        dcol = np.concatenate((col, col))
+        order = np.lexsort((-dcol, src))
+        src, dst, dcol = src[order], dst[order], dcol[order]
+        first = np.ones(src.size, dtype=bool)
+        first[1:] = src[1:] != src[:-1]
+        src, dst, dcol = src[first], dst[first], dcol[first]
+
+        cand = peaks[src] < dcol + mindip
+        if not cand.any():
+            break
+        src, dst = src[cand], dst[cand]
+        merging = np.zeros(peaks.size, dtype=bool)
+        merging[src] = True
+        safe = ~merging[dst]
+        if safe.any():
+            src, dst = src[safe], dst[safe]
+        else:
+            k = np.argmin(peaks[src])
+            src, dst = src[k:k + 1], dst[k:k + 1]
+
+        mapping = np.arange(peaks.size)
+        mapping[src] = dst
+        np.maximum.at(peaks, dst, peaks[src])
+        parent = mapping[parent]
+        lo, hi = mapping[lo], mapping[hi]
+        sel = lo != hi
+        lo, hi, col = _max_per_pair(np.minimum(lo, hi)[sel], np.maximum(lo, hi)[sel], col[sel])
+    return parent[labels]
+
+
+def _smooth_boundaries(labels):
+    # Replace each pixel by the most commonly occuring value within the
+    # 3x3x3 (3x3 for images) cube of pixels centred on it. Only pixels with
+    # some different neighbour can change. Ties keep the central value.
+    shape = labels.shape
+    padded = np.pad(labels, 1, mode='constant', constant_values=-1)
+    offs = list(_offsets(labels.ndim)) + [np.zeros(labels.ndim, dtype=int)]
+    views = [padded[tuple(slice(1 + o, 1 + o + n) for o, n in zip(off, shape))] for off in offs]
+    border = np.zeros(shape, dtype=bool)
+    for v in views[:-1]:
+        border |= (v != labels) & (v != -1)
+    if not border.any():
+        return labels
+    nbs = np.stack([v[border] for v in views], axis=1)
+    counts = np.zeros(nbs.shape, dtype=int)
+    for j in range(nbs.shape[1]):
+        counts[:, j] = (nbs == nbs[:, j:j + 1]).sum(axis=1)
+    counts[nbs == -1] = -1
+    best = np.argmax(counts, axis=1)
+    keep = counts[:, -1] == counts[np.arange(best.size), best]
+    best[keep] = nbs.shape[1] - 1
+    smoothed = labels.copy()
+    smoothed[border] = nbs[np.arange(best.size), best]
+    return smoothed
+
+
+def _fellwalker_numpy(cube, rms, config):
+    """
+    Array-based FellWalker (Berry, 2015), used with BACKEND 'numpy' or when
+    pycupid is not available.
+
+    Every pixel walks up the steepest gradient at the same time: the next
+    pixel of all the walks is computed with shifted-array comparisons, and
+    the peak of each walk by pointer jumping. Parameters follow CUPID, in
+    data units (NOISE, MINHEIGHT, FLATSLOPE and MINDIP default to 2, 2, 1
+    and 3 times the RMS). Isolated usable pixels are removed first with
+    the FRAC/CENTRE cellular automaton.
+    """
+    noise = config.get('NOISE', 2.0 * rms)
+    minheight = config.get('MINHEIGHT', noise)
+    flatslope = config.get('FLATSLOPE', 1.0 * rms)
+    mindip = config.get('MINDIP', 3.0 * rms)
+    minpix = config.get('MINPIX', 16)
+    maxjump = config.get('MAXJUMP', 4)
+    cleaniter = config.get('CLEANITER', 1)
+    allowedge = config.get('ALLOWEDGE', 1)
+
+    data = np.array(cube, dtype=np.float64)
+    if data.ndim not in (2, 3):
+        log.error("Algorithm only support 2D and 3D Matrices")
+        raise ValueError("Algorithm only support 2D and 3D Matrices")
+    with np.errstate(invalid='ignore'):
+        usable = data >= noise
+    # Remove small isolated groups of usable pixels
+    caa = core.remove_isolate(np.where(usable, 0, -1), config.get('FRAC', 0.1),
+                              centre=config.get('CENTRE', 1))
+    usable = caa == 0
+    values = np.where(usable, data, -np.inf)
+
+    # Walk up hill from every usable pixel
+    nxt = _steepest_ascent(values, maxjump)
+    root = _walk_roots(nxt)
+    kept = _walk_kept(nxt, values, flatslope) & usable.ravel()
+
+    # One clump per peak reached by a valid walk
+    peak_ids, inv = np.unique(root[kept], return_inverse=True)
+    labels = np.zeros(data.size, dtype=np.int64)
+    labels[kept] = inv.ravel() + 1
+    labels = labels.reshape(data.shape)
+    peaks = np.concatenate(([-np.inf], data.ravel()[peak_ids]))
+
+    labels = _merge_clumps(labels, data, peaks, mindip)
+    for i in range(cleaniter):
+        labels = _smooth_boundaries(labels)
+
+    # Reject small and low clumps (and those touching the edges if not
+    # allowed), and number the remaining ones by decreasing peak value.
+    ids = np.arange(labels.max() + 1)
+    npix = np.bincount(labels.ravel(), minlength=ids.size)
+    good = (ids > 0) & (npix >= minpix)
+    if good.any():
+        height = np.full(ids.size, -np.inf)
+        height[good] = ndimage.maximum(data, labels, ids[good])
+        good &= height >= minheight
+    if not allowedge:
+        for axis in range(labels.ndim):
+            for edge in (0, -1):
+                good[np.take(labels, edge, axis=axis)] = False
+    good[0] = False
+    mapping = np.zeros(ids.size, dtype=np.int64)
+    order = ids[good][np.argsort(-height[good])] if good.any() else ids[good]
+    mapping[order] = np.arange(1, order.size + 1)
+    return mapping[labels]
+
+
 class FellWalker(Algorithm):
 
     def default_params(self):
@@ -72,19 +350,24 @@ class FellWalker(Algorithm):
         # if rms not in config, estimate it
 
         if 'RMS' not in self.config:
-            if type(data) == NDData or type(data)== NDDataRef:
-                rms = acalib.rms(data.data)
-            else:
-                rms = acalib.rms(data)
+            with self.span("rms"):
+                if type(data) == NDData or type(data)== NDDataRef:
+                    rms = core.rms(data.data)
+                else:
+                    rms = core.rms(data)
         else:
             rms = self.config['RMS']
 
         # computing the CAA through CUPID's fellwalker clumping algorithm
-        caa = _fellwalker(data, self.config,rms = rms)
+        # (or the array-based version if BACKEND is 'numpy' or pycupid is
+        # not available)
+        with self.span("fellwalker"):
+            caa = _fellwalker(data, self.config,rms = rms)
 
         # computing asocciated structures
         if caa is not None:
-            clumps = _struct_builder(caa.data)
+            with self.span("struct_builder"):
+                clumps = _struct_builder(caa.data)
 
             return caa,clumps
         else:
@@ -0,0 +1,778 @@
+import sys
+import numpy as np
+from astropy import log
+from astropy.nddata import *
+from astropy.table import Table
+from scipy.optimize import minimize
+from scipy.ndimage import maximum_filter
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import core
+from .algorithm import Algorithm
+from .profiling import span
+
+K = 4 * np.log(2.0)
+
+CATALOG_NAMES = ("Intensity", "Offset", "RA mu", "RA std", "DEC mu", "DEC std", "Angle",
+                 "FREQ mu", "FREQ std", "RA vel grad", "DEC vel grad")
+
+
+def _profile_width(line, ipeak, valmax, rms, fwhm):
+    # Estimate the FWHM of the profile "line" (a 1D cut through the peak at
+    # index ipeak) by walking outwards up to the first significant minimum
+    # at each side. Returns the FWHM and the baseline value (the smallest
+    # of both minima). Bad pixels must be NaN.
+    mins = []
+    for step in (-1, 1):
+        prev = np.nan
+        vmin = line[ipeak]
+        pmin = ipeak
+        csum = 0.0
+        nsum = 0
+        i = ipeak
+        while 0 <= i + step < line.size:
+            i += step
+            val = line[i]
+            if np.isnan(val):
+                prev = np.nan
+                continue
+            if val < vmin and (np.isnan(prev) or prev - val < 1.5 * rms):
+                vmin = val
+                pmin = i
+                csum = 0.0
+                nsum = 0
+            else:
+                csum += val
+                nsum += 1
+                if csum / nsum - vmin >= 3 * rms / np.sqrt(nsum) and nsum >= fwhm:
+                    break
+            prev = val
+        mins.append((vmin, pmin))
+
+    # Use the side with the deepest minimum to fit the width, assuming a
+    # gaussian profile between the peak and the minimum.
+    vlow, plow = min(mins)
+    hgt = valmax - vlow
+    default = abs(ipeak - plow) / 2.0
+    if hgt <= 0:
+        return default, vlow
+    lo, hi = min(ipeak, plow), max(ipeak, plow) + 1
+    cand = (line[lo:hi] - vlow) / hgt
+    dist = np.abs(np.arange(lo, hi) - ipeak)
+    sel = (cand > 0.25) & (cand < 0.75)
+    if sel.any():
+        default = 1.665 * np.mean(dist[sel] / np.sqrt(-np.log(cand[sel])))
+    return default, vlow
+
+
+def _initial_guess(residual, imax, valmax, config):
+    # Initial guess of the clump parameters centred at imax. The cube is in
+    # FREQ,DEC,RA order, while parameters are given in RA,DEC,FREQ order.
+    beamfwhm = config['FWHMBEAM']
+    velres = config['VELORES']
+    rms = config['RMS']
+
+    # Get a guess at the observed clump fwhm by forming a radial profile and
+    # finding the distance to the first significant minimum. This also gives
+    # the base line data value in the profile. Do this for both spatial axes,
+    # and then take the mean (i.e. we assume the clump is circular as an
+    # initial guess)
+    fobs = np.zeros(3)
+    off = np.zeros(3)
+    lines = (residual[imax[0], imax[1], :], residual[imax[0], :, imax[2]], residual[:, imax[1], imax[2]])
+    fwhms = (beamfwhm, beamfwhm, velres)
+    for i in range(3):
+        fobs[i], off[i] = _profile_width(lines[i], imax[2 - i], valmax, rms, fwhms[i])
+    if fobs[2] < velres + 0.1:
+        fobs[2] = velres + 0.1
+    fbeam = 0.5 * (fobs[0] + fobs[1]) / beamfwhm
+    if fbeam < 1.0:
+        fbeam = 1.2
+    fobs[0] = fbeam * beamfwhm
+    fobs[1] = fbeam * beamfwhm
+
+    cval = np.array([imax[2], imax[1], imax[0]], dtype=np.float64)
+    guess = np.zeros(11)
+    guess[2] = cval[0]
+    guess[4] = cval[1]
+    guess[7] = cval[2]
+    # Find the initial guess at the intrinsic FWHM (i.e. the FWHM of the
+    # clump before being blurred by the instrument beam). Assume zero
+    # rotation of the elliptical clump shape and zero velocity gradient.
+    guess[3] = np.sqrt(fbeam * fbeam - 1.0) * beamfwhm
+    guess[5] = guess[3]
+    fvel = fobs[2] / velres
+    guess[8] = np.sqrt(fvel * fvel - 1.0) * velres
+
+    # Noise will result in the peak data value being larger than the peak
+    # clump value by about the RMS noise. Therefore, reduce the peak value by
+    # the RMS.
+    guess[1] = off.sum() / 3
+    guess[0] = valmax - guess[1] - rms
+
+    # An apparent negative background can be formed by a previous
+    # ill-positioned fit. If the initial background estimate is significantly
+    # less than zero, then set it to zero, and indicate that the background
+    # value should be fixed.
+    fixback = False
+    if guess[1] < -np.abs(guess[0] * 0.05):
+        guess[0] += guess[1]
+        guess[1] = 0.0
+        fixback = True
+    return guess, cval, fobs, fixback
+
+
+def _fit_window(shape, cval, fobs, config):
+    # Bounds (FREQ,DEC,RA order) of the box where the weights are non-zero.
+    beta = 0.5 * config['WWIDTH'] * np.sqrt(-np.log(config['WMIN']) / np.log(2.0))
+    lb = np.rint(cval - beta * fobs)[::-1].astype(int)
+    ub = np.rint(cval + beta * fobs)[::-1].astype(int) + 1
+    lb = np.clip(lb, 0, shape)
+    ub = np.clip(ub, 0, shape)
+    return lb, ub
+
+
+def _box_features(lb, ub):
+    # RA, DEC and FREQ pixel coordinates of every voxel in the box, in the
+    # same (C) order used to ravel the box data.
+    v, y, x = np.meshgrid(np.arange(lb[0], ub[0]), np.arange(lb[1], ub[1]),
+                          np.arange(lb[2], ub[2]), indexing='ij')
+    return np.array([x.ravel(), y.ravel(), v.ravel()], dtype=np.float64)
+
+
+def clump_model(par, feat, config):
+    """
+    Evaluate a (background-free) Gaussian clump at the given features.
+
+    Parameters
+    ----------
+    par : numpy.ndarray
+        The 11 clump parameters (see :class:`GaussClumps`).
+    feat : (3,N) numpy.ndarray
+        RA, DEC and FREQ pixel coordinates where to evaluate the model.
+    config : dict
+        Algorithm configuration with the FWHMBEAM and VELORES keys.
+
+    Returns
+    -------
+    result : (N,) numpy.ndarray
+        The model values (the clump is convolved with the instrumental beam).
+    """
+    bfsq = config['FWHMBEAM'] ** 2
+    velsq = config['VELORES'] ** 2
+    sx2 = bfsq + par[3] * par[3]
+    sy2 = bfsq + par[5] * par[5]
+    sv2 = velsq + par[8] * par[8]
+    peakfactor = np.sqrt(par[3] * par[3] * par[5] * par[5] * par[8] * par[8] / (sx2 * sy2 * sv2))
+    cosv = np.cos(par[6])
+    sinv = np.sin(par[6])
+    x_off = feat[0] - par[2]
+    y_off = feat[1] - par[4]
+    vt_off = feat[2] - par[7] - par[9] * x_off - par[10] * y_off
+    X = x_off * cosv + y_off * sinv
+    Y = -x_off * sinv + y_off * cosv
+    em = X * X / sx2 + Y * Y / sy2 + vt_off * vt_off / sv2
+    return par[0] * peakfactor * np.exp(-K * em)
+
+
+class _ClumpFit(object):
+    """
+    Chi-square of a single clump fit, evaluated only where the Gaussian
+    weights are non-zero. All the work arrays are allocated once per clump
+    and reused by every evaluation of the optimizer, and the chi-square and
+    its gradient are computed in one pass.
+    """
+
+    def __init__(self, val, feat, we, guess, cval, valmax, fixback, config):
+        self.config = config
+        self.val = val
+        self.x = feat[0]
+        self.y = feat[1]
+        self.v = feat[2]
+        self.we = we
+        self.guess = guess
+        self.cval = cval
+        self.valmax = valmax
+        self.fixback = fixback
+        self.bfsq = config['FWHMBEAM'] ** 2
+        self.velsq = config['VELORES'] ** 2
+
+        n = val.size
+        self.x_off = np.empty(n)
+        self.y_off = np.empty(n)
+        self.vt_off = np.empty(n)
+        self.X = np.empty(n)
+        self.Y = np.empty(n)
+        self.expv = np.empty(n)
+        self.model = np.empty(n)
+        self.res = np.empty(n)
+        self.wres = np.empty(n)
+        self.qx = np.empty(n)
+        self.qy = np.empty(n)
+        self.qv = np.empty(n)
+        self.old_model = np.empty(n)
+        self.old_res = np.empty(n)
+        self.wf = np.empty(n)
+
+        # Number of invocations of the function, and of weight modifications
+        self.nf = 0
+        self.nwm = 0
+        self.bg = 0.0
+        self.old_par = None
+        self.last = None
+
+    def _full(self, par):
+        if self.fixback:
+            return np.insert(par, 1, 0.0)
+        return par
+
+    def evaluate(self, par):
+        """ Chi-square and its gradient for the free parameters par """
+        if self.old_par is not None and np.array_equal(par, self.old_par):
+            return self.last
+        self.old_par = par.copy()
+        p = self._full(par)
+        if p[3] <= 0.0 or p[5] <= 0.0 or p[8] <= 0.0:
+            self.last = (np.inf, np.zeros_like(par))
+            return self.last
+
+        cfg = self.config
+        sa = cfg['SA']
+        sb = cfg['SB']
+        sc = cfg['SC']
+        s0 = cfg['S0']
+
+        # Get the factor by which to correct the peak amplitude of the model to
+        # take account of the smoothing by the instrumental beam.
+        t = p[3] * p[3]
+        sx2 = self.bfsq + t
+        f3 = self.bfsq / (p[3] * sx2)
+        peakfactor = t / sx2
+        t = p[5] * p[5]
+        sy2 = self.bfsq + t
+        f5 = self.bfsq / (p[5] * sy2)
+        peakfactor *= t / sy2
+        t = p[8] * p[8]
+        sv2 = self.velsq + t
+        f8 = self.velsq / (p[8] * sv2)
+        peakfactor *= t / sv2
+        peakfactor = np.sqrt(peakfactor)
+        peak = p[0] * peakfactor
+
+        # The difference between the model peak value (after being reduced to
+        # take account of instrumental smoothing) and the data peak value.
+        pdiff = peak + p[1] - self.valmax
+        back_term = p[1] - self.guess[1]
+        # The offset from the model centre to the data peak
+        xm_off = p[2] - self.cval[0]
+        ym_off = p[4] - self.cval[1]
+        vm_off = p[7] - self.cval[2]
+
+        # Get the Gaussian model.
+        cosv = np.cos(p[6])
+        sinv = np.sin(p[6])
+        x_off, y_off, vt_off = self.x_off, self.y_off, self.vt_off
+        X, Y, expv = self.X, self.Y, self.expv
+        np.subtract(self.x, p[2], out=x_off)
+        np.subtract(self.y, p[4], out=y_off)
+        np.subtract(self.v, p[7], out=vt_off)
+        qx = self.qx
+        np.multiply(x_off, p[9], out=qx)
+        vt_off -= qx
+        np.multiply(y_off, p[10], out=qx)
+        vt_off -= qx
+        np.multiply(x_off, cosv, out=X)
+        np.multiply(y_off, sinv, out=qx)
+        X += qx
+        np.multiply(y_off, cosv, out=Y)
+        np.multiply(x_off, sinv, out=qx)
+        Y -= qx
+        # em is accumulated in expv
+        np.multiply(X, X, out=expv)
+        expv /= sx2
+        np.multiply(Y, Y, out=qx)
+        qx /= sy2
+        expv += qx
+        np.multiply(vt_off, vt_off, out=qx)
+        qx /= sv2
+        expv += qx
+        expv *= -K
+        np.exp(expv, out=expv)
+
+        np.multiply(expv, peak, out=self.model)
+        self.model += p[1]
+        np.subtract(self.val, self.model, out=self.res)
+
+        # If the residual at a pixel has not changed much since the previous
+        # call, reduce the weight associated with the pixel, unless the model
+        # value at this pixel has not changed much either. This is done only
+        # for a few iterations near the start, and only if the background has
+        # changed.
+        if (not self.fixback) and self.nf > 2 and self.nwm <= cfg['NWF']:
+            if self.bg != 0.0:
+                dbg = (p[1] - self.bg) / self.bg > 0.001
+            else:
+                dbg = (p[1] != 0.0)
+            if dbg:
+                wf = self.wf
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    np.subtract(self.res, self.old_res, out=wf)
+                    wf /= self.res
+                    np.subtract(self.model, self.old_model, out=self.qy)
+                    self.qy /= self.model
+                    wf /= self.qy
+                np.abs(wf, out=wf)
+                wf[np.isnan(wf)] = 1.0
+                np.clip(wf, cfg['MINWF'], cfg['MAXWF'], out=wf)
+                self.we *= wf
+                np.minimum(self.we, 1.0, out=self.we)
+                self.nwm += 1
+        self.old_model[:] = self.model
+        self.old_res[:] = self.res
+        self.bg = p[1]
+        self.nf += 1
+
+        # Residuals are scaled so the fitted intensity stays below the observed
+        # intensity (the "s0.exp( Yi_fit - Yi )" term of Stutzki & Gusten).
+        wres = self.wres
+        np.multiply(self.we, self.res, out=wres)
+        wres[self.res <= 0.0] *= s0 + 1
+        wsum = self.we.sum()
+
+        off = (xm_off * xm_off + ym_off * ym_off) / self.bfsq + vm_off * vm_off / self.velsq
+        chi2 = wres.dot(self.res) / wsum
+        chi2 += sa * pdiff * pdiff + 4 * sc * off + sb * back_term * back_term
+
+        # Gradient of the model w.r.t. the geometric parameters is always
+        # peak*expv times a combination of X/sx2, Y/sy2 and vt_off/sv2, so
+        # only a few weighted sums are needed.
+        swe = wres.dot(expv)
+        qy, qv = self.qy, self.qv
+        np.multiply(wres, expv, out=qv)
+        qv *= peak
+        sq = qv.sum()
+        np.multiply(qv, X, out=qx)
+        qx /= sx2
+        np.multiply(qv, Y, out=qy)
+        qy /= sy2
+        qv *= vt_off
+        qv /= sv2
+        sx = qx.sum()
+        sy = qy.sum()
+        sv = qv.sum()
+
+        jaco = np.empty(11)
+        jaco[0] = peakfactor * swe
+        jaco[1] = wres.sum()
+        jaco[2] = 2 * K * (cosv * sx - sinv * sy - p[9] * sv)
+        jaco[3] = 2 * K * p[3] * qx.dot(X) / sx2 + f3 * sq
+        jaco[4] = 2 * K * (sinv * sx + cosv * sy - p[10] * sv)
+        jaco[5] = 2 * K * p[5] * qy.dot(Y) / sy2 + f5 * sq
+        jaco[6] = -2 * K * (qx.dot(Y) - qy.dot(X))
+        jaco[7] = 2 * K * sv
+        jaco[8] = 2 * K * p[8] * qv.dot(vt_off) / sv2 + f8 * sq
+        jaco[9] = 2 * K * qv.dot(x_off)
+        jaco[10] = 2 * K * qv.dot(y_off)
+        jaco *= -2.0 / wsum
+
+        # Stiffness terms
+        jaco[0] += 2 * sa * pdiff * peakfactor
+        jaco[1] += 2 * sa * pdiff + 2 * sb * back_term
+        jaco[2] += 8 * sc * xm_off / self.bfsq
+        jaco[3] += 2 * sa * pdiff * f3 * peak
+        jaco[4] += 8 * sc * ym_off / self.bfsq
+        jaco[5] += 2 * sa * pdiff * f5 * peak
+        jaco[7] += 8 * sc * vm_off / self.velsq
+        jaco[8] += 2 * sa * pdiff * f8 * peak
+        if self.fixback:
+            jaco = np.delete(jaco, 1)
+        self.last = (chi2, jaco)
+        return self.last
+
+    def fit(self):
+        """ Minimize the chi-square starting from the initial guess """
+        x0 = np.delete(self.guess, 1) if self.fixback else self.guess.copy()
+        ret = minimize(self.evaluate, x0, jac=True, method='BFGS',
+                       options={'maxiter': self.config['MAXNF']})
+        xopt = self._full(ret.x)
+        if np.array_equal(xopt, self.guess) or not np.all(np.isfinite(xopt)):
+            return None
+        return xopt
+
+
+def _prepare_clump(residual, imax, valmax, config):
+    # Initial guess and fitting box for the clump at the peak imax.
+    guess, cval, fobs, fixback = _initial_guess(residual, imax, valmax, config)
+    lb, ub = _fit_window(residual.shape, cval, fobs, config)
+    return guess, cval, fobs, fixback, lb, ub
+
+
+def _fit_box(box, lb, ub, guess, cval, fobs, fixback, valmax, config):
+    # Fit a single clump to the residuals box (lb to ub). Returns the
+    # parameters in RMS units, or None if the fit failed.
+    rms = config['RMS']
+
+    # Store the data normalised to the RMS noise level, and the Gaussian
+    # weight of each pixel, keeping only the pixels with non-zero weight.
+    box = box.ravel()
+    feat = _box_features(lb, ub)
+    wwidth = config['WWIDTH']
+    we = np.zeros(box.size)
+    for i in range(3):
+        w_off = (feat[i] - cval[i]) / (fobs[i] * wwidth)
+        we += w_off * w_off
+    we = np.exp(-K * we)
+    valid = (we >= config['WMIN']) & ~np.isnan(box)
+    if not valid.any():
+        return None
+
+    guess = guess.copy()
+    guess[0] /= rms
+    guess[1] /= rms
+    # Do the correction of the peak for the instrumental smoothing.
+    t = guess[3] * guess[3]
+    peakfactor = t / (config['FWHMBEAM'] ** 2 + t)
+    t = guess[5] * guess[5]
+    peakfactor *= t / (config['FWHMBEAM'] ** 2 + t)
+    t = guess[8] * guess[8]
+    peakfactor *= t / (config['VELORES'] ** 2 + t)
+    if peakfactor > 0.0:
+        guess[0] /= np.sqrt(peakfactor)
+
+    cf = _ClumpFit(box[valid] / rms, feat[:, valid], we[valid], guess, cval, valmax / rms, fixback, config)
+    return cf.fit()
+
+
+def _fit_clump(residual, imax, valmax, config):
+    # Fit a single clump around the peak imax of the residual cube. Returns
+    # the parameters (in RMS units) and the fitted box bounds.
+    guess, cval, fobs, fixback, lb, ub = _prepare_clump(residual, imax, valmax, config)
+    box = residual[lb[0]:ub[0], lb[1]:ub[1], lb[2]:ub[2]]
+    return _fit_box(box, lb, ub, guess, cval, fobs, fixback, valmax, config), lb, ub
+
+
+def _independent_peaks(residual, config, nmax):
+    # Select up to nmax local maxima of the residuals, in decreasing order,
+    # whose fitting boxes do not overlap. The first one is always the global
+    # maximum, so a batch of one is a sequential iteration.
+    work = np.where(np.isnan(residual), -np.inf, residual)
+    local = (work == maximum_filter(work, size=3)) & np.isfinite(work)
+    cand = np.flatnonzero(local)
+    cand = cand[np.argsort(work.flat[cand])[::-1]]
+    batch = []
+    lbs = np.empty((0, 3), dtype=int)
+    ubs = np.empty((0, 3), dtype=int)
+    # Do not scan the whole list of maxima when the cube is crowded
+    for idx in cand[:8 * nmax]:
+        imax = np.unravel_index(idx, residual.shape)
+        valmax = residual[imax]
+        prep = _prepare_clump(residual, imax, valmax, config)
+        lb, ub = prep[4], prep[5]
+        if np.all((lb < ubs) & (lbs < ub), axis=1).any():
+            continue
+        batch.append((imax, valmax, prep))
+        lbs = np.vstack((lbs, lb))
+        ubs = np.vstack((ubs, ub))
+        if len(batch) == nmax:
+            break
+    return batch
+
+
+class GaussClumps(Algorithm):
+    """
+    Gaussian Clumps:
+
+    Decompose a data cube into gaussian clumps, fitting a gaussian to the
+    highest remaining peak and removing it from the residuals at each
+    iteration (Stutzki & Gusten, 1990, based on the CUPID implementation).
+
+    Parameters
+    ----------
+    params : dict (default = None)
+        Algorithm parameters, allowed keys:
+
+        FWHMBEAM : float (default = 2.0)
+            Beam resolution in pixels.
+        VELORES : float (default = 2.0)
+            Spectral resolution in pixels.
+        RMS : float (default = None)
+            Noise level. If not given it is estimated with :func:`acalib.core.rms`.
+        MAXSKIP : int (default = 10)
+            Maximum allowed number of failed fits between succesful fits.
+        MAXCLUMPS : int (default = sys.maxsize)
+            Maximum number of clumps.
+        NPAD : int (default = 10)
+            Stop when NPAD consecutive clumps are below THRESH or MINPIX.
+        THRESH : float (default = 2.0)
+            Lower threshold for clump peaks, as a multiple of the RMS.
+        MINPIX : int (default = 3)
+            Lower threshold for clump area in pixels.
+        MODELMIN : float (default = 0.5)
+            Lowest clump peak accepted, as a multiple of the RMS.
+        NSIGMA : float (default = 3.0)
+            Standard deviations at which to reject aberrant peaks...
+        NPEAKS : int (default = 9)
+            ...but only if at least NPEAKS peaks were found.
+        NWF, MINWF, MAXWF : (default = 10, 0.8, 1.1)
+            Control the modification of the weights done by the chi-square.
+        MAXNF : int (default = 100)
+            Maximum number of iterations of each clump fit.
+        SA, SB, S0, SC : float (default = 1.0, 0.1, 1.0, 1.0)
+            Chi-square stiffness parameters for the peak amplitude, the
+            background, the peak upper limit and the peak position.
+        WWIDTH : float (default = 2.0)
+            Ratio of the weighting function FWHM to the observed FWHM.
+        WMIN : float (default = 0.05)
+            Weight value considered as zero (it defines the fitting window).
+        WORKERS : int (default = 1)
+            Number of processes. If greater than one, peaks whose fitting
+            windows do not overlap are fitted concurrently, and all the fitted
+            models are subtracted afterwards. The catalog is equivalent (within
+            the fit tolerance) to the sequential one.
+        BATCH : int (default = 4*WORKERS)
+            Maximum number of clumps fitted per round in the parallel mode.
+
+    References
+    ----------
+    .. [1] Stutzki, J., & Gusten, R. (1990). High spatial resolution isotopic CO and CS observations of M17 SW-The clumpy structure of the molecular cloud core. The Astrophysical Journal, 356, 513-533.
+    """
+
+    def default_params(self):
+        defaults = {'FWHMBEAM': 2.0, 'VELORES': 2.0, 'MAXSKIP': 10, 'MAXCLUMPS': sys.maxsize,
+                    'NPAD': 10, 'THRESH': 2.0, 'MINPIX': 3, 'MODELMIN': 0.5, 'NSIGMA': 3.0,
+                    'NPEAKS': 9, 'NWF': 10, 'MINWF': 0.8, 'MAXWF': 1.1, 'MAXNF': 100,
+                    'SA': 1.0, 'SB': 0.1, 'S0': 1.0, 'SC': 1.0, 'WWIDTH': 2.0, 'WMIN': 0.05,
+                    'WORKERS': 1, 'BATCH': None}
+        for key, value in defaults.items():
+            if key not in self.config:
+                self.config[key] = value
+
+    def run(self, data, verbose=False):
+        """
+            Run the GaussClumps algorithm on a given data cube.
+
+            Parameters
+            ----------
+            data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+                Astronomical data cube (FREQ,DEC,RA order).
+            verbose : bool (default = False)
+                Log the progress of the algorithm.
+
+            Returns
+            -------
+            The CAA (clump index of each pixel, 0 for background) and an
+            astropy.table.Table with the parameters of each clump.
+        """
+        wcs = None
+        unit = None
+        mask = None
+        if type(data) is NDData or type(data) is NDDataRef:
+            wcs = data.wcs
+            unit = data.unit
+            mask = data.mask
+            data = data.data
+        cube = np.array(data, dtype=np.float64)
+        while cube.ndim > 3 and cube.shape[0] == 1:
+            cube = cube[0]
+        if cube.ndim != 3:
+            log.error("Only 3D cubes supported")
+            raise ValueError("Only 3D cubes supported")
+        if mask is not None:
+            cube[np.broadcast_to(mask, data.shape).reshape(cube.shape)] = np.nan
+
+        config = dict(self.config)
+        if config.get('RMS') is None:
+            with self.span("rms"):
+                config['RMS'] = core.rms(np.nan_to_num(cube))
+        if config['WORKERS'] > 1:
+            caa, clist = _gaussclumps_batched(cube, config, verbose)
+        else:
+            caa, clist = _gaussclumps(cube, config, verbose)
+        if wcs:
+            caa = NDDataRef(caa, uncertainty=None, mask=None, wcs=wcs, meta=None, unit=unit)
+        return caa, clist
+
+
+class _Decomposition(object):
+    """
+    Book-keeping of the iterative decomposition: residuals, CAA, synthetic
+    cube and the stop criteria. The cube is modified in place to hold the
+    residuals, and masked pixels must be NaN.
+    """
+
+    def __init__(self, cube, config, verbose=False):
+        self.config = config
+        self.verbose = verbose
+        self.residual = cube
+        self.syn = np.zeros_like(cube)
+        self.caa = np.zeros(cube.shape, dtype=np.int32)
+
+        self.iclump = 0
+        self.peaks_below = 0
+        self.area_below = 0
+        # Mean and standard deviation of the most recent "npeaks" fitted peaks
+        self.sigma_peak = 0.0
+        self.new_peak = 0.0
+        self.sum_peak = 0.0
+        self.sum_peak2 = 0.0
+        self.peaks = np.zeros(config['NPEAKS'])
+        self.area = 0
+        self.nskip = 0
+        self.sumclumps = 0.0
+        self.sumdata = np.nansum(cube)
+        self.rows = []
+
+    def _info(self, msg):
+        if self.verbose:
+            log.info(msg)
+
+    def next_peak(self):
+        """ Position and value of the largest residual, or None """
+        try:
+            idx = np.nanargmax(self.residual)
+        except ValueError:
+            self._info("There are no good pixels left to be fitted.")
+            return None
+        imax = np.unravel_index(idx, self.residual.shape)
+        return imax, self.residual[imax]
+
+    def record(self, imax, clump, lb, ub):
+        """ Apply a fit result. Returns False when the decomposition ends """
+        cfg = self.config
+        npeaks = cfg['NPEAKS']
+        if clump is None:
+            # Set the peak bad so no other fit is attempted on it.
+            self.nskip += 1
+            self.residual[imax] = np.nan
+            self._info("No clump fitted (optimization failed). Ignoring Pixel...")
+            return self._skip_limit()
+
+        # Skip this fit if the peak value of the clump is a long way from the
+        # previously fitted peaks, or if it is less than the "mlim" value.
+        if not ((self.iclump < npeaks or np.abs(clump[0] - self.new_peak) < cfg['NSIGMA'] * self.sigma_peak)
+                and clump[0] > cfg['MODELMIN']):
+            self.residual[imax] = np.nan
+            self.new_peak = 0.5 * (self.new_peak + clump[0])
+            self.nskip += 1
+            self._info("Clump rejected due to aberrant peak value. Ignoring Pixel...")
+            return self._skip_limit()
+
+        self.peaks = np.roll(self.peaks, 1)
+        self.new_peak = clump[0]
+        old_peak = self.peaks[0]
+        self.peaks[0] = self.new_peak
+        self.sum_peak += self.new_peak - old_peak
+        self.sum_peak2 = max(self.sum_peak2 + self.new_peak ** 2 - old_peak ** 2, 0.0)
+        mean_peak = self.sum_peak / npeaks
+        self.sigma_peak = np.sqrt(max(self.sum_peak2 / npeaks - mean_peak * mean_peak, 0.0))
+        self.iclump += 1
+        self.nskip = 0
+
+        if clump[0] >= cfg['THRESH']:
+            csum, self.area = self._subtract(clump, lb, ub)
+            self.sumclumps += csum
+            row = clump.copy()
+            row[0] *= cfg['RMS']
+            row[1] *= cfg['RMS']
+            self.rows.append(row)
+            self.peaks_below = 0
+        else:
+            self.residual[imax] = np.nan
+            self.peaks_below += 1
+
+        if self.area < cfg['MINPIX']:
+            self.area_below += 1
+        else:
+            self.area_below = 0
+
+        if self.iclump == cfg['MAXCLUMPS']:
+            self._info("The specified maximum number of clumps (" + str(cfg['MAXCLUMPS']) + ") have been found.")
+            return False
+        elif self.sumclumps >= self.sumdata:
+            self._info("The total data sum of the fitted Gaussians has reached the total data sum.")
+            return False
+        elif self.peaks_below == cfg['NPAD']:
+            self._info("The previous " + str(cfg['NPAD']) + " clumps all had peak values below the threshold.")
+            return False
+        elif self.area_below == cfg['NPAD']:
+            self._info("The previous " + str(cfg['NPAD']) + " clumps all had areas below the threshold.")
+            return False
+        return True
+
+    def _skip_limit(self):
+        if self.nskip > self.config['MAXSKIP']:
+            self._info("The previous " + str(self.config['MAXSKIP']) + " fits were unusable.")
+            return False
+        return True
+
+    def _subtract(self, clump, lb, ub):
+        # Remove the model fit (excluding the background) from the residuals,
+        # and assign to the clump the pixels where it dominates the model.
+        rms = self.config['RMS']
+        box = tuple(slice(lb[i], ub[i]) for i in range(3))
+        ff = clump_model(clump, _box_features(lb, ub), self.config) * rms
+        ff = ff.reshape(ub - lb)
+        self.residual[box] -= ff
+        significant = ff >= rms
+        caabox = self.caa[box]
+        caabox[significant & (self.syn[box] < ff)] = len(self.rows) + 1
+        self.syn[box] += ff
+        return ff.sum(), significant.sum()
+
+    def catalog(self):
+        """ Table with the accepted clumps parameters """
+        self._info("GaussClumps finished normally, " + str(len(self.rows)) + " clumps found")
+        return Table(rows=self.rows if self.rows else None, names=CATALOG_NAMES, dtype=('f8',) * 11)
+
+
+def _gaussclumps(cube, config, verbose=False):
+    # Sequential decomposition: fit the largest remaining peak in the
+    # residuals and remove it, one clump at a time.
+    dec = _Decomposition(cube, config, verbose)
+    while True:
+        peak = dec.next_peak()
+        if peak is None:
+            break
+        imax, valmax = peak
+        with span("GaussClumps.fit"):
+            clump, lb, ub = _fit_clump(dec.residual, imax, valmax, config)
+        if not dec.record(imax, clump, lb, ub):
+            break
+    return dec.caa, dec.catalog()
+
+
+def _fit_shared(residual, lb, ub, *args):
+    # Fit in a worker process, reading the box from the shared residuals
+    box = residual.data[lb[0]:ub[0], lb[1]:ub[1], lb[2]:ub[2]]
+    return _fit_box(box, lb, ub, *args)
+
+
+def _gaussclumps_batched(cube, config, verbose=False):
+    # Batched decomposition: each round fits, in a process pool, a set of
+    # peaks whose fitting boxes do not overlap (so they do not interact), and
+    # then records the results in decreasing peak order as the sequential
+    # version would do. The residuals live in shared memory, so the workers
+    # read their boxes without copying them through the pool; a box is only
+    # written (by record) once its own fit has finished.
+    workers = config['WORKERS']
+    nmax = config['BATCH'] if config['BATCH'] else 4 * workers
+    with core.SharedCube(cube, writable=True) as residual, ProcessPoolExecutor(max_workers=workers) as pool:
+        dec = _Decomposition(residual.data, config, verbose)
+        running = True
+        while running:
+            with span("GaussClumps.independent_peaks"):
+                batch = _independent_peaks(dec.residual, config, nmax)
+            if not batch:
+                dec._info("There are no good pixels left to be fitted.")
+                break
+            dec._info("Fitting a batch of " + str(len(batch)) + " clumps")
+            futures = []
+            for imax, valmax, (guess, cval, fobs, fixback, lb, ub) in batch:
+                futures.append(pool.submit(_fit_shared, residual, lb, ub, guess, cval, fobs, fixback, valmax, config))
+            with span("GaussClumps.fit_batch", clumps=len(batch)):
+                for (imax, valmax, prep), future in zip(batch, futures):
+                    if running:
+                        running = dec.record(imax, future.result(), prep[4], prep[5])
+                    else:
+                        future.cancel()
+    return dec.caa, dec.catalog()
@@ -80,7 +80,8 @@ class GMS(Algorithm):
         image = image.astype('float64')
 
         #Getting optimal radius for first step segmentation
-        w_max = _optimal_w(image, prob)
+        with self.span("optimal_w"):
+            w_max = _optimal_w(image, prob)
 
         diff = (image - np.min(image)) / (np.max(image) - np.min(image))
 
@@ -89,7 +90,8 @@ class GMS(Algorithm):
         # Initial segmentation
         if tt % 2 == 0:
             tt += 1
-        adaptive_threshold = threshold_local(diff, int(tt), method='mean', offset=0)#(diff, int(tt), offset=0)
+        with self.span("threshold_local", window=int(tt)):
+            adaptive_threshold = threshold_local(diff, int(tt), method='mean', offset=0)#(diff, int(tt), offset=0)
         g = diff > adaptive_threshold
 
         r = w_max / 2
@@ -105,11 +107,12 @@ class GMS(Algorithm):
             #Label the previous segmentation
             #calculate shape features for each 
             #connected region.
-            selem = disk(r)
-            sub = binary_opening(g, selem)
-            sub = clear_border(sub)
-            sub = label(sub)
-            fts = regionprops(sub)
+            with self.span("segmentation", radius=float(r)):
+                selem = disk(r)
+                sub = binary_opening(g, selem)
+                sub = clear_border(sub)
+                sub = label(sub)
+                fts = regionprops(sub)
 
             #image_list.append(NDData(sub, wcs=wcs))
             # Non NNData version (without wcs... lets check if it pass)
@@ -137,7 +140,8 @@ class GMS(Algorithm):
             tt = int(r * r)
             if tt % 2 == 0:
                 tt += 1
-            adaptive_threshold = threshold_local(diff, tt, offset=0, method='mean')
+            with self.span("threshold_local", window=tt):
+                adaptive_threshold = threshold_local(diff, tt, offset=0, method='mean')
             g = diff > adaptive_threshold
 
             r = np.round(r / 2.)
@@ -72,11 +72,13 @@ class Indexing(Algorithm):
         gms = GMS(params)
 
 
-        spectra, slices = acalib.core.spectra_sketch(data, self.config["SAMPLES"], self.config["RANDOM_STATE"])
+        with self.span("spectra_sketch"):
+            spectra, slices = acalib.core.spectra_sketch(data, self.config["SAMPLES"], self.config["RANDOM_STATE"])
 
-        pp_slices = []
-        for slice in slices:
-            pp_slice = acalib.core.vel_stacking(cube, slice)
+        # all the stacked images with a single pass over the cube
+        with self.span("vel_stacking", ranges=len(slices)):
+            pp_slices = acalib.core.vel_stacking(cube, slices)
+        for slice, pp_slice in zip(slices, pp_slices):
             labeled_images = gms.run(pp_slice)
 
             if wcs is not None:
@@ -86,7 +88,8 @@ class Indexing(Algorithm):
                 freq_min = None
                 freq_max = None
 
-            table = acalib.core.measure_shape(pp_slice, labeled_images, freq_min, freq_max)
+            with self.span("measure_shape"):
+                table = acalib.core.analysis._measure_shape(pp_slice, labeled_images, freq_min, freq_max)
             if len(table) > 0:
                 c.append(ROI(cube_slice=pp_slice, segmented_images=labeled_images,table=table))
 
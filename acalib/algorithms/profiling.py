@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class _NullSpan(object):
+    # Shared no-op context manager returned by span() when no collector is active
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_collector = None
+
+
+class _Span(object):
+
+    def __init__(self, collector, name, args):
+        self.collector = collector
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.collector._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.collector._exit(self)
+        return False
+
+
+def span(name, **args):
+    """
+        Context manager that measures a stage of an algorithm.
+
+        The stage is recorded by the active :class:`Collector`; without one it is a
+        shared no-op object, so instrumented code costs a function call per stage.
+
+        Parameters
+        ----------
+        name : str
+            Stage name, e.g. ``"Indexing.spectra_sketch"``.
+        **args :
+            Extra values stored with the record (e.g. sizes).
+
+        Examples
+        --------
+        >>> with span("GMS.threshold_local", window=tt):
+        ...     adaptive_threshold = threshold_local(diff, tt)
+    """
+    if _collector is None:
+        return _NULL_SPAN
+    return _Span(_collector, name, args)
+
+
+class Collector(object):
+    """
+    Opt-in recorder of the stages (spans) of the algorithms.
+
+    For each span it records the wall and CPU (process) time and, if *memory*
+    is set, the high-water mark of the memory allocated while it ran (through
+    tracemalloc, which slows the code down). Spans can be nested; the memory
+    of nested spans is only meaningful when they run in a single thread.
+
+    Parameters
+    ----------
+    memory : bool (default = False)
+        Record the allocation high-water of each span.
+
+    Examples
+    --------
+    >>> with Collector(memory=True) as prof:
+    ...     Indexing().run(cube)
+    >>> prof.summary()
+    >>> prof.save_chrome_trace("indexing.json")
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self._local = threading.local()
+        self._previous = None
+        self._tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        """ Make this collector the active one. """
+        global _collector
+        self._previous = _collector
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._t0 = time.perf_counter()
+        _collector = self
+        return self
+
+    def stop(self):
+        """ Stop recording, restoring the previously active collector. """
+        global _collector
+        _collector = self._previous
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, sp):
+        stack = self._stack()
+        if self.memory:
+            size, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # keep the high-water of the enclosing span before resetting it
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            sp.size = sp.peak = size
+        sp.depth = len(stack)
+        stack.append(sp)
+        sp.cpu = time.process_time()
+        sp.start = time.perf_counter()
+
+    def _exit(self, sp):
+        end = time.perf_counter()
+        cpu = time.process_time()
+        stack = self._stack()
+        stack.pop()
+        record = {'name': sp.name, 'start': sp.start - self._t0, 'wall': end - sp.start,
+                  'cpu': cpu - sp.cpu, 'depth': sp.depth, 'thread': threading.get_ident()}
+        if self.memory:
+            peak = max(sp.peak, tracemalloc.get_traced_memory()[1])
+            record['peak'] = peak - sp.size
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+        if sp.args:
+            record['args'] = sp.args
+        self.records.append(record)
+
+    def summary(self):
+        """
+            Aggregate the records by stage name.
+
+            Returns
+            -------
+            result : dict
+                Stage name to a dict with the number of calls and the total wall and
+                CPU time (s), and the largest allocation high-water (bytes) if recorded.
+        """
+        result = {}
+        for rec in self.records:
+            item = result.setdefault(rec['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            item['calls'] += 1
+            item['wall'] += rec['wall']
+            item['cpu'] += rec['cpu']
+            if 'peak' in rec:
+                item['peak'] = max(item.get('peak', 0), rec['peak'])
+        return result
+
+    def to_json(self):
+        """ Records and summary as a JSON string. """
+        return json.dumps({'records': self.records, 'summary': self.summary()}, indent=2, default=str)
+
+    def save_json(self, path):
+        """ Write :meth:`to_json` to *path*. """
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    def chrome_trace(self):
+        """
+            Records in the Chrome trace event format (chrome://tracing, Perfetto).
+
+            Returns
+            -------
+            result : dict
+                Trace with one complete ("X") event per span, times in microseconds.
+        """
+        pid = os.getpid()
+        events = []
+        for rec in self.records:
+            args = {'cpu_ms': 1e3 * rec['cpu']}
+            if 'peak' in rec:
+                args['peak_bytes'] = rec['peak']
+            args.update(rec.get('args', {}))
+            events.append({'name': rec['name'], 'cat': 'acalib', 'ph': 'X', 'pid': pid, 'tid': rec['thread'],
+                           'ts': 1e6 * rec['start'], 'dur': 1e6 * rec['wall'], 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        """ Write :meth:`chrome_trace` to *path*. """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
@@ -1,56 +1,156 @@
 import acalib
+import numpy as np
 from .algorithm import Algorithm
 
-from numpy import mean
-from scipy.stats import signaltonoise
-import scipy.ndimage as scnd
-from astropy.nddata import NDData,NDDataRef
+from astropy import log
+
+from astropy.nddata import NDData
 
 class Stacking(Algorithm):
     """
     Create a stacked image using a template image and a set of different images from same object.
     """
+    # run() leaves the stack in the instance, for partial_fit
+    cacheable = False
 
     def default_params(self):
-        pass
+        if 'ORDER' not in self.config:
+            self.config['ORDER'] = 3
+        if 'VARIANCE' not in self.config:
+            self.config['VARIANCE'] = False
 
-    def run(self, template_data, images):
+    def set_template(self, template_data, props=None):
         """
-            Run the stacking algorithm given a template image and a container of images.
+            Set the template image and reset the stack.
 
             Parameters
             ----------
-            template_data : (M,N) numpy.ndarray
+            template_data : (M,N) numpy.ndarray or astropy.nddata.NDData
                 Astronomical image.
-            images : list of (M,N) numpy.ndarray
-                A list of images.
+            props : dict (default = None)
+                Properties of the template (see :func:`acalib.core.transform.fits_props`), if already computed.
+        """
+        if isinstance(template_data, NDData):
+            template_data = template_data.data
+
+        if props is None:
+            props = acalib.core.transform.fits_props(template_data)
+        self.template_props = props
+        shape = template_data.shape
+        self.count = 0
+        self._mean = np.zeros(shape)
+        self._weight = np.zeros(shape)
+        self._m2 = np.zeros(shape) if self.config['VARIANCE'] else None
+        self._buffer = np.empty(shape)
+        self._coverage = np.empty(shape)
+
+    def partial_fit(self, image, props=None):
+        """
+            Add one image to the stack.
+
+            The image is resampled over the template and accumulated in a running (weighted)
+            mean, so images can be streamed from a generator or a list of files.
+
+            Parameters
+            ----------
+            image : (M,N) numpy.ndarray, astropy.nddata.NDData or str
+                Astronomical image, or path to a FITS file.
+            props : dict (default = None)
+                Properties of the image (see :func:`acalib.core.transform.fits_props`), if already computed.
 
             Returns
             -------
-            result : (M,N) numpy.ndarray
-                Image stacked
+            self : Stacking
         """
-        if type(template_data) is NDData or type(template_data) is NDDataRef:
-            template_data = template_data.data
+        if getattr(self, 'template_props', None) is None:
+            log.error("Template not set, call set_template first")
+            raise ValueError("Template not set, call set_template first")
+
+        if isinstance(image, str):
+            from acalib.io import loadFITS_PrimaryOnly
+            image = loadFITS_PrimaryOnly(image)
+        if isinstance(image, NDData):
+            image = image.data
 
-        for i in range(len(images)):
-            if type(images[i]) is not NDData or type(images[i]) is not NDDataRef:
-                images[i] = NDDataRef(images[i])
+        prop = props
+        if prop is None:
+            with self.span("fits_props"):
+                prop = acalib.core.transform.fits_props(image)
+        order = self.config['ORDER']
+        with self.span("affine_resample"):
+            value = acalib.core.transform.affine_resample(image, prop, self.template_props,
+                                                          order=order, output=self._buffer)
+            # pixels of the template covered by the image
+            weight = acalib.core.transform.affine_resample(np.ones(image.shape), prop, self.template_props,
+                                                           order=0, output=self._coverage)
 
-        tprops = acalib.core.transform.fits_props(template_data)
+        # weighted incremental mean and variance (West, 1979)
+        self._weight += weight
+        delta = value - self._mean
+        rate = np.zeros(weight.shape)
+        np.divide(weight, self._weight, out=rate, where=self._weight > 0)
+        self._mean += rate * delta
+        if self._m2 is not None:
+            self._m2 += weight * (1 - rate) * delta * delta
+        self.count += 1
+        return self
 
-        # TODO: Replace with core.transform.scale once it stops using
-        # a acalib.container.
-        majorAxisTemplate = tprops['major']
-        scaledData = []
-        for i in range(len(images)):
-            prop = acalib.core.transform.fits_props(images[i].data)
-            sc = majorAxisTemplate / prop['major']
-            scaledData.append(scnd.zoom(prop['orig'], sc))
-        scaled = scaledData
+    update = partial_fit
 
-        rotated, angles = acalib.core.transform.rotate(scaled, tprops['angle'])
-        aligned = acalib.core.transform.crop_and_align(rotated, angles)
-        result = mean(aligned,axis=0)
+    def stacked(self):
+        """
+            Current stacked image.
+
+            Returns
+            -------
+            result : tuple
+                The (M,N) stacked image and the (M,N) weight map (number of images covering each pixel).
+        """
+        return self._mean.copy(), self._weight.copy()
 
+    def variance(self):
+        """
+            Current variance of the stacked images (requires the *VARIANCE* parameter).
+
+            Returns
+            -------
+            result : (M,N) numpy.ndarray
+                Per-pixel variance of the images covering each pixel.
+        """
+        if self._m2 is None:
+            log.error("Variance not computed, set the VARIANCE parameter")
+            raise ValueError("Variance not computed, set the VARIANCE parameter")
+        result = np.zeros(self._m2.shape)
+        np.divide(self._m2, self._weight, out=result, where=self._weight > 0)
         return result
+
+    def run(self, template_data, images):
+        """
+            Run the stacking algorithm given a template image and a container of images.
+
+            Parameters
+            ----------
+            template_data : (M,N) numpy.ndarray
+                Astronomical image.
+            images : iterable of (M,N) numpy.ndarray
+                A list (or generator) of images. The properties of the images of a list are
+                computed in a single batch with the template; a generator is streamed.
+
+            Returns
+            -------
+            result : (M,N) numpy.ndarray
+                Image stacked, with the shape of the template.
+        """
+        if isinstance(images, (list, tuple)) and not any(isinstance(image, str) for image in images):
+            images = [image.data if isinstance(image, NDData) else image for image in images]
+            template = template_data.data if isinstance(template_data, NDData) else template_data
+            with self.span("fits_props_batch"):
+                props = acalib.core.transform.fits_props_batch([template] + images)
+            self.set_template(template, props=props[0])
+            for image, prop in zip(images, props[1:]):
+                self.partial_fit(image, props=prop)
+        else:
+            self.set_template(template_data)
+            for image in images:
+                self.partial_fit(image)
+        return self.stacked()[0]
@@ -2,3 +2,4 @@ from .analysis import *
 from .models import *
 from .utils import *
 from .transform import *
+from .shared import *
@@ -8,7 +8,7 @@ from ._morph import differenceImpl, segmentationImpl, erosionImpl
 
 from astropy.table import Table
 
-from .utils import fix_mask, slab
+from .utils import fix_mask, slab, is_dask, da
 from acalib.core import *
 
 def rms(data, mask=None):
@@ -17,14 +17,14 @@ def rms(data, mask=None):
 
     Parameters
     ----------
-    data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData or or astropy.nddata.NDDataRef
+    data : (M,N,Z) numpy.ndarray, dask.array.Array or astropy.nddata.NDData or or astropy.nddata.NDDataRef
         Astronomical data cube.
 
     mask : numpy.ndarray (default = None)
 
     Returns
     -------
-    RMS of the data (float)
+    RMS of the data (float, or a lazy dask scalar for a dask array)
     """
     # TODO: check photutils background estimation for using that if possible
     if mask is not None:
@@ -82,29 +82,119 @@ def snr_estimation(data, mask=None, noise=None, points=1000, full_output=False):
     return snrlimit
 
 
-def integrate(data, mask=None, axis=(0)):
+# Size (in float64 bytes) of the blocks of channels read at once
+_CHUNK_BYTES = 2 ** 25
+
+
+def _channel_blocks(data, start=0, stop=None, chunk=None):
+    # Blocks of contiguous channels (planes of the first axis) converted to
+    # float64, read sequentially so memory-mapped cubes are streamed.
+    if stop is None:
+        stop = data.shape[0]
+    if chunk is None:
+        plane = int(np.prod(data.shape[1:])) * np.dtype(np.float64).itemsize
+        chunk = max(1, _CHUNK_BYTES // max(plane, 1))
+    for first in range(start, stop, chunk):
+        last = min(first + chunk, stop)
+        yield first, last, np.asarray(data[first:last], dtype=np.float64)
+
+
+def _stack_ranges(data, ranges, chunk=None):
+    # Sum of the channels of each (start, stop) range, with one pass over the
+    # channels covered by the ranges. The channels are split in segments by
+    # all the range limits, each block is reduced per segment with
+    # np.add.reduceat, and each range is the sum of its segments.
+    stacked = np.zeros((len(ranges),) + data.shape[1:])
+    used = [(start, stop) for start, stop in ranges if start < stop]
+    if len(used) == 0:
+        return stacked
+    bounds = np.unique(np.array(used).ravel())
+    segments = np.zeros((bounds.size - 1,) + data.shape[1:])
+    for first, last, block in _channel_blocks(data, bounds[0], bounds[-1], chunk):
+        local = np.clip(bounds, first, last) - first
+        nonempty = np.flatnonzero(local[:-1] < local[1:])
+        segments[nonempty] += np.add.reduceat(block, local[nonempty], axis=0)
+    for k, (start, stop) in enumerate(ranges):
+        if start < stop:
+            stacked[k] = segments[np.searchsorted(bounds, start):np.searchsorted(bounds, stop)].sum(axis=0)
+    return stacked
+
+
+def integrate(data, mask=None, axis=(0), chunk=None):
     """
     Sums the slices of a cube of data given an axis.
 
+    The cube is read by blocks of channels (first axis) and accumulated in float64, so
+    memory-mapped cubes are not loaded at once. Dask arrays are reduced lazily, chunk by
+    chunk, and the result is a dask array.
+
     Parameters
     ----------
-    data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+    data : (M,N,Z) numpy.ndarray, dask.array.Array or astropy.nddata.NDData or astropy.nddata.NDDataRef
         Astronomical data cube.
 
     mask : numpy.ndarray (default = None)
 
     axis : int (default=(0))
 
+    chunk : int (default = None)
+        Number of channels read at once (by default, blocks of about 32MB).
+
     Returns
     -------
      A numpy array with the integration results.
 
     """
+    if is_dask(data):
+        return _integrate_dask(data, mask, axis)
+    if isinstance(data, np.ma.MaskedArray):
+        # the mask of the array is combined with the given one, as fix_mask does
+        own = np.ma.getmaskarray(data)
+        mask = own if mask is None else own | mask
+        data = data.data
+    if data.ndim == 0 or data.shape[0] == 0:
+        if mask is not None:
+            data = fix_mask(data, mask)
+        return np.sum(data, axis=axis)
+
+    axes = tuple(sorted(set(a % data.ndim for a in np.atleast_1d(axis))))
     if mask is not None:
-        data = fix_mask(data, mask)
-    newdata = np.sum(data, axis=axis)
-    mask = np.isnan(newdata)
-    return newdata
+        mask = np.broadcast_to(mask, data.shape)
+    total = None
+    count = None
+    parts = []
+    counts = []
+    for first, last, block in _channel_blocks(data, chunk=chunk):
+        if mask is not None:
+            valid = ~mask[first:last]
+            bsum = np.sum(np.where(valid, block, 0.0), axis=axes)
+            bcount = np.sum(valid, axis=axes)
+        else:
+            bsum = np.sum(block, axis=axes)
+            bcount = None
+        if 0 in axes:
+            total = bsum if total is None else total + bsum
+            if bcount is not None:
+                count = bcount if count is None else count + bcount
+        else:
+            parts.append(bsum)
+            counts.append(bcount)
+    if 0 not in axes:
+        total = np.concatenate(parts)
+        if mask is not None:
+            count = np.concatenate(counts)
+    if mask is not None:
+        return np.ma.MaskedArray(total, mask=(count == 0))
+    return total
+
+
+def _integrate_dask(data, mask, axis):
+    # Lazy version of integrate, masked where every summed value is masked
+    if mask is None:
+        return da.sum(data, axis=axis, dtype=np.float64)
+    valid = ~da.broadcast_to(da.asarray(mask), data.shape)
+    total = da.sum(da.where(valid, data, 0.0), axis=axis, dtype=np.float64)
+    return da.ma.masked_array(total, mask=~da.any(valid, axis=axis))
 
 
 def get_shape(data, intensity_image, wcs=None):
@@ -139,6 +229,11 @@ def get_shape(data, intensity_image, wcs=None):
 def measure_shape(data, labeled_images, min_freq=None, max_freq=None, wcs=None):
     """ Measure a few statistics from labeled images """
     # TODO: Document this function
+    return _measure_shape(data, labeled_images, min_freq, max_freq)
+
+
+def _measure_shape(data, labeled_images, min_freq=None, max_freq=None):
+    # Kernel of measure_shape, for internal callers (Indexing, once per slice) with plain arrays
     objects = list()
     intensity_image = data
     for image in labeled_images:
@@ -248,12 +343,16 @@ def index_mesh(data, lower=None, upper=None):
 
 def index_features(data, lower=None, upper=None):
     """ Creates an array with indices in features format """
-    msh = index_mesh(data, lower, upper)
+    sl = slab(data, lower, upper)
     dim = data.ndim
-    ii = np.empty((dim, int(msh.size / dim)))
+    shape = tuple(s.stop - s.start for s in sl)
+    ii = np.empty((dim,) + shape)
     for i in range(dim):
-        ii[dim - i - 1] = msh[i].ravel()
-    return ii
+        # broadcast each axis instead of building the full mesh
+        view = [1] * dim
+        view[i] = shape[i]
+        ii[dim - i - 1] = np.arange(sl[i].start, sl[i].stop).reshape(view)
+    return ii.reshape(dim, -1)
 
 def _optimal_w(image, p=0.05):
     # Calculate the optimal window size for the image segmentation given a quantile.
@@ -370,34 +469,104 @@ def _kernel_shift(back, kernel, x, y):
     return back
 
 
+def _label_ranges(labels):
+    # Runs of consecutive channels with the same (non-negative) label
+    labels = np.asarray(labels)
+    change = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    stops = np.concatenate((change, [labels.size]))
+    keep = labels[starts] >= 0
+    return list(zip(starts[keep], stops[keep])), labels[starts[keep]]
+
+
 # TODO: This is non-generic, uses the axis=0!
 @support_nddata
-def vel_stacking(data,data_slice,wcs=None,uncertainty=None, mask=None, meta=None, unit=None):
+def vel_stacking(data,data_slice,wcs=None,uncertainty=None, mask=None, meta=None, unit=None, chunk=None):
     """
     Create an image collapsing the frecuency axis
 
+    The channels are read by contiguous blocks and accumulated in float64. Many images can be
+    created with a single pass over the channels, from a list of slices or from a label per channel.
+    Dask cubes are collapsed lazily, and the images are dask arrays.
+
     Parameters
     ----------
-    data : numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+    data : numpy.ndarray, dask.array.Array or astropy.nddata.NDData or astropy.nddata.NDDataRef
         Astronomical 2D image
 
-    slice : slice object
-        Sector to be collapsed
+    slice : slice object, list of slice objects, numpy.ndarray or any channel selector
+        Sector to be collapsed, list of sectors, or label of each channel (channels with the same
+        non-negative label are collapsed together, negative labels are ignored). An integer
+        numpy.ndarray with one value per channel is always read as labels, not as channel
+        indices. Any other selector of the first axis (a channel, a list of channels or a
+        boolean mask) gives a single image.
+
+    chunk : int (default = None)
+        Number of channels read at once (by default, blocks of about 32MB).
 
     Returns
     -------
-    image (NDDataRef): 2D-Array with the stacked cube.
+    image (NDDataRef): 2D-Array with the stacked cube (or a list of them, in the order of the
+    slices or of the sorted labels).
 
     """
     if len(data.shape) != 3:
         log.error("Cube needs to be a 3D array")
         raise ValueError("Cube needs to be a 3D array")
-    dims = data.shape
-    subcube = data[data_slice, :,:]
-    stacked = np.sum(subcube,axis=0)
     if wcs:
         wcs = wcs.dropaxis(2)
 
-        return NDDataRef(stacked, uncertainty=uncertainty, mask=mask,wcs=wcs, meta=meta, unit=unit)
-    else:
-        return stacked
\ No newline at end of file
+    def _image(stacked):
+        if wcs:
+            return NDDataRef(stacked, uncertainty=uncertainty, mask=mask,wcs=wcs, meta=meta, unit=unit)
+        return stacked
+
+    stack_ranges = _stack_ranges_dask if is_dask(data) else _stack_ranges
+    stack_slices = _stack_slices_dask if is_dask(data) else _stack_slices
+
+    if isinstance(data_slice, slice):
+        return _image(stack_slices(data, [data_slice], chunk)[0])
+
+    if isinstance(data_slice, list) and data_slice and all(isinstance(sl, slice) for sl in data_slice):
+        return [_image(img) for img in stack_slices(data, data_slice, chunk)]
+
+    if isinstance(data_slice, np.ndarray) and data_slice.dtype.kind in 'iu' and data_slice.shape == data.shape[:1]:
+        ranges, run_labels = _label_ranges(data_slice)
+        runs = stack_ranges(data, ranges, chunk)
+        names = np.unique(run_labels)
+        if is_dask(data):
+            return [_image(runs[np.flatnonzero(run_labels == name)].sum(axis=0)) for name in names]
+        stacked = np.zeros((names.size,) + data.shape[1:])
+        np.add.at(stacked, np.searchsorted(names, run_labels), runs)
+        return [_image(img) for img in stacked]
+
+    if np.ndim(data_slice) == 0 and not isinstance(data_slice, slice):
+        data_slice = [data_slice]
+    return _image(np.sum(data[data_slice, :, :], axis=0, dtype=np.float64))
+
+
+def _stack_slices(data, slices, chunk=None):
+    # Collapse each slice of channels, in one pass for the contiguous ones
+    stacked = np.zeros((len(slices),) + data.shape[1:])
+    ranges = []
+    for k, sl in enumerate(slices):
+        start, stop, step = sl.indices(data.shape[0])
+        if step == 1:
+            ranges.append((start, stop))
+        else:
+            ranges.append((0, 0))
+            stacked[k] = np.sum(data[sl, :, :], axis=0, dtype=np.float64)
+    stacked += _stack_ranges(data, ranges, chunk)
+    return stacked
+
+
+def _stack_ranges_dask(data, ranges, chunk=None):
+    # Lazy sum of the channels of each (start, stop) range
+    empty = da.zeros(data.shape[1:], chunks=data.chunksize[1:])
+    return da.stack([da.sum(data[start:stop], axis=0, dtype=np.float64) if start < stop else empty
+                     for start, stop in ranges])
+
+
+def _stack_slices_dask(data, slices, chunk=None):
+    # Lazy collapse of each slice of channels
+    return da.stack([da.sum(data[sl], axis=0, dtype=np.float64) for sl in slices])
@@ -0,0 +1,210 @@
+import os
+import tempfile
+import weakref
+
+import numpy as np
+from astropy import log
+from astropy.nddata import NDData
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+else:
+    class _Segment(shared_memory.SharedMemory):
+        # Views still in use keep the memory mapped until they are collected,
+        # instead of failing (again) when the segment object is deleted
+        def __del__(self):
+            try:
+                self.close()
+            except BufferError:
+                pass
+
+__all__ = ['SharedCube']
+
+# Attached cubes of this (worker) process, so the tasks running at the same
+# time share a single mapping of each segment
+_attached = weakref.WeakValueDictionary()
+
+
+def _layout(arrays):
+    # Offsets (aligned to 64 bytes) of the arrays in a single segment
+    layout = []
+    offset = 0
+    for arr in arrays:
+        layout.append((arr.shape, arr.dtype.str, offset))
+        offset += -(-arr.nbytes // 64) * 64
+    return layout, max(offset, 1)
+
+
+def _views(buf, layout, writable):
+    views = []
+    for shape, dtype, offset in layout:
+        count = int(np.prod(shape))
+        view = np.frombuffer(buf, dtype=dtype, count=count, offset=offset).reshape(shape)
+        if not writable:
+            view.flags.writeable = False
+        views.append(view)
+    return views
+
+
+def _release(shm, path, owner, views):
+    # Close the mapping, and remove the segment if this process created it
+    del views[:]
+    if shm is not None:
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        if owner:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+    elif owner:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _attach(backend, name, layout, has_mask):
+    # Unpickling of a SharedCube in a worker process
+    key = (backend, name)
+    cube = _attached.get(key)
+    if cube is None:
+        cube = SharedCube.__new__(SharedCube)
+        cube._open(backend, name, layout, has_mask, owner=False, writable=False)
+        _attached[key] = cube
+    return cube
+
+
+class SharedCube(object):
+    """
+    Cube (and its mask) placed once in shared memory, to be handed to worker processes.
+
+    A SharedCube is pickled as a reference to the segment, so passing it to a
+    ``ProcessPoolExecutor`` or ``multiprocessing.Pool`` task does not copy
+    the data: the workers attach to the segment and see the cube as a read-only
+    NumPy array. The segment is removed when the cube is closed (at the end of
+    a ``with`` block) or garbage collected in the process that created it.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or astropy.nddata.NDData
+        Astronomical data cube, copied into the segment.
+    mask : numpy.ndarray (default = None)
+        Mask for data (the mask of *data* if it is an NDData).
+    backend : str (default = "shm")
+        ``"shm"`` for ``multiprocessing.shared_memory``, or ``"memmap"`` for a memory
+        mapped temporary file (for cubes larger than /dev/shm).
+    dir : str (default = None)
+        Directory of the temporary file of the memmap backend.
+    writable : bool (default = False)
+        Let the creating process modify the cube in place (workers always get
+        a read-only view).
+
+    Examples
+    --------
+    >>> with SharedCube(cube) as shared, ProcessPoolExecutor() as pool:
+    ...     tables = list(pool.map(analyze, [shared] * 4, windows))
+
+    where ``analyze(shared, window)`` reads ``shared.data[window]``.
+    """
+
+    def __init__(self, data, mask=None, backend='shm', dir=None, writable=False):
+        if isinstance(data, NDData):
+            if mask is None:
+                mask = data.mask
+            data = data.data
+        data = np.asanyarray(data)
+        if isinstance(data, np.ma.MaskedArray):
+            if mask is None and data.mask is not np.ma.nomask:
+                mask = data.mask
+            data = data.data
+        arrays = [data] if mask is None else [data, np.broadcast_to(np.asarray(mask, dtype=bool), data.shape)]
+        layout, size = _layout(arrays)
+
+        if backend == 'shm':
+            if shared_memory is None:
+                log.error("multiprocessing.shared_memory not available, use the memmap backend")
+                raise ValueError("multiprocessing.shared_memory not available, use the memmap backend")
+            shm = _Segment(create=True, size=size)
+            name = shm.name
+            shm.close()
+        elif backend == 'memmap':
+            fd, name = tempfile.mkstemp(prefix='acalib-', suffix='.cube', dir=dir)
+            os.ftruncate(fd, size)
+            os.close(fd)
+        else:
+            log.error("Unknown backend " + str(backend))
+            raise ValueError("Unknown backend " + str(backend))
+
+        self._open(backend, name, layout, mask is not None, owner=True, writable=True)
+        for view, arr in zip(self._arrays, arrays):
+            view[...] = arr
+        if not writable:
+            for view in self._arrays:
+                view.flags.writeable = False
+
+    def _open(self, backend, name, layout, has_mask, owner, writable):
+        self.backend = backend
+        self.name = name
+        self._layout = layout
+        self._has_mask = has_mask
+        shm = None
+        if backend == 'shm':
+            if owner:
+                shm = _Segment(name=name)
+            else:
+                try:
+                    # the creating process is in charge of removing the segment
+                    shm = _Segment(name=name, track=False)
+                except TypeError:
+                    shm = _Segment(name=name)
+            buf = shm.buf
+        else:
+            buf = np.memmap(name, dtype=np.uint8, mode='r+' if writable else 'r', shape=(_layout_size(layout),))
+        self._arrays = _views(buf, layout, writable)
+        self._finalizer = weakref.finalize(self, _release, shm, name, owner, self._arrays)
+
+    @property
+    def data(self):
+        """ The cube, as a NumPy array backed by the shared segment. """
+        self._check()
+        return self._arrays[0]
+
+    @property
+    def mask(self):
+        """ The mask of the cube, or None. """
+        self._check()
+        return self._arrays[1] if self._has_mask else None
+
+    def _check(self):
+        if self.closed:
+            log.error("SharedCube already closed")
+            raise ValueError("SharedCube already closed")
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """ Release the segment (and remove it, in the creating process). """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __reduce__(self):
+        self._check()
+        return _attach, (self.backend, self.name, self._layout, self._has_mask)
+
+
+def _layout_size(layout):
+    shape, dtype, offset = layout[-1]
+    return max(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
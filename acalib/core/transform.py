@@ -1,6 +1,9 @@
 import scipy.ndimage as scnd
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+from astropy import log
+
 
 from skimage.filters import threshold_otsu
 from skimage.measure import label
@@ -11,7 +14,16 @@ from skimage.measure import regionprops
 from . import utils
 
 
-def scale(inputCont, majorAxisTemplate):
+def _map(func, items, workers=1):
+    # Apply func to every item, in order, optionally with a pool of threads
+    # (scipy.ndimage releases the GIL while resampling).
+    if workers is None or workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def scale(inputCont, majorAxisTemplate, workers=1):
     """
     Performs an scale of the images in the container acording to the indicated mayor axis.
 
@@ -22,22 +34,19 @@ def scale(inputCont, majorAxisTemplate):
 
     mayorAxisTemplate : float
         Axis respect the scale will be performed on all the images of the container.
+    workers : int, optional
+        Number of threads used to scale the images (None for the default of ThreadPoolExecutor).
 
     Returns
     -------
     result : list
         List with the scaled images.
     """
-    scaledData = []
+    props = fits_props_batch([img.data for img in inputCont.images])
+    return _map(lambda prop: scnd.zoom(prop['orig'], majorAxisTemplate / prop['major']), props, workers)
 
-    for i in np.arange(len(inputCont.images)):
-        prop = fits_props(inputCont.images[i].data)
-        sc = majorAxisTemplate / prop['major']
-        scaledData.append(scnd.zoom(prop['orig'], sc))
-    return scaledData
 
-
-def rotate(data, angle):
+def rotate(data, angle, props=None, workers=1):
     """
     Performs an angle rotation over a list of images
 
@@ -47,35 +56,41 @@ def rotate(data, angle):
         List of (M,N,Z) numpy.ndarray images.
     angle : float
         Rotation reference angle that will be applied to all the images.
+    props : list, optional
+        Properties of the images, as returned by :func:`fits_props_batch`. Computed if not given.
+    workers : int, optional
+        Number of threads used to rotate the images (None for the default of ThreadPoolExecutor).
 
     Returns
     -------
     result : tuple
         Tuple with the list of rotated images and the list of rotation angles applied to each one.
     """
-    rotatedData = []
-    angles = []
+    if props is None:
+        props = fits_props_batch(data)
 
-    for i in np.arange(len(data)):
-        prop = fits_props(data[i])
-        angles.append(angle - prop['angle'])
-        rotatedData.append(scnd.rotate(data[i], angles[-1], reshape=True))
+    angles = [angle - prop['angle'] for prop in props]
+    rotatedData = _map(lambda args: scnd.rotate(args[0], args[1], reshape=True), zip(data, angles), workers)
     return rotatedData, angles
 
 
 def _rotation_limits(img, angle):
-    if angle > 0:
-        cx, cy = np.nonzero(np.array(img.T))
-    else:
-        cx, cy = np.nonzero(np.array(img))
-
-    upper = (cx[0], cy[0])
-    lower = (cx[-1], cy[-1])
+    # First and last non-zero pixels of the image, in column-major order if
+    # angle > 0 and in row-major order otherwise, found from the extents of
+    # the non-zero lines instead of the full list of non-zero indexes.
+    img = np.asarray(img)
+    axis = 0 if angle > 0 else 1
+    lines = np.flatnonzero(np.any(img, axis=axis))
+    first, last = lines[0], lines[-1]
+    first_line = np.take(img, first, axis=1 - axis)
+    last_line = np.take(img, last, axis=1 - axis)
+    upper = (first, np.argmax(first_line != 0))
+    lower = (last, len(last_line) - 1 - np.argmax(last_line[::-1] != 0))
 
     return upper, lower
 
 
-def crop_and_align(data, angles):
+def crop_and_align(data, angles, workers=1):
     """
     Performs crop and alignment of a list of data cubes.
 
@@ -86,21 +101,20 @@ def crop_and_align(data, angles):
 
     angles : list
         List of angles (float) to perform alignment.
+    workers : int, optional
+        Number of threads used to crop the images (None for the default of ThreadPoolExecutor).
 
     Returns
     -------
     result : list
         List of *aligned* astronomical data cubes (numpy.ndarray).
     """
-    alignedData = []
-    shapes = []
+    def _crop(args):
+        upper, lower = _rotation_limits(*args)
+        return args[0][upper[1]:lower[1], upper[1]:lower[1]]
 
-    for i in np.arange(len(data)):
-        upper, lower = _rotation_limits(data[i], angles[i])
-        crop = data[i][upper[1]:lower[1], upper[1]:lower[1]]
-        shapes.append(list(crop.shape))
-
-        alignedData.append(crop)
+    alignedData = _map(_crop, zip(data, angles), workers)
+    shapes = [list(crop.shape) for crop in alignedData]
 
     minShape = tuple(np.amin(shapes, axis=0))
 
@@ -115,89 +129,373 @@ def crop_and_align(data, angles):
     return alignedData
 
 
-def standarize(data):
+def affine_resample(img, props, template_props, order=3, output=None):
+    """
+    Resamples an image over a template, scaling it to the major axis of the template, rotating it to its
+    orientation and centring it on its centroid with a single affine transformation.
+
+    Parameters
+    ----------
+    img : (M,N) numpy.ndarray
+        Astronomical image.
+    props : dict
+        Properties of the image, as returned by :func:`fits_props`.
+    template_props : dict
+        Properties of the template image, as returned by :func:`fits_props`.
+    order : int
+        Order of the spline interpolation.
+    output : numpy.ndarray, optional
+        Array with the shape of the template where the result is stored.
+
+    Returns
+    -------
+    result : numpy.ndarray
+        Resampled image, with the shape of the template.
+    """
+    shape = template_props['orig'].shape
+    if output is None:
+        output = np.empty(shape)
+    sc = template_props['major'] / props['major']
+    angle = props['angle'] - template_props['angle']
+    matrix = np.array([[np.cos(angle), -np.sin(angle)],
+                       [np.sin(angle), np.cos(angle)]]) / sc
+    offset = np.array(props['centroid']) - matrix.dot(np.array(template_props['centroid']))
+    scnd.affine_transform(np.asarray(img, dtype=np.float64), matrix, offset=offset,
+                          output=output, order=order, mode='constant', cval=0.0)
+    return output
+
+
+def affine_stack(data, template_props, props=None, order=3):
+    """
+    Stacks a list of images over a template, resampling each image only once.
+
+    Every image is scaled to the major axis of the template, rotated to its orientation and centred on its centroid,
+    with a single affine transformation (see :func:`affine_resample`). The mean is accumulated while the images are
+    resampled, so only one resampled image is kept in memory.
+
+    Parameters
+    ----------
+    data : list
+        List of (M,N) numpy.ndarray images.
+    template_props : dict
+        Properties of the template image, as returned by :func:`fits_props`.
+    props : list, optional
+        Properties of the images, as returned by :func:`fits_props_batch`. Computed if not given.
+    order : int
+        Order of the spline interpolation.
+
+    Returns
+    -------
+    result : numpy.ndarray
+        Stacked image, with the shape of the template.
+    """
+    if props is None:
+        props = fits_props_batch(data)
+
+    shape = template_props['orig'].shape
+    resampled = np.empty(shape)
+    result = np.zeros(shape)
+
+    for i in np.arange(len(data)):
+        affine_resample(data[i], props[i], template_props, order=order, output=resampled)
+        result += (resampled - result) / (i + 1)
+
+    return result
+
+
+def _output(data, out=None, inplace=False, floating=True):
+    # Array receiving the result: data itself, out, or a new array with the
+    # type of data (float64 for integer data). Operations with a floating
+    # point result can not be done in place on integer data.
+    if inplace:
+        if out is not None:
+            log.error("out can not be given for inplace operations")
+            raise ValueError("out can not be given for inplace operations")
+        if floating and data.dtype.kind not in 'fc':
+            log.error("inplace needs floating point data, not " + str(data.dtype))
+            raise ValueError("inplace needs floating point data, not " + str(data.dtype))
+        return data
+    if out is None:
+        return np.empty(data.shape, dtype=data.dtype if data.dtype.kind == 'f' else np.float64)
+    if out.shape != data.shape:
+        log.error("out needs the shape of data")
+        raise ValueError("out needs the shape of data")
+    return out
+
+
+def _plain(data, out, inplace):
+    # Masked and dask arrays are computed as expressions (no out/inplace)
+    if utils.is_dask(data) or isinstance(data, np.ma.MaskedArray):
+        if out is not None or inplace:
+            log.error("out and inplace are not supported for masked or dask arrays")
+            raise ValueError("out and inplace are not supported for masked or dask arrays")
+        return False
+    return True
+
+
+def standarize(data, out=None, inplace=False):
     """
     Standarize astronomical data cubes in the 0-1 range.
 
+    Floating point data keeps its type (float32 stays float32), and the cube is written
+    to *out* or to *data* itself if given, without temporaries.
+
     Parameters
     ----------
-    data : numpy.ndarray or astropy.nddata.NDData or or astropy.nddata.NDData
+    data : numpy.ndarray, dask.array.Array or astropy.nddata.NDData or or astropy.nddata.NDData
         Astronomical data cube.
+    out : numpy.ndarray (default = None)
+        Array for the result, with the shape of data.
+    inplace : bool (default = False)
+        Overwrite data with the result.
 
     Returns
     -------
     result : tuple
-        Tuple containing the standarized numpy.ndarray or astropy.nddata.NDData cube, the factor scale y_fact and the shift y_min.
+        Tuple containing the standarized numpy.ndarray or astropy.nddata.NDData cube, the factor scale y_fact and the shift y_min
+        (all of them lazy for a dask array).
     """
     y_min = data.min()
-    res = data - y_min
-    y_fact = res.sum()
-    res = res / y_fact
+    if not _plain(data, out, inplace):
+        res = data - y_min
+        y_fact = res.sum()
+        res = res / y_fact
+        return (res, y_fact, y_min)
+    res = np.subtract(data, y_min, out=_output(data, out, inplace))
+    # accumulated in float64 even for float32 cubes
+    y_fact = res.sum(dtype=np.float64)
+    np.divide(res, y_fact, out=res)
     return (res, y_fact, y_min)
 
 
-def unstandarize(data, a, b):
+def unstandarize(data, a, b, out=None, inplace=False):
     """
     Unstandarize the astronomical data cube: :math:`a \cdot data + b`.
 
     Parameters
     ----------
-    data : numpy.ndarray or astropy.nddata.NDData or or astropy.nddata.NDData
-        Astronomical data cube.
+    data : numpy.ndarray, dask.array.Array or astropy.nddata.NDData or or astropy.nddata.NDData
+        Astronomical data cube (a and b may be lazy dask scalars).
     a : float
         Scale value.
     b : float
         Shift value.
+    out : numpy.ndarray (default = None)
+        Array for the result, with the shape of data.
+    inplace : bool (default = False)
+        Overwrite data with the result.
 
     Returns
     -------
     result : numpy.ndarray or astropy.nddata.NDData
-        Unstandarized astronomical cube.
+        Unstandarized astronomical cube (float32 data stays float32).
     """
-    return a*data+b
+    if not _plain(data, out, inplace):
+        return a*data+b
+    res = np.multiply(data, a, out=_output(data, out, inplace))
+    np.add(res, b, out=res)
+    return res
 
 
-def add(data, flux, lower, upper):
+def add(data, flux, lower, upper, out=None):
     """
     Adds flux to a sub-cube of an astronomical data cube.
 
     Parameters
     ----------
     data : numpy.ndarray or astropy.nddata.NDData or or astropy.nddata.NDData
-        Astronomical data cube.
+        Astronomical data cube (modified in place, unless *out* is given).
     flux : numpy.ndarray
         Flux added to the cube.
     lower : float
         Lower bound of the sub-cube to which flux will be added.
     upper : float
         Upper bound of the sub-cube to which flux will be added.
+    out : numpy.ndarray (default = None)
+        Array for the result (a copy of data plus the flux), with the shape of data.
+
+    Returns
+    -------
+    result : numpy.ndarray
+        The cube with the flux added (data itself, or out).
+    """
+    if out is not None:
+        np.copyto(_output(data, out), data)
+        data = out
+    data_slab, flux_slab = utils.matching_slabs(data, flux, lower, upper)
+    data[tuple(data_slab)] += flux[tuple(flux_slab)]
+    return data
+
+
+def _stamp_boxes(shape, stamps, lowers, uppers):
+    # Clip all the boxes at once: each stamp starts at its lower corner and
+    # is cut by the upper corner and by the cube borders. Returns the
+    # clipped data boxes, the matching stamp offsets and the non-empty ones.
+    shape = np.array(shape)
+    sizes = np.array([np.shape(st) for st in stamps]).reshape(len(stamps), shape.size)
+    lowers = np.asarray(lowers).reshape(-1, shape.size).astype(int)
+    uppers = np.asarray(uppers).reshape(-1, shape.size).astype(int)
+    lo = np.clip(lowers, 0, shape)
+    hi = np.clip(np.minimum(uppers, lowers + sizes), 0, shape)
+    valid = np.all(hi > lo, axis=1)
+    return lo, hi, lo - lowers, valid
+
+
+def _overlap_groups(lo, hi):
+    # Greedy partition of the boxes in groups of pairwise disjoint boxes
+    groups = []
+    glo = []
+    ghi = []
+    for k in range(lo.shape[0]):
+        for g in range(len(groups)):
+            if not np.any(np.all((lo[k] < ghi[g]) & (glo[g] < hi[k]), axis=1)):
+                groups[g].append(k)
+                glo[g] = np.vstack((glo[g], lo[k]))
+                ghi[g] = np.vstack((ghi[g], hi[k]))
+                break
+        else:
+            groups.append([k])
+            glo.append(lo[k:k + 1])
+            ghi.append(hi[k:k + 1])
+    return groups
+
+
+def add_many(data, stamps, lowers, uppers, out=None, workers=1):
     """
+    Adds many flux stamps to an astronomical data cube (scatter-add).
 
-    data_slab, flux_slab = matching_slabs(data, flux, lower, upper)
-    data[data_slab] += flux[flux_slab]
+    Stamp k is placed with its first pixel at ``lowers[k]`` and added over the box from
+    ``lowers[k]`` to ``uppers[k]``, cut at the borders of the cube (as :func:`add`). The boxes are
+    clipped all at once, and overlapping stamps are all added. With several workers the stamps
+    are split in groups of disjoint boxes, and the stamps of each group are added by a thread pool.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Astronomical data cube (modified in place, unless *out* is given).
+    stamps : list of numpy.ndarray
+        Fluxes added to the cube.
+    lowers : (K,dim) array_like
+        Lower bound of the sub-cube of each stamp.
+    uppers : (K,dim) array_like
+        Upper bound of the sub-cube of each stamp.
+    out : numpy.ndarray (default = None)
+        Array for the result (a copy of data plus the stamps), with the shape of data.
+    workers : int (default = 1)
+        Number of threads (None for the default of ThreadPoolExecutor).
+
+    Returns
+    -------
+    result : numpy.ndarray
+        The cube with the stamps added (data itself, or out).
+    """
+    if out is not None:
+        np.copyto(_output(data, out), data)
+        data = out
+    if len(stamps) == 0:
+        return data
+    lo, hi, offset, valid = _stamp_boxes(data.shape, stamps, lowers, uppers)
+    index = np.flatnonzero(valid)
+
+    def _add(k):
+        box = tuple(slice(a, b) for a, b in zip(lo[k], hi[k]))
+        sbox = tuple(slice(a, a + b - c) for a, b, c in zip(offset[k], hi[k], lo[k]))
+        data[box] += stamps[k][sbox]
+
+    if workers == 1:
+        for k in index:
+            _add(k)
+    else:
+        # threads only write disjoint boxes at the same time
+        for group in _overlap_groups(lo[index], hi[index]):
+            _map(_add, index[group], workers)
+    return data
 
 
-def denoise(data, threshold):
+def denoise(data, threshold, out=None, inplace=False):
     """
     Performs denoising of data cube, thresholding over the threshold value.
 
+    Values not greater than the threshold (and NaNs) are set to zero. Floating point data
+    keeps its type, and the cube is written to *out* or to *data* itself if given.
+
     Parameters
     ----------
-    data : numpy.ndarray or astropy.nddata.NDData or or astropy.nddata.NDData
+    data : numpy.ndarray, dask.array.Array or astropy.nddata.NDData or or astropy.nddata.NDData
         Astronomical data cube.
     threshold : float
         Threshold value used for denoising.
+    out : numpy.ndarray (default = None)
+        Array for the result, with the shape of data.
+    inplace : bool (default = False)
+        Overwrite data with the result.
 
     Returns
     -------
-    result : numpy.ndarray
+    result : numpy.ndarray or dask.array.Array
         Denoised (thresholded) astronomical data cube.
     """
+    if utils.is_dask(data):
+        _plain(data, out, inplace)
+        return utils.da.where(data > threshold, data, 0.0)
+
+    if out is None and not inplace:
+        # a single pass, without the zeros array
+        dtype = data.dtype if data.dtype.kind == 'f' else np.dtype(np.float64)
+        return np.where(data > threshold, data, dtype.type(0)).astype(dtype, copy=False)
+    res = _output(data, out, inplace, floating=False)
+    # np.multiply(data, keep) would keep the NaNs (NaN * 0), so the values are copied
+    keep = np.greater(data, threshold)
+    if res is data:
+        np.copyto(res, 0, where=np.logical_not(keep, out=keep))
+    else:
+        res.fill(0)
+        np.copyto(res, data, where=keep)
+    return res
 
-    elms = data > threshold
-    newdata = np.zeros(data.shape)
-    newdata[elms] = data[elms]
-    return newdata
+
+def remove_isolate(caa, frac=0.1, on=0, off=-1, centre=True, iterations=1):
+    """
+    Removes small isolated groups of "on" pixels from a clump assignment array (CAA), using a cellular automaton.
+
+    Each output pixel is set to *on* if the fraction of *on* pixels in the 3x3 (2D) or 3x3x3 (3D) neighbourhood of the
+    input pixel (including itself, and excluding positions outside the array) is at least *frac*, and to *off* otherwise.
+    Neighbours are counted with a single convolution per iteration.
+
+    Parameters
+    ----------
+    caa : numpy.ndarray
+        2D or 3D clump assignment array.
+    frac : float
+        Minimum fraction of neighbouring pixels that must be on.
+    on : int
+        The value used to represent "on" pixels in the input and output arrays.
+    off : int
+        The value used to represent "off" pixels in the output array (any value not equal to *on* is treated as off
+        in the input array).
+    centre : bool
+        If True, no output pixel will be set on if the corresponding input pixel is not on.
+    iterations : int
+        Number of times the automaton is applied.
+
+    Returns
+    -------
+    result : numpy.ndarray
+        Cleaned clump assignment array.
+    """
+    caa = np.asarray(caa)
+    kernel = np.ones((3,) * caa.ndim, dtype=np.int32)
+    total = scnd.convolve(np.ones(caa.shape, dtype=np.int32), kernel, mode='constant', cval=0)
+    need = frac * total
+    result = caa
+    for i in range(iterations):
+        alive = result == on
+        count = scnd.convolve(alive.astype(np.int32), kernel, mode='constant', cval=0)
+        alive_next = count >= need
+        if centre:
+            alive_next &= alive
+        result = np.where(alive_next, on, off).astype(caa.dtype)
+    return result
 
 
 def fits_props(img):
@@ -214,35 +512,114 @@ def fits_props(img):
     result : dict
         Dictionary with properties of the image: *centroid*, *major*, *minor*, *ratio*, *angle*, *area*, *img*, *clr*, *label*, *orig*.
     """
-    flt = threshold_otsu(img)
-    otsu = img >= flt
-    clr = clear_border(otsu)
-
-    # label image regions
-    label_image, nlabel = label(clr, return_num=True)
-    borders = np.logical_xor(otsu, clr)
-    label_image[borders] = -1
+    return fits_props_batch([img])[0]
 
-    props = regionprops(label_image)
 
-    ratios = []
-    areas = []
+def fits_props_batch(images):
+    """
+    Extracts properties information of a set of astronomical images.
 
-    for i in props:
-        if i.major_axis_length > 0:
-            ratios.append(i.minor_axis_length / i.major_axis_length)
-            areas.append(i.area)
-        else:
-            ratios.append(0)
-            areas.append(0)
+    Images of the same shape are labeled together as a single stack, and the
+    properties of all their regions are computed at once from the image moments.
+    Each distinct image object is processed only once, even if it appears several
+    times in the set.
 
-    if len(props) > 1:
-        pos = np.argmax(areas)
-    else:
-        pos = 0
+    Parameters
+    ----------
+    images : list of numpy.ndarray or (K,M,N) numpy.ndarray
+        Astronomical images.
 
-    properties = {'centroid': props[pos].centroid, 'major': props[pos].major_axis_length,
-                  'minor': props[pos].minor_axis_length, 'ratio': ratios[pos],
-                  'angle': props[pos].orientation, 'area': props[pos].area, 'img': props[pos].image,
-                  'clr': clr, 'label': label_image, 'orig': img}
+    Returns
+    -------
+    result : list
+        List of dictionaries with the properties of each image (see :func:`fits_props`).
+    """
+    images = list(images)
+    unique = {}
+    groups = {}
+    for img in images:
+        if id(img) not in unique:
+            unique[id(img)] = None
+            groups.setdefault(np.shape(img), []).append(img)
+
+    for imgs in groups.values():
+        for img, props in zip(imgs, _fits_props_stack(imgs)):
+            unique[id(img)] = props
+
+    return [unique[id(img)] for img in images]
+
+
+def _fits_props_stack(imgs):
+    # Otsu threshold of each image
+    stack = np.array(imgs)
+    otsu = np.empty(stack.shape, dtype=bool)
+    for k in range(len(stack)):
+        otsu[k] = stack[k] >= threshold_otsu(stack[k])
+
+    # Label all the images at once (no connectivity between images)
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = scnd.generate_binary_structure(2, 2)
+    labels, nlabel = scnd.label(otsu, structure=structure)
+    ids = np.arange(nlabel + 1)
+
+    # Regions touching the image borders (clear_border)
+    border = np.zeros(nlabel + 1, dtype=bool)
+    for edge in (labels[:, 0, :], labels[:, -1, :], labels[:, :, 0], labels[:, :, -1]):
+        border[edge] = True
+    border[0] = False
+
+    # Image of each label, and its per-image label (as in skimage.measure.label)
+    flat = labels.ravel()
+    owner = np.unique(flat, return_index=True)[1] // labels[0].size
+    inner = ~border
+    inner[0] = False
+    rank = np.cumsum(inner)
+    first = np.searchsorted(owner[1:], np.arange(len(stack)), side='left') + 1
+    offset = rank[first - 1]
+    local = np.where(inner, rank - offset[owner], -1)
+    local[0] = 0
+
+    # Moments of every region
+    rr, cc = np.indices(stack.shape[1:])
+    rr = np.broadcast_to(rr, stack.shape).ravel()
+    cc = np.broadcast_to(cc, stack.shape).ravel()
+    m00 = np.bincount(flat, minlength=nlabel + 1).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mr = np.bincount(flat, rr, nlabel + 1) / m00
+        mc = np.bincount(flat, cc, nlabel + 1) / m00
+        dr = rr - mr[flat]
+        dc = cc - mc[flat]
+        vr = np.bincount(flat, dr * dr, nlabel + 1) / m00
+        vc = np.bincount(flat, dc * dc, nlabel + 1) / m00
+        vrc = np.bincount(flat, dr * dc, nlabel + 1) / m00
+
+    # Inertia tensor eigenvalues and orientation (as in skimage.measure.regionprops)
+    a, b, c = vc, -vrc, vr
+    root = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    l1 = np.clip((a + c) / 2 + root, 0, None)
+    l2 = np.clip((a + c) / 2 - root, 0, None)
+    major = 4 * np.sqrt(l1)
+    minor = 4 * np.sqrt(l2)
+    angle = np.where(a - c == 0, np.where(b < 0, np.pi / 4, -np.pi / 4), 0.5 * np.arctan2(-2 * b, c - a))
+
+    # Largest region of each image, ignoring degenerated ones
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = np.where(major > 0, minor / major, 0)
+    areas = np.where(major > 0, m00, 0)
+    areas[~inner] = -1
+
+    properties = []
+    for k in range(len(stack)):
+        mine = ids[(owner == k) & inner]
+        if mine.size == 0:
+            raise IndexError("No region found in image {0}".format(k))
+        pos = mine[np.argmax(areas[mine])]
+        label_image = local[labels[k]]
+        clr = label_image > 0
+        region = labels[k] == pos
+        bbox = scnd.find_objects(region.astype(int))[0]
+        properties.append({'centroid': (mr[pos], mc[pos]), 'major': major[pos],
+                           'minor': minor[pos], 'ratio': ratios[pos],
+                           'angle': angle[pos], 'area': m00[pos], 'img': region[bbox],
+                           'clr': clr, 'label': label_image, 'orig': imgs[k]})
     return properties
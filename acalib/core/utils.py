@@ -1,21 +1,47 @@
 import numpy as np
 
+try:
+    import dask.array as da
+except ImportError:
+    da = None
+
+
+def is_dask(data):
+    """
+    Check if data is a dask array (lazy and chunked).
+
+    Parameters
+    ----------
+    data : object
+        Astronomical data cube.
+
+    Returns
+    -------
+    result : bool
+        True if dask is installed and data is a dask.array.Array.
+    """
+    return da is not None and isinstance(data, da.Array)
+
 def fix_mask(data, mask):
     """
 
     Parameters
     ----------
-    data : numpy.ndarray or numpy.ma.MaskedArray
+    data : numpy.ndarray, numpy.ma.MaskedArray or dask.array.Array
         Astronomical data cube.
     mask : numpy.ndarray
         Boolean that will be applied.
     
     Returns
     -------
-    result : numpy.ma.MaskedArray
-        Masked astronomical data cube.
+    result : numpy.ma.MaskedArray or dask.array.Array
+        Masked astronomical data cube (a lazy masked dask array for dask input).
     """
 
+    if is_dask(data):
+        if mask is None:
+            return data
+        return da.ma.masked_array(data, mask=np.broadcast_to(mask, data.shape))
     ismasked = isinstance(data, np.ma.MaskedArray)
     if ismasked and mask is None:
         return data
@@ -31,7 +57,7 @@ def fix_limits(data, vect):
     data : numpy.ndarray or numpy.ma.MaskedArray
         Astronomical data cube.
     vect : tuple, list or numpy.ndarray
-        Array with the indexes to be fixed.
+        Array with the indexes to be fixed (or (K,dim) array with K index vectors).
 
     Returns
     -------
@@ -47,7 +73,7 @@ def fix_limits(data, vect):
     if vect.any():
         vect[low] = 0
     if vect.any():
-        vect[up] = np.array(data.shape)[up]
+        vect[up] = np.broadcast_to(np.array(data.shape), vect.shape)[up]
     return vect
 
 
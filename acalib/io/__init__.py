@@ -1,8 +1,35 @@
-import astropy.visualization
-from astropy.units.format.latex import Latex
-from .fits import *
-from .graph import *
-from .container import *
+import importlib
+import numpy as np
+
+from .._lazy import submodule as _submodule
+
+# Functions are imported on first access (PEP 562), so matplotlib and SAMP
+# are only loaded when needed.
+_LAZY = {}
+for _module, _names in (('fits', ['HDU_to_NDData', 'HDU_to_Table', 'Table_to_HDU', 'NDData_to_HDU',
+                                  'save_fits_from_cont', 'load_fits_to_cont', 'loadFITS_PrimaryOnly',
+                                  'SAMP_send_fits', 'NaNMask']),
+                        ('graph', ['visualize', 'visualize_plot', 'visualize_image', 'rms']),
+                        ('container', ['Container', 'load_fits', 'save_fits'])):
+    for _name in _names:
+        _LAZY[_name] = _module
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    if not name.startswith('_'):
+        # Submodules (e.g. io.fits) stay reachable as attributes, as when imported eagerly
+        return _submodule(__name__, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
 
 # TODO: This maybe moved to a file
@@ -45,6 +72,8 @@ def jovial_tuple_makeup(t):
 
 try:
     fmt = get_ipython().display_formatter.formatters['text/latex']
+    import astropy.visualization
+    from astropy.units.format.latex import Latex
     astropy.visualization.quantity_support()
     formatter = {'float_kind': Latex.format_exponential_notation, 'numpystr': jovial_array_styler}
     np.set_printoptions(threshold=astropy.units.quantity.conf.latex_array_threshold)
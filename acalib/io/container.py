@@ -17,13 +17,13 @@ class Container:
         self.tables = []
         """List of astropy tables"""
 
-    def load_fits(self,path):
-        load_fits_to_cont(path,self)
-    def save_fits(self,path):
-        save_fits_from_cont(path,self)
+    def load_fits(self,path,columns=None):
+        load_fits_to_cont(path,self,columns=columns)
+    def save_fits(self,path,dtype=None,compression=None):
+        save_fits_from_cont(path,self,dtype=dtype,compression=compression)
 
 
-def load_fits(path):
+def load_fits(path,columns=None):
     """
     Load a FITS into a container.
 
@@ -31,13 +31,16 @@ def load_fits(path):
     ----------
     path : str
         Path to FITS file in local disk.
+    columns : list of str or dict (default = None)
+        Names of the columns to load from the tables (all the columns if None), or a dict
+        from EXTNAME to the names of each table (see :func:`~acalib.io.fits.load_fits_to_cont`).
 
     Returns
     -------
     result: :class:`~acalib.Container` with the FITS loaded.
     """
     cont=Container()
-    cont.load_fits(path)
+    cont.load_fits(path,columns=columns)
     return cont
 
 def save_fits(cont,path):
@@ -4,9 +4,145 @@ import numpy as np
 import astropy.units as u
 from astropy.wcs import wcs
 import astropy.nddata as ndd
-from astropy.table.table import Table
-from astropy.vo.samp import SAMPIntegratedClient
+from astropy.table.table import Table, Column
+from collections import OrderedDict
 import os
+import re
+
+# Header keywords of the table structure, not restored into the meta of a table
+_TABLE_KEYWORDS = ('XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'PCOUNT', 'GCOUNT', 'TFIELDS',
+                   'THEAP', 'EXTNAME', 'EXTVER', 'CHECKSUM', 'DATASUM', 'COMMENT', 'HISTORY', '')
+_COLUMN_KEYWORD = re.compile(r'^T(TYPE|FORM|UNIT|DIM|NULL|SCAL|ZERO|DISP)[0-9]+$')
+
+# Elements per chunk when scanning (and masking) the NaN values of a cube
+_NAN_CHUNK = 2 ** 22
+
+
+def _blocks(n, rowsize):
+    # Slices of the first axis with about _NAN_CHUNK elements each
+    step = max(1, _NAN_CHUNK // max(rowsize, 1))
+    for start in range(0, n, step):
+        yield slice(start, min(start + step, n))
+
+
+def _pack_nans(data, reduce=False):
+    # Bit-packed NaN mask of the data, computed by chunks in a single pass, or
+    # None if the data has no NaN values (then no mask is allocated)
+    shape = data.shape[1:] if reduce else data.shape
+    if data.dtype.kind not in 'fc' or data.size == 0:
+        return None
+    packed = None
+    rows = shape[0]
+    for sl in _blocks(rows, data.size // rows):
+        if reduce:
+            block = np.logical_and.reduce(np.isnan(data[:, sl]), axis=0)
+        else:
+            block = np.isnan(data[sl])
+        if packed is None:
+            if not block.any():
+                continue
+            packed = np.zeros(shape[:-1] + (-(-shape[-1] // 8),), dtype=np.uint8)
+        packed[sl] = np.packbits(block, axis=-1)
+    return packed
+
+
+class NaNMask(object):
+    """
+    Mask of the NaN values of a cube, stored bit-packed.
+
+    The mask is computed by chunks when it is created (so later in-place changes of the
+    data do not change it) and packed (``numpy.packbits``) along the last axis, so it takes
+    one bit per voxel instead of a byte. It behaves like a read-only bool array: it can be
+    indexed (slicing leading axes only unpacks the selected part), combined with ``~``,
+    ``&``, ``|`` and ``^``, and passed to any NumPy function, and the ndarray methods
+    (``any``, ``sum``, ``nonzero``...) are those of the unpacked mask.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Astronomical data cube.
+    reduce : bool (default = False)
+        Mask only the voxels that are NaN in all the planes of the first axis
+        (e.g. the Stokes planes of a 4D cube), which is then dropped from the mask.
+    """
+    dtype = np.dtype(bool)
+
+    def __init__(self, data, reduce=False):
+        self.shape = tuple(data.shape[1:] if reduce else data.shape)
+        packed = _pack_nans(data, reduce)
+        if packed is None:
+            packed = np.zeros(self.shape[:-1] + (-(-self.shape[-1] // 8),), dtype=np.uint8)
+        self.packed = packed
+
+    @classmethod
+    def _from_packed(cls, packed, shape):
+        mask = cls.__new__(cls)
+        mask.shape = tuple(shape)
+        mask.packed = packed
+        return mask
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def _unpack(self, packed):
+        return np.unpackbits(packed, axis=-1, count=self.shape[-1]).view(bool)
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self._unpack(self.packed)
+        if dtype is not None and np.dtype(dtype) != self.dtype:
+            return mask.astype(dtype)
+        return mask
+
+    def __getitem__(self, item):
+        leading = item if isinstance(item, tuple) else (item,)
+        if len(leading) < self.ndim and all(isinstance(i, (int, np.integer, slice)) for i in leading):
+            return self._unpack(self.packed[item])
+        return np.asarray(self)[item]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(np.asarray(self))
+
+    def __invert__(self):
+        return ~np.asarray(self)
+
+    def __and__(self, other):
+        return np.asarray(self) & other
+
+    def __or__(self, other):
+        return np.asarray(self) | other
+
+    def __xor__(self, other):
+        return np.asarray(self) ^ other
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __getattr__(self, name):
+        # ndarray methods and attributes of the unpacked mask
+        if name.startswith('_') or name in ('shape', 'packed'):
+            raise AttributeError(name)
+        return getattr(np.asarray(self), name)
+
+    def __repr__(self):
+        return 'NaNMask(shape={})'.format(self.shape)
+
+
+def _nan_mask(data, reduce=False):
+    # None for cubes without NaN values, a NaNMask otherwise
+    packed = _pack_nans(data, reduce)
+    if packed is None:
+        return None
+    return NaNMask._from_packed(packed, data.shape[1:] if reduce else data.shape)
+
 
 def HDU_to_NDData(hdu):
    """
@@ -20,11 +156,11 @@ def HDU_to_NDData(hdu):
     Returns
     -------
     result: astropy.nddata.NDDataRef with data from the HDU object.
+        Its mask is None if the data has no NaN values, and a :class:`NaNMask` otherwise.
    """
    hdu.verify("fix")
    data=hdu.data
    meta=hdu.header
-   mask=np.isnan(data)
    # Hack to correct wrong uppercased units generated by CASA
    try:
      bscale=meta['BSCALE']
@@ -54,35 +190,65 @@ def HDU_to_NDData(hdu):
        # Put data in physically-meaninful values, and remove stokes
        # TODO: Stokes is removed by summing (is this correct? maybe is averaging?)
        log.info("4D data detected: assuming RA-DEC-FREQ-STOKES (like CASA-generated ones), and dropping STOKES")
+       mask=_nan_mask(data,reduce=True)
        data=data.sum(axis=0)*bscale+bzero
-       mask = np.logical_and.reduce(mask,axis=0)
        mywcs=mywcs.dropaxis(3)
    elif len(data.shape) == 3:
        log.info("3D data detected: assuming RA-DEC-FREQ")
        data=data*bscale+bzero
+       mask=_nan_mask(data)
    elif len(data.shape) == 2:
        log.info("2D data detected: assuming RA-DEC")
        data=data*bscale+bzero
+       mask=_nan_mask(data)
    else:
        log.error("Only 3D data allowed (or 4D in case of polarization)")
        raise TypeError
    return ndd.NDDataRef(data, uncertainty=None, mask=mask,wcs=mywcs, meta=meta, unit=bunit)
 
-def HDU_to_Table(hdu):
+def HDU_to_Table(hdu,columns=None):
     """
     Create a data table from a HDU component.
 
+    The columns are views of the table data (memory-mapped when the file was opened
+    with memmap), so no row is converted or read until it is used. The header keywords,
+    except those describing the table structure, are restored into the meta of the table.
+
     Parameters
     ----------
     hdu : HDU object
         HDU to transform into a data table.
+    columns : list of str (default = None)
+        Names of the columns to load (all the columns if None).
 
     Returns
     -------
     result: astropy.table.Table with data from the HDU.
     """
-    log.warning("FITS Table ---> AstroPy Table not implemented Yet")
-    #return atable.ATable(data=hdu.data,meta=hdu.header)
+    names = hdu.columns.names
+    if columns is None:
+        columns = names
+    else:
+        missing = [name for name in columns if name not in names]
+        if missing:
+            log.error("Columns not in the table: " + ", ".join(missing))
+            raise ValueError("Columns not in the table: " + ", ".join(missing))
+    meta = OrderedDict()
+    for key, value in hdu.header.items():
+        if key in _TABLE_KEYWORDS or _COLUMN_KEYWORD.match(key):
+            continue
+        meta[key] = value
+    data = hdu.data
+    cols = []
+    for name in columns:
+        col = hdu.columns[name]
+        if data is None:
+            values = np.empty(0, dtype=col.dtype)
+        else:
+            values = data.field(name)
+        cols.append(Column(values, name=name, unit=col.unit, copy=False))
+    # copy=False, so the columns stay views of the (memory-mapped) table data
+    return Table(cols, meta=meta, copy=False)
 
 def Table_to_HDU(tab):
     """
@@ -105,7 +271,7 @@ def Table_to_HDU(tab):
             hdu.header[k] = v
     return hdu
 
-def NDData_to_HDU(cube,primary=False):
+def NDData_to_HDU(cube,primary=False,dtype=None,compression=None):
     """
     Create a HDU object from an N-dimensional dataset.
 
@@ -115,49 +281,106 @@ def NDData_to_HDU(cube,primary=False):
         Astronomical data cube.
     primary : bool
         Whether to pick the primary or an image HDU.
+    dtype : numpy.dtype (default = None)
+        Type of the written data (e.g. numpy.float32 to halve the size of float64 cubes).
+    compression : str (default = None)
+        Tile compression algorithm (e.g. 'RICE_1' or 'GZIP_1') of a compressed image HDU.
+        Primary HDUs are never compressed.
 
     Returns
     -------
     result: HDU object with data from the data cube.
     """
     header = cube.wcs.to_header()
+    if cube.meta is not None:
+        header.update(cube.meta)
+    data = cube.data
+    if dtype is not None:
+        data = np.asarray(data).astype(dtype, copy=False)
     if primary==True:
-        hdu = fits.PrimaryHDU(cube.data,header=header)
+        hdu = fits.PrimaryHDU(data,header=header)
+    elif compression is not None:
+        hdu = fits.CompImageHDU(data,header=header,compression_type=compression)
     else:
-        hdu = fits.ImageHDU(cube.data,header=header)
-
-    if cube.meta is not None:
-        for k, v in cube.meta.items():
-            hdu.header[k] = v
+        hdu = fits.ImageHDU(data,header=header)
     return hdu
 
-def save_fits_from_cont(filepath,acont):
+def _cont_to_HDUs(acont,dtype=None,compression=None):
+    # HDUs of a container, created one at a time
     if isinstance(acont.primary,Table):
         raise NotImplementedError("FITS Format do now support tables as primary HDU! You can set primary = None")
-    if acont.primary == None:
-        phdu=fits.PrimaryHDU()
+    if acont.primary is None:
+        yield fits.PrimaryHDU()
     else:
-        phdu=NDData_to_HDU(acont.primary,primary=True)
-    nlist=[phdu]
+        yield NDData_to_HDU(acont.primary,primary=True,dtype=dtype)
     count=0
     for elm in acont.images:
         count+=1
-        hdu=NDData_to_HDU(elm)
+        hdu=NDData_to_HDU(elm,dtype=dtype,compression=compression)
         hdu.header['EXTNAME'] = 'SCI'
         hdu.header['EXTVER'] = count
-        nlist.append(hdu)
+        yield hdu
     count=0
     for elm in acont.tables:
         count+=1
         hdu=Table_to_HDU(elm)
         hdu.header['EXTNAME'] = 'TAB'
         hdu.header['EXTVER'] = count
-        nlist.append(hdu)
-    hdulist = fits.HDUList(nlist)
-    hdulist.writeto(filepath,clobber=True)
+        yield hdu
+
+def save_fits_from_cont(filepath,acont,dtype=None,compression=None,overwrite=True):
+    """
+    Write a container to a FITS file.
+
+    Each HDU is written to the file as soon as it is created, and its (possibly converted)
+    data is released afterwards, so the whole HDU list is never held in memory.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the FITS file.
+    acont : acalib.io.container.Container
+        Container to write.
+    dtype : numpy.dtype (default = None)
+        Type of the written images (e.g. numpy.float32).
+    compression : str (default = None)
+        Tile compression algorithm (e.g. 'RICE_1') for the images (the primary HDU is not compressed).
+        Floating point images are quantized by the compression, so it is lossy for them.
+    overwrite : bool (default = True)
+        Whether to overwrite an existing file.
+    """
+    if os.path.exists(filepath):
+        if not overwrite:
+            log.error("File "+filepath+" already exists")
+            raise OSError("File "+filepath+" already exists")
+        os.remove(filepath)
+    with fits.open(filepath,mode='ostream') as hdulist:
+        for hdu in _cont_to_HDUs(acont,dtype,compression):
+            hdulist.append(hdu)
+            hdulist.flush()
+            hdulist[-1].data = None
+
+def load_fits_to_cont(filePath,acont,columns=None):
+    """
+    Load the images and tables of a FITS file into a container.
+
+    The file is memory-mapped, so the data of each HDU is only read when used.
 
-def load_fits_to_cont(filePath,acont):
-    hdulist = fits.open(filePath)
+    Parameters
+    ----------
+    filePath : str
+        Path of the FITS file.
+    acont : acalib.io.container.Container
+        Container to fill.
+    columns : list of str or dict (default = None)
+        Names of the columns to load from the tables (all the columns if None). With a list,
+        each table loads the listed columns it has. With a dict from EXTNAME to a list of names,
+        each table loads its own columns (all of them if its EXTNAME is not a key).
+    """
+    if isinstance(columns, dict):
+        columns = dict((extname.upper(), names) for extname, names in columns.items())
+    found = set()
+    hdulist = fits.open(filePath, memmap=True)
     for counter,hdu in enumerate(hdulist):
         if isinstance(hdu,fits.PrimaryHDU) or isinstance(hdu,fits.ImageHDU):
             log.info("Processing HDU "+str(counter)+" (Image)")
@@ -169,8 +392,19 @@ def load_fits_to_cont(filePath,acont):
             except TypeError:
                 log.info(str(counter)+" (Image) wasn't an Image")
         if isinstance(hdu, fits.BinTableHDU):
-            table = HDU_to_Table(hdu)
+            log.info("Processing HDU "+str(counter)+" (Table)")
+            names = columns
+            if isinstance(columns, dict):
+                names = columns.get(hdu.name.upper())
+            elif columns is not None:
+                names = [name for name in columns if name in hdu.columns.names]
+                found.update(names)
+            table = HDU_to_Table(hdu,columns=names)
             acont.tables.append(table)
+    if columns is not None and not isinstance(columns, dict):
+        missing = [name for name in columns if name not in found]
+        if missing:
+            log.warning("Columns not in any table: " + ", ".join(missing))
     if acont.primary is None:
         if len(acont.images)==0:
             acont.primary = acont.tables[0]
@@ -190,6 +424,7 @@ def loadFITS_PrimaryOnly(fitsfile):
 
 
 def SAMP_send_fits(filename,longname):
+    from astropy.vo.samp import SAMPIntegratedClient
     client = SAMPIntegratedClient()
     client.connect()
     params = {}
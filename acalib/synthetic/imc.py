@@ -10,6 +10,8 @@ import urllib
 import shutil
 import os.path
 from acalib import *
+from acalib import core
+from acalib.upi.flux import _world_gaussian
 
 #INTEN_GROUP = [('default'), ('COv=0'), ('13COv=0'), ('HCO+, HC3N, CS, C18O, CH3OH, N2H, HDO')]
 #INTEN_VALUES = [[0.1, 2], [20, 60], [5, 20], [1, 10]]
@@ -41,6 +43,7 @@ class IMC(Component):
         self.mol_list = mol_list
 
     def _draw(self,cube,flux,freq,cutoff):
+        # Returns the flux stamp of a line and its bounds, or None
         raise NotImplementedError("Draw not implemented.")
 
     def info(self):
@@ -60,6 +63,7 @@ class IMC(Component):
         # print "cor_fwin",cor_fwin
         counter = 0
         used = False
+        stamps = []
         for mol in self.mol_list:
             # For each molecule specified in the dictionary
             # load its spectral lines
@@ -87,9 +91,11 @@ class IMC(Component):
                     log.info('    - Discarding ' + str(lin[1]) + ' at freq=' + str(freq) + '('+str(lin[3]*u.MHz)+') because I='+str(flux)+' < '+str(cutoff))
                     continue
                 
-                if self._draw(cube,flux,freq,cutoff)==False:
+                stamp = self._draw(cube,flux,freq,cutoff)
+                if stamp is None:
                     log.info('    - Discarding ' + str(lin[1]) + ' at freq=' + str(freq) + '('+str(lin[3]*u.MHz)+') because it is too thin for the resolution')
                     continue
+                stamps.append(stamp)
                 log.info('   - Projecting ' + str(lin[2]) + ' (' + str(lin[1]) + ') at freq=' + str(freq) + '('+str(lin[3]*u.MHz)+') intens='+ str(flux))
                 used = True
 
@@ -100,6 +106,9 @@ class IMC(Component):
         dba.disconnect()
         if not used:
             return None
+        # all the lines of the component at once
+        mcubs, lowers, uppers = zip(*stamps)
+        core.add_many(cube.data, mcubs, lowers, uppers)
 
         return table
         #return []
@@ -126,12 +135,10 @@ class GaussianIMC(IMC):
     def _draw(self, cube, flux, freq, cutoff):
         new_pos = self.pos + self.offset
         mu, p = gclump_to_wcsgauss(new_pos, self.std, self.angle, freq, self.fwhm, self.gradient)
-        mcub, lower, upper =world_gaussian(cube.data,cube.wcs, mu, p, flux, cutoff)
-        if mcub==None:
-            return False
-        else:
-            cube.add_flux(cube.data,mcub, lower, upper)
-            return True
+        mcub, lower, upper = _world_gaussian(cube.data, mu, p, flux, cutoff, cube.wcs)
+        if mcub is None:
+            return None
+        return mcub, lower, upper
 
     def info(self):
         return "species = " + str(self.mol_list) + " temp = "+str(self.temp)+" offset = "+str(self.offset)+" std = "+str(self.std)+" angle = "+str(self.angle)+" fwhm = "+str(self.fwhm)+"  gradient = "+str(self.gradient)
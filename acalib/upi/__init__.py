@@ -1,3 +1,29 @@
-from .axes import *
-from .flux import *
-from .reduction import *
+import importlib
+
+from .._lazy import submodule as _submodule
+
+# Functions are imported on first access (PEP 562)
+_LAZY = {}
+for _module, _names in (('axes', ['axes_names', 'cut', 'cuts', 'extent', 'center', 'axes_units', 'resolution',
+                                  'spectral_velocities', 'features_chunks', 'features', 'opening', 'openings']),
+                        ('flux', ['noise_level', 'standarize', 'unstandarize', 'add', 'denoise', 'world_gaussian']),
+                        ('reduction', ['moment0', 'moment1', 'moment2', 'spectra'])):
+    for _name in _names:
+        _LAZY[_name] = _module
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    if not name.startswith('_'):
+        # Submodules (e.g. upi.axes) stay reachable as attributes, as when imported eagerly
+        return _submodule(__name__, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -32,10 +32,47 @@ def axes_names(data,wcs=None):
 
 from acalib.upi.formatting import _unitize, _world_table_creator
 
+class _Cutout(NDDataRef):
+    # NDDataRef over a view of the parent data, whose WCS is sliced from the
+    # parent WCS only when it is first accessed.
+    def __init__(self, data, slicer=None, **kwargs):
+        self._slicer = slicer
+        super(_Cutout, self).__init__(data, **kwargs)
+
+    @property
+    def wcs(self):
+        if self._wcs is None and self._slicer is not None:
+            self._wcs = self._slicer()
+            self._slicer = None
+        return self._wcs
+
+    @wcs.setter
+    def wcs(self, wcs):
+        if wcs is not None:
+            self._slicer = None
+        NDDataRef.wcs.fset(self, wcs)
+
+
+def _cutout(data, wcs, mask, unit, meta, mslab, cache=None):
+    mslab = tuple(mslab)
+    slicer = None
+    if wcs is not None:
+        key = tuple((int(sl.start), int(sl.stop)) for sl in mslab)
+
+        def slicer():
+            if cache is None:
+                return wcs.slice(mslab, numpy_order=True)
+            if key not in cache:
+                cache[key] = wcs.slice(mslab, numpy_order=True)
+            return cache[key]
+    smask = None if mask is None or np.isscalar(mask) else mask[mslab]
+    return _Cutout(data[mslab], slicer=slicer, mask=smask, unit=unit, meta=meta, copy=False)
+
+
 @support_nddata
-def cut(data, wcs=None, mask=None, unit=None, lower=None, upper=None):
+def cut(data, wcs=None, mask=None, unit=None, meta=None, lower=None, upper=None):
     """
-        Get the axes's names.
+        Get a cut (sub-cube) of the data.
 
         Parameters
         ----------
@@ -47,6 +84,8 @@ def cut(data, wcs=None, mask=None, unit=None, lower=None, upper=None):
             Mask for data.
         unit : astropy.units.Unit
             Astropy unit (http://docs.astropy.org/en/stable/units/).
+        meta : dict
+            Metadata of the data.
         lower : tuple
             Start coordinate from where to cut.
         upper : tuple
@@ -55,14 +94,69 @@ def cut(data, wcs=None, mask=None, unit=None, lower=None, upper=None):
         Returns
         -------
         result: astropy.nddata.NDDataRef.
-            data cut from lower to upper.
+            data cut from lower to upper, as a view of the data (the mask is cut as well, and the WCS
+            is sliced when first accessed).
 
     """
-    # Check for NDDataSlicing... maybe this is already done by astropy.nddata package.
     mslab = core.slab(data, lower, upper)
-    scube = data[mslab]
-    newwcs = wcs.slice(mslab, numpy_order=True)
-    return NDDataRef(scube, wcs=newwcs, unit=unit)
+    return _cutout(data, wcs, mask, unit, meta, mslab)
+
+
+@support_nddata
+def cuts(data, wcs=None, mask=None, unit=None, meta=None, lowers=None, uppers=None, centers=None, windows=None):
+    """
+        Get many cuts (e.g. postage stamps around catalog positions) of the data.
+
+        The boxes are given in pixels (lowers and uppers) or in world coordinates (centers and
+        windows, see :func:`openings`). Each cut is a view of the data (no copy is made, so a
+        memory-mapped cube is only read when the cut is used), with its mask, and its WCS is sliced
+        lazily and shared between the cuts of the same box.
+
+        Parameters
+        ----------
+        data : (M,N) or (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+            Astronomical data cube.
+        wcs : astropy.wcs.wcs.WCS
+            World Coordinate System to use.
+        mask : numpy.ndarray
+            Mask for data.
+        unit : astropy.units.Unit
+            Astropy unit (http://docs.astropy.org/en/stable/units/).
+        meta : dict
+            Metadata of the data.
+        lowers : list of tuples
+            Start coordinates of the cuts.
+        uppers : list of tuples
+            End coordinates of the cuts.
+        centers : list of astropy.units.quantity.Quantity
+            Centers of the cuts in WCS.
+        windows : list of astropy.units.quantity.Quantity
+            Windows of the cuts in WCS.
+
+        Returns
+        -------
+        result: list of astropy.nddata.NDDataRef
+            The cuts, in the order of the boxes.
+
+    """
+    if centers is not None:
+        if windows is None:
+            log.error("windows are needed with centers")
+            raise ValueError("windows are needed with centers")
+        if wcs is None:
+            log.error("A world coordinate system (WCS) is needed")
+            return None
+        lowers, uppers = _openings(data, centers, windows, wcs)
+    elif lowers is None or uppers is None:
+        log.error("Either lowers and uppers, or centers and windows are needed")
+        raise ValueError("Either lowers and uppers, or centers and windows are needed")
+    if len(lowers) != len(uppers):
+        log.error("lowers and uppers must have the same length")
+        raise ValueError("lowers and uppers must have the same length")
+    cache = dict()
+    return [_cutout(data, wcs, mask, unit, meta, core.slab(data, lower, upper), cache)
+            for lower, upper in zip(lowers, uppers)]
+
 
 @support_nddata
 def extent(data,wcs=None,lower=None,upper=None):
@@ -147,8 +241,12 @@ def axes_units(data,wcs=None):
     if wcs is None:
         log.error("A world coordinate system (WCS) is needed")
         return None
-    uvec=np.array(wcs.wcs.cunit)[::-1]
-    return uvec
+    return _axes_units(wcs)
+
+
+def _axes_units(wcs):
+    # Kernel of axes_units, for internal callers that already hold the WCS
+    return np.array(wcs.wcs.cunit)[::-1]
 
 @support_nddata
 def resolution(data,wcs=None):
@@ -218,6 +316,96 @@ def spectral_velocities(data,wcs=None,fqs=None,fqis=None,restfrq=None):
     return fqs.to(u.km/u.s, equivalencies=eq)
 
 
+def _separable_groups(wcs):
+    # Groups of WCS pixel axes (with their world axes) whose world coordinates
+    # do not depend on the other pixel axes, e.g. the celestial plane and the
+    # spectral axis of a cube.
+    naxis = wcs.wcs.naxis
+    try:
+        corr = np.asarray(wcs.axis_correlation_matrix)
+    except AttributeError:
+        return [(list(range(naxis)), list(range(naxis)))]
+    pending = set(range(naxis))
+    groups = []
+    while len(pending) > 0:
+        pix = np.zeros(naxis, dtype=bool)
+        pix[pending.pop()] = True
+        while True:
+            world = corr[:, pix].any(axis=1)
+            npix = corr[world].any(axis=0) | pix
+            if (npix == pix).all():
+                break
+            pix = npix
+        pending -= set(np.flatnonzero(pix))
+        groups.append((np.flatnonzero(pix).tolist(), np.flatnonzero(world).tolist()))
+    return groups
+
+
+def _world_chunks(data, wcs, lower, upper, chunk_size):
+    mslab = core.slab(data, lower, upper)
+    dim = data.ndim
+    start = np.array([sl.start for sl in mslab])
+    shape = tuple(int(sl.stop - sl.start) for sl in mslab)
+    size = int(np.prod(shape))
+
+    # World coordinates of each group of axes, computed once on its own grid
+    tables = []
+    for pix, world in _separable_groups(wcs):
+        axes = [dim - p - 1 for p in pix]
+        gshape = tuple(shape[a] for a in axes)
+        grid = np.indices(gshape).reshape(len(axes), -1)
+        ii = np.tile(start[::-1].astype(np.float64), (grid.shape[1], 1))
+        for k, p in enumerate(pix):
+            ii[:, p] += grid[k]
+        values = wcs.wcs_pix2world(ii, 0)[:, world]
+        tables.append((axes, gshape, [dim - w - 1 for w in world], values))
+
+    if chunk_size is None:
+        chunk_size = max(size, 1)
+    for first in range(0, size, chunk_size):
+        idx = np.unravel_index(np.arange(first, min(first + chunk_size, size)), shape)
+        f = np.empty((idx[0].size, dim))
+        for axes, gshape, cols, values in tables:
+            pos = np.ravel_multi_index(tuple(idx[a] for a in axes), gshape)
+            f[:, cols] = values[pos]
+        yield f
+
+
+@support_nddata
+def features_chunks(data,wcs=None,lower=None,upper=None,chunk_size=65536):
+    """
+        Generates the WCS axes of a section of the data in features format, by chunks.
+
+        World coordinates are computed once for each separable group of axes (e.g. the celestial
+        plane and the spectral axis) and broadcast to the voxels of each chunk, so the full set of
+        pixel indices is never built.
+
+        Parameters
+        ----------
+        data : (M,N) or (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+            Astronomical data cube.
+        wcs : astropy.wcs.wcs.WCS
+            World Coordinate System to use.
+        lower : (M,N) or (M,N,Z) tuple of integers
+            Start coordinate in data.
+        upper : (M,N) or (M,N,Z) tuple of integers
+            End coordinate in data.
+        chunk_size : int
+            Number of voxels of each chunk (None for a single chunk).
+
+        Returns
+        -------
+        result: generator of numpy.ndarray
+            (chunk_size, dim) arrays of world coordinates, in the order of the voxels of the section
+            and with the axes in the same order (and units) as the columns of :func:`features`.
+
+    """
+    if wcs is None:
+        log.error("A world coordinate system (WCS) is needed")
+        return iter(())
+    return _world_chunks(data, wcs, lower, upper, chunk_size)
+
+
 @support_nddata
 def features(data,wcs=None,lower=None,upper=None):
     """
@@ -243,9 +431,28 @@ def features(data,wcs=None,lower=None,upper=None):
     if wcs is None:
         log.error("A world coordinate system (WCS) is needed")
         return None
-    ii=core.index_features(data,lower,upper)
-    f=wcs.wcs_pix2world(ii.T,0)
-    return _world_table_creator(f,wcs)
+    return _world_table_creator(np.fliplr(_features(data, wcs, lower, upper)),wcs)
+
+
+def _features(data, wcs, lower=None, upper=None):
+    # Kernel of features: (N, dim) array of world coordinates, with the columns of the table
+    return next(_world_chunks(data, wcs, lower, upper, None), np.empty((0, data.ndim)))
+
+
+def _world_values(values, wcs):
+    # (N, dim) float array, in the units of the WCS axes, from plain values or (arrays of) quantities
+    units = np.array(wcs.wcs.cunit)[::-1]
+
+    def convert(x, unit):
+        if isinstance(x, u.Quantity) and u.dimensionless_unscaled not in (x.unit, unit):
+            return x.to_value(unit)
+        return getattr(x, 'value', x)
+
+    if isinstance(values, u.Quantity):
+        values = np.atleast_2d(values)
+        return np.array([convert(values[:, i], unit) for i, unit in enumerate(units)], dtype=np.float64).T
+    values = np.array(values, dtype=object, ndmin=2)
+    return np.array([[convert(x, unit) for x, unit in zip(row, units)] for row in values], dtype=np.float64)
 
 
 @support_nddata
@@ -274,19 +481,55 @@ def opening(data,center,window,wcs=None):
     if wcs is None:
         log.error("A world coordinate system (WCS) is needed")
         return None
-    off_low=center-window
-    off_low = np.array([x.value for x in off_low])
-    off_up = center+window
-    off_up = np.array([x.value for x in off_up])
-    #dim = len(center.colnames)
-    #off_low = np.array([center[0][i] - window[0][i] for i in range(dim)])
-    #off_up  = np.array([center[0][i] + window[0][i] for i in range(dim)])
-    ld=np.rint(wcs.wcs_world2pix([off_low[::-1]],0))
-    lu=np.rint(wcs.wcs_world2pix([off_up[::-1]],0))
-    lower=np.array([ld,lu]).min(axis=0)
-    upper=np.array([ld,lu]).max(axis=0)
-    lower=core.fix_limits(data,lower[0][::-1])
-    upper=core.fix_limits(data,upper[0][::-1])
-    return (lower,upper)
+    return _opening(data, center, window, wcs)
     #values=np.vstack((lower,upper))
     #return _pix_table_creator(values,wcs)
+
+
+def _opening(data, center, window, wcs):
+    # Kernel of opening, for internal callers with plain arrays and a WCS
+    lower, upper = _openings(data, [center], [window], wcs)
+    return (lower[0], upper[0])
+
+
+@support_nddata
+def openings(data,centers,windows,wcs=None):
+    """
+        Many fields of view (centers +- windows) converted to indices, with a single WCS transformation.
+
+        Parameters
+        ----------
+        data : (M,N) or (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+            Astronomical data cube.
+        centers : list of astropy.units.quantity.Quantity or (K,dim) numpy.ndarray
+            Centers of the fields of view in WCS (plain values are in the units of the WCS).
+        windows : list of astropy.units.quantity.Quantity or (K,dim) numpy.ndarray
+            Windows for the fields in WCS (plain values are in the units of the WCS).
+        wcs : astropy.wcs.wcs.WCS
+            World Coordinate System to use.
+
+        Returns
+        -------
+        result: ((K,dim) numpy.ndarray, (K,dim) numpy.ndarray)
+            Lower and upper indices of each field, clipped to the data.
+
+    """
+    if wcs is None:
+        log.error("A world coordinate system (WCS) is needed")
+        return None
+    return _openings(data, centers, windows, wcs)
+
+
+def _openings(data, centers, windows, wcs):
+    # Kernel of openings, for internal callers with plain arrays and a WCS
+    centers = _world_values(centers, wcs)
+    windows = _world_values(windows, wcs)
+    off_low = centers - windows
+    off_up = centers + windows
+    n = off_low.shape[0]
+    pix = np.rint(wcs.wcs_world2pix(np.vstack((off_low, off_up))[:, ::-1], 0))[:, ::-1]
+    lower = np.minimum(pix[:n], pix[n:])
+    upper = np.maximum(pix[:n], pix[n:])
+    lower = core.fix_limits(data, lower)
+    upper = core.fix_limits(data, upper)
+    return (lower, upper)
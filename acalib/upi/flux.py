@@ -1,8 +1,9 @@
 from astropy.nddata import support_nddata, NDDataRef
+from astropy import log
 from acalib import core
 import numpy as np
 
-from acalib.upi.axes import opening, features, axes_units
+from acalib.upi.axes import _opening, _features
 
 @support_nddata
 def noise_level(data,mask=None,unit=None):
@@ -31,7 +32,7 @@ def noise_level(data,mask=None,unit=None):
         return core.rms(data,mask)*unit
 
 @support_nddata
-def standarize(data, wcs=None, unit=None, mask=None, meta=None):
+def standarize(data, wcs=None, unit=None, mask=None, meta=None, out=None, inplace=False):
     """
         Standarize data:
 
@@ -44,6 +45,10 @@ def standarize(data, wcs=None, unit=None, mask=None, meta=None):
         unit : astropy.units.Unit
             Astropy Unit (http://docs.astropy.org/en/stable/units/)
         meta : FITS metadata
+        out : numpy.ndarray
+            Array for the result (not supported with a mask)
+        inplace : bool
+            Overwrite data with the result (not supported with a mask)
 
         Returns
         -------
@@ -51,13 +56,13 @@ def standarize(data, wcs=None, unit=None, mask=None, meta=None):
     """
     if mask is not None:
         data = core.fix_mask(data, mask)
-    (res, a, b) = core.standarize(data)
+    (res, a, b) = core.standarize(data, out=out, inplace=inplace)
     res = NDDataRef(res, uncertainty=None, mask=mask, wcs=wcs, meta=meta, unit=unit)
     return (res, a, b)
 
 
 @support_nddata
-def unstandarize(data, a, b, wcs=None, unit=None, mask=None, meta=None):
+def unstandarize(data, a, b, wcs=None, unit=None, mask=None, meta=None, out=None, inplace=False):
     """
         Unstandarize data: res = a * data + b
 
@@ -75,6 +80,10 @@ def unstandarize(data, a, b, wcs=None, unit=None, mask=None, meta=None):
         unit : astropy.units.Unit
             Astropy Unit (http://docs.astropy.org/en/stable/units/)
         meta : FITS metadata
+        out : numpy.ndarray
+            Array for the result (not supported with a mask)
+        inplace : bool
+            Overwrite data with the result (not supported with a mask)
 
         Returns
         -------
@@ -82,16 +91,17 @@ def unstandarize(data, a, b, wcs=None, unit=None, mask=None, meta=None):
     """
     if mask is not None:
         data = core.fix_mask(data, mask)
-    res = core.unstandarize(data, a, b)
+    res = core.unstandarize(data, a, b, out=out, inplace=inplace)
     return NDDataRef(res, uncertainty=None, mask=mask, wcs=wcs, meta=meta, unit=unit)
 
 
 @support_nddata
-def add(data, flux, lower=None, upper=None,wcs=None,unit=None,meta=None,mask=None):
+def add(data, flux, lower=None, upper=None,wcs=None,unit=None,meta=None,mask=None,out=None,inplace=False):
     """
         Create a new data with the new flux added.
 
-        Lower and upper are bounds for data. This operation is border-safe and creates a new object at each call.
+        Lower and upper are bounds for data. This operation is border-safe and creates a new object at each call,
+        unless *out* or *inplace* are given.
 
         Parameters
         ----------
@@ -107,6 +117,10 @@ def add(data, flux, lower=None, upper=None,wcs=None,unit=None,meta=None,mask=Non
         unit : astropy.units.Unit
             Astropy Unit (http://docs.astropy.org/en/stable/units/)
         meta : FITS metadata
+        out : numpy.ndarray
+            Array for the result, instead of a copy of data
+        inplace : bool
+            Add the flux to data itself
 
         Returns
         -------
@@ -114,16 +128,20 @@ def add(data, flux, lower=None, upper=None,wcs=None,unit=None,meta=None,mask=Non
 
     """
 
-    #Please use the OO version data.add(flux) for modifying the data itself.
-    res = data.copy()
-    core.add(res, flux, lower, upper)
+    if inplace:
+        if out is not None:
+            log.error("out can not be given for inplace operations")
+            raise ValueError("out can not be given for inplace operations")
+        res = core.add(data, flux, lower, upper)
+    else:
+        res = core.add(data, flux, lower, upper, out=data.copy() if out is None else out)
     return NDDataRef(res, uncertainty=None, mask=mask, wcs=wcs, meta=None, unit=unit)
 
 
 @support_nddata
-def denoise(data, wcs=None, mask=None, unit=None, threshold=0.0):
+def denoise(data, wcs=None, mask=None, unit=None, threshold=0.0, out=None, inplace=False):
     """
-        Simple denoising given a threshold (creates a new object)
+        Simple denoising given a threshold (creates a new object, unless *out* or *inplace* are given)
 
         Parameters
         ----------
@@ -133,14 +151,18 @@ def denoise(data, wcs=None, mask=None, unit=None, threshold=0.0):
             mask for the data
         unit : astropy.units.Unit
             Astropy Unit (http://docs.astropy.org/en/stable/units/)
-        threshold : float
+        threshold : float or astropy.units.Quantity
+        out : numpy.ndarray
+            Array for the result
+        inplace : bool
+            Overwrite data with the result
 
         Returns
         -------
         NDDataRef: Data denoised
 
     """
-    newdata = core.denoise(data, threshold.value)
+    newdata = core.denoise(data, getattr(threshold, 'value', threshold), out=out, inplace=inplace)
     return NDDataRef(newdata, uncertainty=None, mask=mask, wcs=wcs, meta=None, unit=unit)
 
 
@@ -169,13 +191,19 @@ def world_gaussian(data, mu, P, peak, cutoff, wcs=None):
         Tuple of gaussian flux and borders
 
     """
+    return _world_gaussian(data, mu, P, peak, cutoff, wcs)
+
+
+def _world_gaussian(data, mu, P, peak, cutoff, wcs):
+    # Kernel of world_gaussian, for internal callers (e.g. the IMC models drawing
+    # many clumps) with a plain array and a WCS
     Sigma = np.linalg.inv(P)
-    window = np.sqrt(2 * np.log(peak / cutoff) * np.diag(Sigma)) * axes_units(data, wcs=wcs)
-    lower, upper = opening(data, mu, window, wcs=wcs)
+    # plain window values, in the units of the WCS (as the axes of features)
+    window = np.sqrt(2 * np.log(peak / cutoff) * np.diag(Sigma))
+    lower, upper = _opening(data, mu, window, wcs)
     if np.any(np.array(upper - lower) <= 0):
         return None, lower, upper
-    feat = features(data, wcs=wcs, lower=lower, upper=upper)
-    feat = np.array(feat.columns.values())
+    feat = _features(data, wcs, lower, upper).T
     mu = np.array([x.value for x in mu])
     res = core.gaussian_function(mu, P, feat, peak)
     # TODO Not generic
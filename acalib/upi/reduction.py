@@ -4,6 +4,7 @@ from astropy import log
 import numpy as np
 import astropy.units as u
 from acalib import core
+from acalib.core.utils import da
 from acalib.upi.axes import spectral_velocities
 
 
@@ -18,6 +19,8 @@ def _moment(data,order,wcs=None,mask=None,unit=None,restfrq=None):
     rdim=data.ndim - 1 - dim
     v=spectral_velocities(data,wcs,fqis=np.arange(data.shape[rdim]),restfrq=restfrq)
     v=v.value
+    if core.is_dask(data):
+        return _moment_dask(data,order,v,rdim,wcs.dropaxis(dim),unit)
     m0=data.sum(axis=rdim)
     if order==0:
         mywcs=wcs.dropaxis(dim)
@@ -38,15 +41,38 @@ def _moment(data,order,wcs=None,mask=None,unit=None,restfrq=None):
     log.error("Order not supported")
     return None
 
+def _moment_dask(data,order,v,rdim,wcs,unit):
+    # Lazy moments of a dask cube; masked values do not contribute, and the
+    # pixels with every value masked are masked in the result.
+    mask=da.ma.getmaskarray(data)
+    data=da.where(mask,0.0,da.ma.getdata(data))
+    shape=[1]*data.ndim
+    shape[rdim]=-1
+    v=v.reshape(shape)
+    empty=mask.all(axis=rdim)
+    m0=data.sum(axis=rdim)
+    if order==0:
+        return NDDataRef(m0, uncertainty=None, mask=empty,wcs=wcs, meta=None, unit=unit)
+    m1=(data*v).sum(axis=rdim)/m0
+    if order==1:
+        return NDDataRef(m1, uncertainty=None, mask=empty,wcs=wcs, meta=None, unit=u.km/u.s)
+    var=(data*v*v).sum(axis=rdim)/m0 - m1*m1
+    m2=da.sqrt(da.maximum(var,0.0))
+    if order==2:
+        # as np.ma.sqrt, negative variances are masked
+        return NDDataRef(m2, uncertainty=None, mask=empty | (var < 0),wcs=wcs, meta=None, unit=u.km*u.km/u.s/u.s)
+    log.error("Order not supported")
+    return None
+
 # Should return a NDData
 @support_nddata
 def moment0(data,wcs=None,mask=None,unit=None,restfrq=None):
     """
-        Calculate moment 0 from a data cube.
+        Calculate moment 0 from a data cube (lazily, for a dask array).
 
         Parameters
         ----------
-        data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+        data : (M,N,Z) numpy.ndarray, dask.array.Array or astropy.nddata.NDData or astropy.nddata.NDDataRef
             Astronomical data cube.
         wcs : astropy.wcs.wcs.WCS
             World Coordinate System to use.
@@ -68,11 +94,11 @@ def moment0(data,wcs=None,mask=None,unit=None,restfrq=None):
 @support_nddata
 def moment1(data,wcs=None,mask=None,unit=None,restfrq=None):
     """
-        Calculate moment 1 from a data cube.
+        Calculate moment 1 from a data cube (lazily, for a dask array).
 
         Parameters
         ----------
-        data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData
+        data : (M,N,Z) numpy.ndarray, dask.array.Array or astropy.nddata.NDData
             Astronomical data cube.
         wcs : astropy.wcs.wcs.WCS
             World Coordinate System to use
@@ -94,11 +120,11 @@ def moment1(data,wcs=None,mask=None,unit=None,restfrq=None):
 @support_nddata
 def moment2(data,wcs=None,mask=None,unit=None,restfrq=None):
     """
-        Calculate moment 2 from a data cube.
+        Calculate moment 2 from a data cube (lazily, for a dask array).
 
         Parameters
         ----------
-        data : (M,N,Z) numpy.ndarray or astropy.nddata.NDData or astropy.nddata.NDDataRef
+        data : (M,N,Z) numpy.ndarray, dask.array.Array or astropy.nddata.NDData or astropy.nddata.NDDataRef
             Astronomical data cube.
         wcs : astropy.wcs.wcs.WCS
             World Coordinate System to use
@@ -0,0 +1,89 @@
+"""
+Benchmark of the GaussClumps chi-square evaluation.
+
+Compares the cost of one chi-square plus gradient evaluation (the unit of
+work of the BFGS optimizer) between the attic implementation and
+acalib.algorithms.GaussClumps, for several fitting window sizes.
+
+Usage: python benchmarks/bench_gaussclumps.py
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+import numpy as np
+
+from acalib.algorithms import gaussClumps as gc
+from acalib.algorithms.attic import gaussClumps as attic
+
+CONFIG = {'FWHMBEAM': 2.0, 'VELORES': 2.0, 'SA': 1.0, 'SB': 0.1, 'S0': 1.0, 'SC': 1.0,
+          'NWF': -1, 'MINWF': 0.8, 'MAXWF': 1.1, 'WWIDTH': 2.0, 'WMIN': 0.05}
+REPEAT = 200
+
+
+def problem(half):
+    rs = np.random.RandomState(0)
+    lb = np.zeros(3, dtype=int)
+    ub = np.array([2 * half + 1] * 3)
+    feat = gc._box_features(lb, ub)
+    par = np.array([5.0, 0.1, half, 3.0, half, 3.5, 0.3, half, 3.0, 0.05, -0.05])
+    val = gc.clump_model(par, feat, CONFIG) + par[1] + rs.normal(0, 1, feat.shape[1])
+    cval = np.array([half, half, half], dtype=np.float64)
+    fobs = np.array([half, half, half]) / 2.0
+    we = np.zeros(feat.shape[1])
+    for i in range(3):
+        w_off = (feat[i] - cval[i]) / (fobs[i] * CONFIG['WWIDTH'])
+        we += w_off * w_off
+    we = np.exp(-gc.K * we)
+    we[we < CONFIG['WMIN']] = 0.0
+    guess = par + rs.normal(0, 0.1, par.size)
+    return feat, val, we, cval, guess
+
+
+def attic_evaluator(feat, val, we, cval, guess):
+    old = attic.GaussClumps.__new__(attic.GaussClumps)
+    old.par = dict(CONFIG)
+    old.feat = feat
+    old.val = val
+    old.we = we.copy()
+    old.cval = cval
+    old.valmax = val.max()
+    old.guess = guess
+    old.bfsq = CONFIG['FWHMBEAM'] ** 2
+    old.velsq = CONFIG['VELORES'] ** 2
+    old.fixback = False
+    old.nf = 0
+    old.nwm = 0
+    old.old_par = None
+
+    def evaluate(par):
+        old.update_comp(par)
+        return old.get_chi2(par), old.get_jaco(par)
+    return evaluate
+
+
+def new_evaluator(feat, val, we, cval, guess):
+    valid = we > 0
+    fit = gc._ClumpFit(val[valid], feat[:, valid], we[valid], guess, cval, val.max(), False, CONFIG)
+    return fit.evaluate
+
+
+def timed(evaluate, guess):
+    pars = [guess * (1 + 1e-6 * i) for i in range(REPEAT)]
+    it = iter(pars)
+    return timeit.timeit(lambda: evaluate(next(it)), number=REPEAT) / REPEAT
+
+
+def main():
+    print("{:>8} {:>10} {:>14} {:>14} {:>8}".format("window", "voxels", "attic (ms)", "new (ms)", "speedup"))
+    for half in (5, 10, 15, 20):
+        prob = problem(half)
+        t_old = timed(attic_evaluator(*prob), prob[4])
+        t_new = timed(new_evaluator(*prob), prob[4])
+        print("{:>8} {:>10} {:>14.3f} {:>14.3f} {:>8.1f}".format(
+            2 * half + 1, prob[1].size, 1e3 * t_old, 1e3 * t_new, t_old / t_new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Benchmark of the acalib import time.
+
+Each statement is timed in a fresh interpreter (several times, keeping the
+best and the median), and the heavy dependencies loaded by it are listed, so
+startup regressions (e.g. an eager import of matplotlib) show up.
+
+Usage: python benchmarks/bench_import.py [repeat]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATEMENTS = ['import acalib',
+              'import acalib.core',
+              'from acalib import upi',
+              'from acalib.algorithms import GaussClumps',
+              'from acalib.io import Container',
+              'from acalib import *']
+HEAVY = ['matplotlib.pyplot', 'skimage', 'scipy.ndimage', 'scipy.optimize', 'pycupid', 'astropy.wcs', 'IPython']
+PROBE = """
+import sys, time
+t = time.time()
+{statement}
+t = time.time() - t
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(repr((t, heavy)))
+"""
+
+
+def timed(statement):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    out = subprocess.check_output([sys.executable, '-c', PROBE.format(statement=statement, heavy=HEAVY)],
+                                  env=env, cwd=ROOT, stderr=subprocess.DEVNULL)
+    return eval(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("{:<45} {:>10} {:>10}  {}".format("statement", "best (ms)", "median", "heavy modules loaded"))
+    for statement in STATEMENTS:
+        try:
+            runs = [timed(statement) for i in range(repeat)]
+        except subprocess.CalledProcessError:
+            print("{:<45} {:>10}".format(statement, "failed"))
+            continue
+        times = np.array([run[0] for run in runs])
+        print("{:<45} {:>10.1f} {:>10.1f}  {}".format(
+            statement, 1e3 * times.min(), 1e3 * np.median(times), ', '.join(runs[0][1])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
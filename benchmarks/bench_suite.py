@@ -0,0 +1,223 @@
+"""
+Offline benchmark suite for acalib.core, acalib.upi and acalib.algorithms.
+
+Every case runs on deterministic synthetic data (Gaussian clumps plus noise,
+generated with plain NumPy from a fixed seed) at several sizes, so no file has
+to be downloaded and results are comparable between commits and machines.
+For each case the best and median wall time of several runs and the peak
+memory allocated during one run (through tracemalloc, which also follows the
+NumPy buffers) are recorded.
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes small,medium] [--filter rms]
+                                     [--repeat 3] [--output report.json]
+                                     [--compare baseline.json]
+
+The JSON report holds the environment (commit, versions, platform) and one
+record per (case, size), so two reports can be compared with --compare.
+
+GMS and Indexing are skipped on NumPy 2 (GMS uses np.lib.pad, which was
+removed), and cases whose dependencies are missing (e.g. ClumpFind without
+pycupid) are recorded as errors.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import astropy
+import astropy.units as u
+from astropy.nddata import NDData
+from astropy.wcs import WCS
+
+from acalib import core, upi
+from acalib.algorithms import GMS, Indexing, ClumpFind, FellWalker, Stacking
+
+SEED = 1234
+# (channels, rows, cols); GMS scales its windows with the image size in
+# percent, so images must be at least 100 pixels wide.
+SIZES = {'small': (32, 100, 100),
+         'medium': (64, 160, 160),
+         'large': (128, 256, 256)}
+NOISE = 0.05
+# GMS (and Indexing, which runs it) pads with np.lib.pad, removed in NumPy 2
+PAD_MISSING = None if hasattr(np.lib, 'pad') else "GMS uses np.lib.pad, removed in NumPy 2"
+
+
+def synthetic_cube(shape, clumps=8, seed=SEED):
+    """ Noisy cube with randomly placed (but seeded) Gaussian clumps. """
+    rs = np.random.RandomState(seed)
+    grid = np.ogrid[tuple(slice(0, n) for n in shape)]
+    cube = rs.normal(0, NOISE, shape)
+    for i in range(clumps):
+        centre = rs.uniform(0.2, 0.8, len(shape)) * shape
+        sigma = rs.uniform(0.03, 0.08, len(shape)) * shape
+        arg = sum(((x - c) / s) ** 2 for x, c, s in zip(grid, centre, sigma))
+        cube += rs.uniform(0.5, 2.0) * np.exp(-0.5 * arg)
+    return cube
+
+
+def synthetic_wcs(shape):
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN', 'FREQ']
+    wcs.wcs.cunit = ['deg', 'deg', 'Hz']
+    wcs.wcs.crpix = [shape[2] / 2.0, shape[1] / 2.0, shape[0] / 2.0]
+    wcs.wcs.crval = [83.8, -5.4, 230.5e9]
+    wcs.wcs.cdelt = [-1e-4, 1e-4, 1e6]
+    wcs.wcs.restfrq = 230.5e9
+    wcs.wcs.set()
+    return wcs
+
+
+def synthetic_images(shape, count=4, seed=SEED):
+    """ Template image and shifted, rotated noisy copies of it. """
+    rs = np.random.RandomState(seed)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    cy, cx = shape[0] / 2.0, shape[1] / 2.0
+
+    def image(dy, dx, angle):
+        c, s = np.cos(angle), np.sin(angle)
+        yy, xx = y - cy - dy, x - cx - dx
+        a, b = c * xx + s * yy, -s * xx + c * yy
+        return np.exp(-(a / (0.2 * shape[1])) ** 2 - (b / (0.08 * shape[0])) ** 2)
+
+    template = image(0, 0, 0.0)
+    images = [image(dy, dx, angle) + rs.normal(0, NOISE, shape)
+              for dy, dx, angle in rs.uniform(-0.05, 0.05, (count, 3)) * [shape[0], shape[1], 10]]
+    return template, images
+
+
+# Each case maps a cube shape to (function, args, kwargs); the data is built once per
+# size, outside the measured region. Cases with a skip reason are reported but not run.
+def cases():
+    def cube(shape):
+        return synthetic_cube(shape)
+
+    def nddata(shape):
+        return NDData(synthetic_cube(shape), wcs=synthetic_wcs(shape), unit=u.Jy)
+
+    def image(shape):
+        return synthetic_cube(shape).sum(axis=0)
+
+    return [
+        ('core.rms', lambda s: (core.rms, (cube(s),), {}), None),
+        ('core.snr_estimation', lambda s: (core.snr_estimation, (cube(s),), {}), None),
+        ('core.spectra_sketch', lambda s: (core.spectra_sketch, (cube(s), 1000), {'random_state': SEED}), None),
+        ('upi.moment0', lambda s: (upi.moment0, (nddata(s),), {}), None),
+        ('upi.moment1', lambda s: (upi.moment1, (nddata(s),), {}), None),
+        ('upi.moment2', lambda s: (upi.moment2, (nddata(s),), {}), None),
+        ('GMS.run', lambda s: (GMS().run, (image(s),), {}), PAD_MISSING),
+        ('Indexing.run', lambda s: (Indexing({'RANDOM_STATE': SEED}).run, (cube(s),), {}), PAD_MISSING),
+        ('ClumpFind.run', lambda s: (ClumpFind({'RMS': NOISE}).run, (cube(s),), {}), None),
+        ('FellWalker.run', lambda s: (FellWalker({'RMS': NOISE}).run, (cube(s),), {}), None),
+        ('Stacking.run', lambda s: (Stacking().run, synthetic_images(s[1:]), {}), None),
+    ]
+
+
+def measure(func, args, kwargs, repeat):
+    """ Best and median wall time (s) over `repeat` runs, and peak traced memory (bytes) of one run. """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'astropy': astropy.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'seed': SEED,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(records, baseline):
+    base = {(r['name'], r['size']): r for r in baseline['results']}
+    print("\n{:<22} {:>8} {:>12} {:>12} {:>9} {:>9}".format(
+        "case", "size", "base (ms)", "new (ms)", "time", "memory"))
+    for r in records:
+        old = base.get((r['name'], r['size']))
+        if old is None or 'best' not in old or 'best' not in r:
+            continue
+        print("{:<22} {:>8} {:>12.2f} {:>12.2f} {:>8.2f}x {:>8.2f}x".format(
+            r['name'], r['size'], 1e3 * old['best'], 1e3 * r['best'],
+            r['best'] / old['best'], r['peak_bytes'] / max(old['peak_bytes'], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium', help="comma separated, from: " + ', '.join(SIZES))
+    parser.add_argument('--filter', default='', help="only run cases whose name contains this string")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--compare', help="JSON report to compare against")
+    opts = parser.parse_args()
+    # deprecation and numerical warnings of the measured code only clutter the table
+    warnings.simplefilter('ignore')
+
+    records = []
+    print("{:<22} {:>8} {:>18} {:>10} {:>10} {:>12}".format(
+        "case", "size", "shape", "best (ms)", "median", "peak (MiB)"))
+    for size in opts.sizes.split(','):
+        shape = SIZES[size]
+        for name, setup, skip in cases():
+            if opts.filter not in name:
+                continue
+            record = {'name': name, 'size': size, 'shape': list(shape)}
+            if skip is not None:
+                record['skipped'] = skip
+                print("{:<22} {:>8} {:>18}  skipped ({})".format(name, size, str(tuple(shape)), skip))
+                records.append(record)
+                continue
+            try:
+                func, args, kwargs = setup(shape)
+                record['best'], record['median'], record['peak_bytes'] = measure(func, args, kwargs, opts.repeat)
+            except Exception as e:
+                # e.g. ClumpFind without pycupid
+                record['error'] = '{}: {}'.format(type(e).__name__, e)
+                print("{:<22} {:>8} {:>18}  skipped ({})".format(name, size, str(tuple(shape)), record['error']))
+            else:
+                print("{:<22} {:>8} {:>18} {:>10.2f} {:>10.2f} {:>12.2f}".format(
+                    name, size, str(tuple(shape)), 1e3 * record['best'], 1e3 * record['median'],
+                    record['peak_bytes'] / 2.0 ** 20))
+            records.append(record)
+
+    report = {'environment': environment(), 'repeat': opts.repeat, 'results': records}
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if opts.compare:
+        with open(opts.compare) as f:
+            compare(records, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
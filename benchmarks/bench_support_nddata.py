@@ -0,0 +1,83 @@
+"""
+Per-call overhead of the @support_nddata wrappers of acalib.upi and acalib.core.
+
+Each public function is timed when called with an NDData, with a plain array
+and a WCS keyword, and through its undecorated kernel (the fast path used by
+the internal callers, e.g. world_gaussian, the IMC models and Indexing), on
+inputs small enough for the wrapper to dominate the call.
+
+Usage: python benchmarks/bench_support_nddata.py [number]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import astropy.units as u
+from astropy.nddata import NDData
+
+from acalib import core, upi
+from acalib.upi import axes, flux
+
+from bench_suite import synthetic_cube, synthetic_wcs
+
+SHAPE = (16, 24, 24)
+
+
+def cases():
+    data = synthetic_cube(SHAPE)
+    wcs = synthetic_wcs(SHAPE)
+    cube = NDData(data, wcs=wcs, unit=u.Jy)
+    mu = [230.5e9 * u.Hz, -5.4 * u.deg, 83.8 * u.deg]
+    window = [2e6 * u.Hz, 3e-4 * u.deg, 3e-4 * u.deg]
+    P = np.diag([1 / 2e6 ** 2, 1 / 2e-4 ** 2, 1 / 2e-4 ** 2])
+    lower, upper = (6, 10, 10), (10, 14, 14)
+    image = data.sum(axis=0)
+    labeled = [(image > np.percentile(image, 90)).astype(int)]
+
+    # name: (decorated with NDData, decorated with array and wcs, kernel)
+    return [
+        ('axes_units', (lambda: upi.axes_units(cube),
+                        lambda: upi.axes_units(data, wcs=wcs),
+                        lambda: axes._axes_units(wcs))),
+        ('opening', (lambda: upi.opening(cube, mu, window),
+                     lambda: upi.opening(data, mu, window, wcs=wcs),
+                     lambda: axes._opening(data, mu, window, wcs))),
+        ('features', (lambda: upi.features(cube, lower=lower, upper=upper),
+                      lambda: upi.features(data, wcs=wcs, lower=lower, upper=upper),
+                      lambda: axes._features(data, wcs, lower, upper))),
+        ('world_gaussian', (lambda: flux.world_gaussian(cube, mu, P, 1.0, 0.01),
+                            lambda: flux.world_gaussian(data, mu, P, 1.0, 0.01, wcs=wcs),
+                            lambda: flux._world_gaussian(data, mu, P, 1.0, 0.01, wcs))),
+        ('measure_shape', (lambda: core.measure_shape(NDData(image), labeled),
+                           lambda: core.measure_shape(image, labeled),
+                           lambda: core.analysis._measure_shape(image, labeled))),
+    ]
+
+
+def best(func, number):
+    """ Best time per call (us) over 5 rounds of `number` calls. """
+    return 1e6 * min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # unit conversion and numerical warnings of the measured code only clutter the table
+    warnings.simplefilter('ignore')
+    print("{:<16} {:>12} {:>12} {:>12} {:>10}".format("function", "NDData (us)", "array (us)", "kernel (us)", "saved"))
+    for name, funcs in cases():
+        nddata, array, kernel = [best(f, number) for f in funcs]
+        print("{:<16} {:>12.1f} {:>12.1f} {:>12.1f} {:>9.0f}%".format(
+            name, nddata, array, kernel, 100 * (1 - kernel / nddata)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,6 +39,25 @@ class TestAnalysis(unittest.TestCase):
         np.testing.assert_almost_equal(acaana.integrate(data3d,axis=1),result1axis)
         np.testing.assert_almost_equal(acaana.integrate(data3d,axis=2),result2axis)
 
+    def test_integrate_chunked(self):
+        random = np.random.RandomState(0)
+        data = random.rand(7,4,5)
+        mask = data < 0.2
+        mask[:,1,1] = True
+        for chunk in (1, 3, None):
+            for axis in (0, 1, (1,2), (0,2)):
+                np.testing.assert_allclose(acaana.integrate(data,axis=axis,chunk=chunk),data.sum(axis=axis))
+                expected = np.sum(np.ma.MaskedArray(data,mask),axis=axis)
+                result = acaana.integrate(data,mask,axis=axis,chunk=chunk)
+                np.testing.assert_equal(np.ma.getmaskarray(result),np.ma.getmaskarray(expected))
+                np.testing.assert_allclose(result.filled(0),expected.filled(0))
+        # the mask of a masked array is combined with the given one
+        masked = np.ma.MaskedArray(data,data > 0.9)
+        expected = np.sum(np.ma.MaskedArray(masked,mask),axis=0)
+        result = acaana.integrate(masked,mask,chunk=2)
+        np.testing.assert_equal(np.ma.getmaskarray(result),np.ma.getmaskarray(expected))
+        np.testing.assert_allclose(result.filled(0),expected.filled(0))
+
 
     def test_spectra_sketch(self):
         random = np.random.RandomState(0)
@@ -106,5 +125,53 @@ class TestAnalysis(unittest.TestCase):
 
         np.testing.assert_almost_equal(acaana.vel_stacking(data,slice(3,5)), result)
 
+    def test_vel_stacking_many(self):
+        random = np.random.RandomState(0)
+        data = random.rand(10,5,5)
+        slices = [slice(3,5),slice(0,7),slice(6,10)]
+        results = acaana.vel_stacking(data,slices,chunk=3)
+        for sl,result in zip(slices,results):
+            np.testing.assert_almost_equal(result,data[sl].sum(axis=0))
+        labels = np.array([0,0,1,1,-1,0,2,2,2,1])
+        results = acaana.vel_stacking(data,labels)
+        for label,result in zip(range(3),results):
+            np.testing.assert_almost_equal(result,data[labels==label].sum(axis=0))
+
+    def test_vel_stacking_selectors(self):
+        random = np.random.RandomState(0)
+        data = random.rand(10,5,5)
+        channels = np.zeros(10, dtype=bool)
+        channels[[2,3,7]] = True
+        np.testing.assert_almost_equal(acaana.vel_stacking(data,channels),data[channels].sum(axis=0))
+        np.testing.assert_almost_equal(acaana.vel_stacking(data,[2,3,4]),data[2:5].sum(axis=0))
+        np.testing.assert_almost_equal(acaana.vel_stacking(data,np.array([2,3,4])),data[2:5].sum(axis=0))
+        np.testing.assert_almost_equal(acaana.vel_stacking(data,4),data[4])
+
+    def test_index_features(self):
+        data = np.zeros((3,4,5))
+        result = acaana.index_features(data,lower=(1,0,2),upper=(3,2,4))
+        mesh = np.mgrid[1:3,0:2,2:4]
+        np.testing.assert_equal(result.shape,(3,8))
+        for i in range(3):
+            np.testing.assert_equal(result[2-i],mesh[i].ravel())
+
+    @unittest.skipIf(acaana.da is None, "dask not installed")
+    def test_dask(self):
+        np.random.seed(0)
+        data = np.random.rand(8,6,6) - 0.3
+        mask = data < 0
+        lazy = acaana.da.from_array(data, chunks=(3,4,4))
+        result = acaana.rms(lazy, mask)
+        self.assertIsInstance(result, acaana.da.Array)
+        np.testing.assert_almost_equal(result.compute(), acaana.rms(data, mask))
+        for axis in (0, (1,2)):
+            result = acaana.integrate(lazy, mask, axis=axis)
+            self.assertIsInstance(result, acaana.da.Array)
+            np.testing.assert_allclose(result.compute(), acaana.integrate(data, mask, axis=axis))
+        slices = [slice(0,3), slice(2,8,2)]
+        for lazy_img, img in zip(acaana.vel_stacking(lazy, slices), acaana.vel_stacking(data, slices)):
+            self.assertIsInstance(lazy_img, acaana.da.Array)
+            np.testing.assert_allclose(lazy_img.compute(), img)
+
 if __name__ == '__main__':
     unittest.main()     
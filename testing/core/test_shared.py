@@ -0,0 +1,36 @@
+import unittest
+import sys
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append("../..")
+from acalib.core.shared import SharedCube
+
+
+def _plane_sum(shared, i):
+    return shared.data[i].sum(), shared.data.flags.writeable, shared.mask[i].sum()
+
+
+class TestShared(unittest.TestCase):
+    data = np.random.RandomState(0).normal(size=(6,20,20))
+
+    def test_workers(self):
+        for backend in ("shm", "memmap"):
+            with SharedCube(self.data, mask=self.data > 1, backend=backend) as shared:
+                np.testing.assert_equal(shared.data, self.data)
+                with ProcessPoolExecutor(max_workers=2) as pool:
+                    result = list(pool.map(_plane_sum, [shared] * 6, range(6)))
+            np.testing.assert_allclose([r[0] for r in result], self.data.sum(axis=(1,2)))
+            np.testing.assert_equal([r[1] for r in result], [False] * 6)
+            np.testing.assert_equal([r[2] for r in result], (self.data > 1).sum(axis=(1,2)))
+            self.assertTrue(shared.closed)
+            if backend == "memmap":
+                self.assertFalse(os.path.exists(shared.name))
+
+    def test_writable(self):
+        with SharedCube(self.data, writable=True) as shared:
+            shared.data[0,0,0] = 10.0
+            self.assertIsNone(shared.mask)
+        with SharedCube(self.data) as shared:
+            self.assertFalse(shared.data.flags.writeable)
+        self.assertRaises(ValueError, lambda: shared.data)
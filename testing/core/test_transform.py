@@ -0,0 +1,130 @@
+import unittest
+import sys
+import numpy as np
+sys.path.append("../..")
+import acalib.core.transform as acatr
+
+
+class TestTransform(unittest.TestCase):
+    def test_remove_isolate(self):
+        caa2d = -np.ones((6,6),dtype=int)
+        caa2d[1:4,1:4] = 0
+        caa2d[5,5] = 0
+        result = acatr.remove_isolate(caa2d, frac=0.3)
+        expected = -np.ones((6,6),dtype=int)
+        expected[1:4,1:4] = 0
+        np.testing.assert_equal(result,expected)
+
+        caa3d = -np.ones((5,5,5),dtype=int)
+        caa3d[2,2,2] = 0
+        caa3d[0,0,0] = 0
+        caa3d[0,0,1] = 0
+        result = acatr.remove_isolate(caa3d, frac=0.15)
+        expected = -np.ones((5,5,5),dtype=int)
+        expected[0,0,0] = 0
+        expected[0,0,1] = 0
+        np.testing.assert_equal(result,expected)
+
+        result = acatr.remove_isolate(caa2d, frac=0.5, centre=False)
+        assert(result[2,0] == 0)
+        assert(result[0,0] == -1)
+        assert(result[5,5] == -1)
+
+    def test_fits_props_batch(self):
+        y,x = np.mgrid[:40,:40]
+        img1 = np.exp(-((x-20)**2/50.0+(y-18)**2/10.0))
+        img2 = np.exp(-((x-15)**2/10.0+(y-22)**2/50.0))
+        props = acatr.fits_props_batch([img1,img2,img1])
+        assert(props[0] is props[2])
+        for img,prop in zip([img1,img2],props):
+            single = acatr.fits_props(img)
+            for key in ['centroid','major','minor','angle','area']:
+                np.testing.assert_almost_equal(prop[key],single[key])
+        np.testing.assert_almost_equal(props[0]['centroid'],(18.0,20.0))
+        assert(props[0]['major'] > props[0]['minor'])
+        np.testing.assert_almost_equal(abs(props[1]['angle']),0.0)
+
+    def test_affine_stack(self):
+        y,x = np.mgrid[:40,:40]
+        template = np.exp(-((x-20)**2/50.0+(y-18)**2/10.0))
+        rotated = np.exp(-((x-21)**2/10.0+(y-20)**2/50.0))
+        tprops = acatr.fits_props(template)
+        result = acatr.affine_stack([template,rotated],tprops)
+        np.testing.assert_equal(result.shape,template.shape)
+        np.testing.assert_allclose(result,template,atol=0.05)
+
+    def test_rotate_workers(self):
+        y,x = np.mgrid[:40,:40]
+        imgs = [np.exp(-((x-20)**2/50.0+(y-18)**2/10.0)),np.exp(-((x-15)**2/10.0+(y-22)**2/50.0))]
+        rotated,angles = acatr.rotate(imgs,0.5)
+        rotated2,angles2 = acatr.rotate(imgs,0.5,workers=2)
+        np.testing.assert_equal(angles,angles2)
+        for img,img2 in zip(rotated,rotated2):
+            np.testing.assert_equal(img,img2)
+        aligned = acatr.crop_and_align(rotated,angles)
+        aligned2 = acatr.crop_and_align(rotated,angles,workers=2)
+        for img,img2 in zip(aligned,aligned2):
+            np.testing.assert_equal(img,img2)
+
+    def test_denoise(self):
+        data = np.random.RandomState(0).normal(size=(4,5,6)).astype(np.float32)
+        data[0,0,0] = np.nan
+        expected = np.where(data > 0.5, data, 0)
+        result = acatr.denoise(data,0.5)
+        np.testing.assert_equal(result.dtype,np.float32)
+        np.testing.assert_equal(result,expected)
+        out = np.empty_like(data)
+        self.assertIs(acatr.denoise(data,0.5,out=out),out)
+        np.testing.assert_equal(out,expected)
+        self.assertIs(acatr.denoise(data,0.5,inplace=True),data)
+        np.testing.assert_equal(data,expected)
+        ints = np.arange(24).reshape(2,3,4)
+        self.assertIs(acatr.denoise(ints,10,inplace=True),ints)
+        np.testing.assert_equal(ints,np.where(np.arange(24) > 10,np.arange(24),0).reshape(2,3,4))
+
+    @unittest.skipIf(acatr.utils.da is None, "dask not installed")
+    def test_denoise_dask(self):
+        data = np.random.RandomState(0).normal(size=(4,5,6))
+        data[0,0,0] = np.nan
+        lazy = acatr.utils.da.from_array(data, chunks=(2,3,3))
+        result = acatr.denoise(lazy,0.5)
+        self.assertIsInstance(result, acatr.utils.da.Array)
+        np.testing.assert_equal(result.compute(),acatr.denoise(data,0.5))
+        self.assertRaises(ValueError, acatr.denoise, lazy, 0.5, inplace=True)
+
+    def test_standarize(self):
+        data = np.random.RandomState(0).normal(size=(4,5,6)).astype(np.float32)
+        res,a,b = acatr.standarize(data)
+        np.testing.assert_equal(res.dtype,np.float32)
+        np.testing.assert_almost_equal(res.sum(),1.0,decimal=5)
+        np.testing.assert_allclose(acatr.unstandarize(res,a,b),data,atol=1e-5)
+        copy = data.copy()
+        acatr.standarize(copy,inplace=True)
+        np.testing.assert_equal(copy,res)
+        ints = np.arange(24).reshape(2,3,4)
+        self.assertRaises(ValueError, acatr.standarize, ints, inplace=True)
+        self.assertRaises(ValueError, acatr.unstandarize, ints, 2.0, 1.0, inplace=True)
+        np.testing.assert_equal(acatr.unstandarize(ints,2.0,1.0),2.0*ints+1.0)
+
+    def test_add(self):
+        data = np.zeros((5,5),dtype=np.float32)
+        out = np.empty_like(data)
+        acatr.add(data,np.ones((3,3)),[-1,-1],[2,2],out=out)
+        np.testing.assert_equal(data.sum(),0)
+        np.testing.assert_equal(out[:2,:2],np.ones((2,2)))
+        np.testing.assert_equal(out.sum(),4)
+        acatr.add(data,np.ones((3,3)),[3,3],[6,6])
+        np.testing.assert_equal(data.sum(),4)
+
+    def test_add_many(self):
+        random = np.random.RandomState(0)
+        stamps = [random.normal(size=tuple(random.randint(1,6,3))) for i in range(50)]
+        lowers = [random.randint(-4,12,3) for i in range(50)]
+        uppers = [lower+stamp.shape for lower,stamp in zip(lowers,stamps)]
+        expected = np.zeros((10,12,12))
+        for stamp,lower,upper in zip(stamps,lowers,uppers):
+            acatr.add(expected,stamp,lower,upper)
+        result = acatr.add_many(np.zeros((10,12,12)),stamps,lowers,uppers)
+        np.testing.assert_allclose(result,expected)
+        result = acatr.add_many(np.zeros((10,12,12)),stamps,lowers,uppers,workers=3)
+        np.testing.assert_allclose(result,expected)
@@ -0,0 +1,143 @@
+import unittest
+import sys
+import os
+import pickle
+import tempfile
+import warnings
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+from astropy.nddata import NDData
+from astropy.wcs import WCS
+sys.path.append("../..")
+import acalib.io.fits as acafits
+from acalib.io.container import Container, load_fits
+
+
+class TestFits(unittest.TestCase):
+    data = np.random.RandomState(0).normal(size=(5,7,13)).astype(np.float32)
+
+    def test_nan_mask(self):
+        ndd = acafits.HDU_to_NDData(fits.PrimaryHDU(self.data.copy()))
+        self.assertIsNone(ndd.mask)
+
+        data = self.data.copy()
+        data[1,2,3] = np.nan
+        data[4,6,12] = np.nan
+        ref = np.isnan(data)
+        chunk = acafits._NAN_CHUNK
+        acafits._NAN_CHUNK = 20
+        try:
+            mask = acafits.HDU_to_NDData(fits.PrimaryHDU(data)).mask
+            self.assertIsInstance(mask, acafits.NaNMask)
+            np.testing.assert_equal(np.asarray(mask), ref)
+        finally:
+            acafits._NAN_CHUNK = chunk
+        self.assertEqual(mask.packed.shape, (5,7,2))
+        self.assertEqual(mask.shape, ref.shape)
+        np.testing.assert_equal(mask[1:3,2], ref[1:3,2])
+        np.testing.assert_equal(mask[...,3], ref[...,3])
+        np.testing.assert_equal(~mask, ~ref)
+        self.assertEqual(mask.sum(), 2)
+        np.testing.assert_equal(np.asarray(pickle.loads(pickle.dumps(mask))), ref)
+
+    def test_nan_mask_inplace(self):
+        data = self.data.copy()
+        data[1,2,3] = np.nan
+        ndd = acafits.HDU_to_NDData(fits.PrimaryHDU(data))
+        # the mask is taken at load, in-place changes of the data do not clear it
+        ndd.data[...] = 0.0
+        self.assertEqual(np.asarray(ndd.mask).sum(), 1)
+
+    def test_nan_mask_stokes(self):
+        data = np.random.RandomState(1).normal(size=(2,3,4,9))
+        data[:,0,0,0] = np.nan
+        data[0,1,1,1] = np.nan
+        ndd = acafits.HDU_to_NDData(fits.PrimaryHDU(data))
+        self.assertEqual(ndd.mask.shape, (3,4,9))
+        np.testing.assert_equal(np.asarray(ndd.mask), np.logical_and.reduce(np.isnan(data), axis=0))
+
+    def test_table(self):
+        table = Table(rows=np.random.RandomState(2).normal(size=(20,3)), names=["CentroidRa", "CentroidDec", "Area"],
+                      meta={"name": "Object Shapes", "min_freq_hz": 1.5e11})
+        cont = Container()
+        cont.primary = acafits.HDU_to_NDData(fits.PrimaryHDU(self.data))
+        cont.tables.append(table)
+        fd, path = tempfile.mkstemp(suffix=".fits")
+        os.close(fd)
+        try:
+            with warnings.catch_warnings():
+                # long meta keywords are written as HIERARCH cards
+                warnings.simplefilter("ignore")
+                cont.save_fits(path)
+            loaded = load_fits(path).tables[0]
+            self.assertEqual(loaded.colnames, table.colnames)
+            for name in table.colnames:
+                np.testing.assert_equal(loaded[name], table[name])
+            self.assertEqual(loaded.meta["NAME"], "Object Shapes")
+            self.assertEqual(loaded.meta["min_freq_hz"], 1.5e11)
+            self.assertNotIn("TTYPE1", loaded.meta)
+
+            with fits.open(path, memmap=True) as hdulist:
+                hdu = hdulist[1]
+                area = acafits.HDU_to_Table(hdu, columns=["Area"])
+                self.assertEqual(area.colnames, ["Area"])
+                self.assertTrue(np.shares_memory(area["Area"], hdu.data))
+                self.assertRaises(ValueError, acafits.HDU_to_Table, hdu, columns=["Flux"])
+                del area
+        finally:
+            os.remove(path)
+
+    def test_load_columns(self):
+        random = np.random.RandomState(4)
+        shapes = Table(rows=random.normal(size=(5,2)), names=["Area", "Flux"])
+        lines = Table(rows=random.normal(size=(3,2)), names=["Freq", "Flux"])
+        fd, path = tempfile.mkstemp(suffix=".fits")
+        os.close(fd)
+        try:
+            fits.HDUList([fits.PrimaryHDU(self.data), fits.BinTableHDU(shapes, name="SHAPES"),
+                          fits.BinTableHDU(lines, name="LINES")]).writeto(path, overwrite=True)
+            tables = load_fits(path, columns=["Area", "Flux"]).tables
+            self.assertEqual(tables[0].colnames, ["Area", "Flux"])
+            self.assertEqual(tables[1].colnames, ["Flux"])
+            np.testing.assert_equal(tables[1]["Flux"], lines["Flux"])
+            tables = load_fits(path, columns={"shapes": ["Area"], "LINES": ["Freq"]}).tables
+            self.assertEqual(tables[0].colnames, ["Area"])
+            self.assertEqual(tables[1].colnames, ["Freq"])
+            tables = load_fits(path, columns={"LINES": ["Freq"]}).tables
+            self.assertEqual(tables[0].colnames, ["Area", "Flux"])
+            self.assertRaises(ValueError, load_fits, path, columns={"SHAPES": ["Freq"]})
+            del tables
+        finally:
+            os.remove(path)
+
+    def test_save_dtype_compression(self):
+        data = self.data.astype(np.float64)
+        wcs = WCS(naxis=3)
+        table = Table(rows=np.random.RandomState(3).normal(size=(4,2)), names=["a", "b"])
+        cont = Container()
+        cont.primary = NDData(data, wcs=wcs)
+        cont.images.append(NDData(2 * data, wcs=wcs))
+        cont.tables.append(table)
+        fd, path = tempfile.mkstemp(suffix=".fits")
+        os.close(fd)
+        try:
+            cont.save_fits(path, dtype=np.float32, compression="RICE_1")
+            with fits.open(path) as hdulist:
+                self.assertEqual([type(hdu) for hdu in hdulist],
+                                 [fits.PrimaryHDU, fits.CompImageHDU, fits.BinTableHDU])
+            loaded = load_fits(path)
+            self.assertEqual(len(loaded.images), 2)
+            for image in loaded.images:
+                self.assertEqual(image.data.dtype, np.float32)
+            # the primary HDU is not compressed, the extension is quantized by RICE_1
+            np.testing.assert_allclose(loaded.primary.data, data, rtol=1e-6)
+            np.testing.assert_allclose(loaded.images[1].data, 2 * data, atol=0.25)
+            for name in table.colnames:
+                np.testing.assert_equal(loaded.tables[0][name], table[name])
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
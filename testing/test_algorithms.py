@@ -59,8 +59,9 @@ class TestCF(unittest.TestCase):
 		assert(caa.max() == 3)
 
 
+@unittest.skipIf(acaalgo.fellWalker.pycupid is None, "pycupid not installed")
 class TestFW(unittest.TestCase):
-	fw = acaalgo.FellWalker()
+	fw = acaalgo.FellWalker({"BACKEND":"pycupid"})
 
 	data = download_and_load()
 	data2d = np.sum(data,axis=0)
@@ -76,6 +77,100 @@ class TestFW(unittest.TestCase):
 		assert(caa.max() == 4)
 
 
+def label_agreement(ref, caa):
+	# Fraction of the clump pixels of ref that have, in caa, the clump label
+	# most of their ref clump has
+	sel = ref > 0
+	pairs, counts = np.unique(np.vstack((ref[sel], caa[sel])), axis=1, return_counts=True)
+	best = dict()
+	for (label, other), count in zip(pairs.T, counts):
+		if other > 0:
+			best[label] = max(best.get(label, 0), count)
+	return sum(best.values()) / float(sel.sum())
+
+
+@unittest.skipIf(acaalgo.fellWalker.pycupid is None, "pycupid not installed")
+class TestFWParity(unittest.TestCase):
+	cupid = acaalgo.FellWalker({"BACKEND":"pycupid"})
+	fw = acaalgo.FellWalker({"BACKEND":"numpy"})
+
+	data = download_and_load()
+	data2d = np.sum(data,axis=0)
+
+	def check(self, data):
+		ref = self.cupid.run(data)[0]
+		caa = self.fw.run(data)[0]
+		np.testing.assert_equal(caa.max(), ref.max())
+		assert(label_agreement(ref, caa) > 0.9)
+		assert(label_agreement(caa, ref) > 0.9)
+
+	def test_parity_3d(self):
+		self.check(self.data)
+
+	def test_parity_2d(self):
+		self.check(self.data2d)
+
+
+class TestFWNumpy(unittest.TestCase):
+	fw = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy"})
+
+	z,y,x = np.mgrid[:30,:60,:60]
+	data = 5.0*np.exp(-((z-15)**2+(y-20)**2+(x-20)**2)/18.0)
+	data += 4.0*np.exp(-((z-15)**2+(y-40)**2+(x-40)**2)/18.0)
+	data += np.random.RandomState(0).normal(0,0.1,data.shape)
+
+	def test_run_3d(self):
+		caa = self.fw.run(self.data)[0]
+		assert(caa.min() == 0)
+		assert(caa.max() == 2)
+		assert(caa[15,20,20] == 1)
+		assert(caa[15,40,40] == 2)
+
+	def test_run_2d(self):
+		caa = self.fw.run(self.data[15])[0]
+		assert(caa.max() == 2)
+
+	def test_mindip(self):
+		z,y,x = np.mgrid[:30,:40,:50]
+		data = 5.0*np.exp(-((z-15)**2+(y-20)**2+(x-20)**2)/18.0)
+		data += 4.8*np.exp(-((z-15)**2+(y-20)**2+(x-28)**2)/18.0)
+		data += np.random.RandomState(0).normal(0,0.1,data.shape)
+		# the dip between the peaks is about 0.9
+		caa = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy", "MINDIP":0.3}).run(data)[0]
+		assert(caa.max() == 2)
+		assert(caa[15,20,20] == 1)
+		assert(caa[15,20,28] == 2)
+		caa = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy", "MINDIP":2.0}).run(data)[0]
+		assert(caa.max() == 1)
+		assert(caa[15,20,20] == 1)
+		assert(caa[15,20,28] == 1)
+
+	def test_minpix(self):
+		y,x = np.mgrid[:40,:40]
+		img = 5.0*np.exp(-((y-15)**2+(x-15)**2)/18.0)
+		img += 3.0*np.exp(-((y-30)**2+(x-30)**2)/1.0)
+		img += np.random.RandomState(0).normal(0,0.1,img.shape)
+		# the narrow clump has only a few pixels above the noise
+		caa = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy"}).run(img)[0]
+		assert(caa.max() == 1)
+		assert(caa[15,15] == 1)
+		assert(caa[30,30] == 0)
+		caa = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy", "MINPIX":4}).run(img)[0]
+		assert(caa.max() == 2)
+		assert(caa[30,30] == 2)
+
+	def test_flatslope(self):
+		y,x = np.mgrid[:40,:40]
+		img = 5.0*np.exp(-((y-15)**2+(x-15)**2)/18.0)
+		img += np.random.RandomState(0).normal(0,0.1,img.shape)
+		# the flat start of the walks on the wings is left out of the clump
+		caa = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy", "FLATSLOPE":0.1}).run(img)[0]
+		steep = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy", "FLATSLOPE":1.0}).run(img)[0]
+		assert(caa[15,15] == 1 and steep[15,15] == 1)
+		assert((steep == 1).sum() < (caa == 1).sum())
+		assert(np.all(caa[steep == 1] == 1))
+
+
 class TestIndexing(unittest.TestCase):
 	idx = acaalgo.Indexing({"RANDOM_STATE":1234})
 
@@ -100,7 +195,158 @@ class TestStacking(unittest.TestCase):
 	#TODO make a better unit test
 	def test_run(self):
 		result = self.st.run(self.template,self.imgs)
-		np.testing.assert_equal(result.shape,(99,99))
+		np.testing.assert_equal(result.shape,self.template.shape)
+
+
+class TestStackingStream(unittest.TestCase):
+	y,x = np.mgrid[:60,:60]
+	template = np.exp(-((x-30)**2/50.0+(y-28)**2/10.0))
+	noise = np.random.RandomState(0).normal(0,0.05,(4,)+template.shape)
+	imgs = list(template+noise)
+
+	def test_partial_fit(self):
+		st = acaalgo.Stacking({"VARIANCE":True})
+		st.set_template(self.template)
+		for img in self.imgs:
+			st.partial_fit(img)
+		stacked,weight = st.stacked()
+		np.testing.assert_equal(stacked.shape,self.template.shape)
+		np.testing.assert_equal(weight.max(),len(self.imgs))
+		np.testing.assert_equal(st.variance().shape,self.template.shape)
+		result = acaalgo.Stacking().run(self.template,iter(self.imgs))
+		np.testing.assert_allclose(result,stacked)
+
+	def test_run_batch(self):
+		# a list is measured in one batch, a generator image by image
+		with acaalgo.Collector() as prof:
+			result = acaalgo.Stacking().run(self.template,self.imgs)
+		summary = prof.summary()
+		np.testing.assert_equal(summary["Stacking.fits_props_batch"]["calls"],1)
+		assert("Stacking.fits_props" not in summary)
+		np.testing.assert_allclose(result,acaalgo.Stacking().run(self.template,iter(self.imgs)))
+
+
+class TestCollector(unittest.TestCase):
+	y,x = np.mgrid[:60,:60]
+	template = np.exp(-((x-30)**2/50.0+(y-28)**2/10.0))
+
+	def test_spans(self):
+		st = acaalgo.Stacking()
+		with acaalgo.Collector(memory=True) as prof:
+			st.run(self.template,[self.template,self.template])
+		summary = prof.summary()
+		np.testing.assert_equal(summary["Stacking.run"]["calls"],1)
+		np.testing.assert_equal(summary["Stacking.affine_resample"]["calls"],2)
+		assert(summary["Stacking.run"]["wall"] >= summary["Stacking.affine_resample"]["wall"])
+		assert(summary["Stacking.run"]["peak"] >= summary["Stacking.affine_resample"]["peak"] > 0)
+		trace = prof.chrome_trace()["traceEvents"]
+		np.testing.assert_equal(len(trace),len(prof.records))
+		np.testing.assert_equal(trace[-1]["name"],"Stacking.run")
+
+	def test_disabled(self):
+		prof = acaalgo.Collector()
+		with prof:
+			pass
+		acaalgo.Stacking().run(self.template,[self.template])
+		np.testing.assert_equal(len(prof.records),0)
+
+
+class TestResultCache(unittest.TestCase):
+	data = TestFWNumpy.data[10:20]
+
+	def test_run(self):
+		import tempfile
+		path = tempfile.mkdtemp()
+		try:
+			cache = acaalgo.ResultCache(path)
+			fw = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy"}, cache=cache)
+			caa = fw.run(self.data)[0]
+			np.testing.assert_equal(fw.run(self.data)[0],caa)
+			np.testing.assert_equal((cache.hits,cache.misses),(1,1))
+			fw.set_param("MINPIX",1000)
+			fw.run(self.data)
+			np.testing.assert_equal((cache.hits,cache.misses),(1,2))
+			cache.max_bytes = 0
+			cache.evict()
+			np.testing.assert_equal(os.listdir(path),[])
+		finally:
+			shutil.rmtree(path)
+
+	def test_key_wcs(self):
+		import tempfile
+		from astropy.nddata import NDDataRef
+		from astropy.wcs import WCS
+		path = tempfile.mkdtemp()
+		try:
+			cache = acaalgo.ResultCache(path)
+			fw = acaalgo.FellWalker({"RMS":0.1, "BACKEND":"numpy"})
+			cube = NDDataRef(self.data, wcs=WCS(naxis=3))
+			assert(cache.key(fw,(cube,),{}) is not None)
+			# sliced cubes carry a high level WCS wrapper, and are run without the cache
+			assert(cache.key(fw,(cube[2:5],),{}) is None)
+		finally:
+			shutil.rmtree(path)
+
+	def test_get_evicted(self):
+		import tempfile
+		from unittest import mock
+		path = tempfile.mkdtemp()
+		try:
+			cache = acaalgo.ResultCache(path)
+			cache.put("entry", 42)
+			# another process evicts the entry between the read and the utime
+			with mock.patch.object(acaalgo.cache.os, "utime", side_effect=FileNotFoundError):
+				np.testing.assert_equal(cache.get("entry"),(True,42))
+		finally:
+			shutil.rmtree(path)
+
+
+class TestGaussClumps(unittest.TestCase):
+	gc = acaalgo.GaussClumps({"RMS":0.05, "THRESH":5.0})
+
+	def test_run(self):
+		from acalib.algorithms.gaussClumps import clump_model, _box_features
+		random = np.random.RandomState(0)
+		shape = (20,30,30)
+		par = np.array([3.0,0.0,12.0,3.0,17.0,4.0,0.5,9.0,3.0,0.0,0.0])
+		feat = _box_features(np.zeros(3,dtype=int),np.array(shape))
+		data = clump_model(par,feat,self.gc.get_params()).reshape(shape)
+		data += random.normal(0,0.05,shape)
+		caa,table = self.gc.run(data)
+		assert(caa.max() >= 1)
+		np.testing.assert_allclose(table[0]["RA mu"],12.0,atol=0.5)
+		np.testing.assert_allclose(table[0]["DEC mu"],17.0,atol=0.5)
+		np.testing.assert_allclose(table[0]["FREQ mu"],9.0,atol=0.5)
+		np.testing.assert_allclose(table[0]["Intensity"],3.0,rtol=0.1)
+
+	def test_gradient(self):
+		from acalib.algorithms.gaussClumps import _ClumpFit, _box_features, clump_model
+		from scipy.optimize import approx_fprime
+		config = dict(self.gc.get_params(), NWF=-1)
+		feat = _box_features(np.zeros(3,dtype=int),np.array([9,9,9]))
+		par = np.array([5.0,0.1,4.0,3.0,4.0,3.5,0.3,4.0,3.0,0.05,-0.05])
+		val = clump_model(par,feat,config) + 0.1
+		guess = par + 0.2
+		fit = _ClumpFit(val,feat,np.ones(val.size),guess,par[[2,4,7]],val.max(),False,config)
+		grad = fit.evaluate(guess)[1]
+		num = approx_fprime(guess,lambda p: _ClumpFit.evaluate(fit,p)[0],1e-7)
+		np.testing.assert_allclose(grad,num,rtol=1e-4,atol=1e-5)
+
+	def test_parallel(self):
+		from acalib.algorithms.gaussClumps import clump_model, _box_features
+		random = np.random.RandomState(1)
+		shape = (20,40,40)
+		feat = _box_features(np.zeros(3,dtype=int),np.array(shape))
+		data = random.normal(0,0.05,shape)
+		for x,y,v in [(8,8,5),(30,10,14),(12,30,10),(31,31,6)]:
+			par = np.array([3.0,0.0,x,3.0,y,3.5,0.3,v,3.0,0.0,0.0])
+			data += clump_model(par,feat,self.gc.get_params()).reshape(shape)
+		seq = self.gc.run(data.copy())[1]
+		par = acaalgo.GaussClumps({"RMS":0.05, "THRESH":5.0, "WORKERS":2}).run(data.copy())[1]
+		np.testing.assert_equal(len(seq),len(par))
+		for name in ["Intensity","RA mu","DEC mu","FREQ mu"]:
+			np.testing.assert_allclose(np.sort(seq[name]),np.sort(par[name]),rtol=1e-3,atol=1e-2)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import sys
+import os
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each check runs in a fresh interpreter, where no submodule has been imported yet
+CHECK = """
+import types
+import acalib
+import acalib.upi, acalib.io, acalib.algorithms
+for module, name in [(acalib.upi, 'axes'), (acalib.upi, 'flux'), (acalib.upi, 'reduction'),
+                     (acalib.io, 'fits'), (acalib.io, 'container'), (acalib.algorithms, 'cache'),
+                     (acalib, 'axes'), (acalib, 'flux'), (acalib, 'fits'), (acalib, 'core')]:
+    assert isinstance(getattr(module, name), types.ModuleType), name
+assert acalib.upi.axes.opening is acalib.upi.opening
+assert acalib.flux is acalib.upi.flux
+try:
+    acalib.upi.nonexistent
+except AttributeError:
+    pass
+else:
+    raise AssertionError("nonexistent attribute found")
+"""
+
+
+class TestImports(unittest.TestCase):
+    def test_submodule_attributes(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+        result = subprocess.run([sys.executable, '-c', CHECK], env=env, cwd=ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
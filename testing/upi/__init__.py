@@ -0,0 +1,2 @@
+from .test_axes import *
+from .test_reduction import *
\ No newline at end of file
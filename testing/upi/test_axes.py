@@ -0,0 +1,124 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import astropy.units as u
+from astropy.nddata import NDData
+from astropy.wcs import WCS
+sys.path.append("../..")
+import acalib.upi.axes as acaax
+
+
+def _wcs():
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN', 'FREQ']
+    wcs.wcs.cunit = ['deg', 'deg', 'Hz']
+    wcs.wcs.crpix = [20, 20, 5]
+    wcs.wcs.crval = [83.8, -5.4, 2.3e11]
+    wcs.wcs.cdelt = [-1e-4, 1e-4, 1e6]
+    wcs.wcs.set()
+    return wcs
+
+
+class TestAxes(unittest.TestCase):
+    wcs = _wcs()
+    data = np.random.RandomState(0).normal(size=(10,40,40))
+    center = [2.3e11 * u.Hz, -5.4 * u.deg, 83.8 * u.deg]
+
+    def test_opening(self):
+        lower, upper = acaax.opening(self.data, self.center, [3e6 * u.Hz, 1e-3 * u.deg, 1e-3 * u.deg], wcs=self.wcs)
+        np.testing.assert_equal(lower, [1,9,9])
+        np.testing.assert_equal(upper, [7,29,29])
+        # windows in other (equivalent) units give the same box
+        mixed = acaax.opening(self.data, self.center, [3 * u.MHz, 3.6 * u.arcsec, 3.6 * u.arcsec], wcs=self.wcs)
+        np.testing.assert_equal(mixed, (lower, upper))
+        # boxes are clipped to the data
+        lower, upper = acaax.opening(self.data, self.center, [1e8 * u.Hz, 1 * u.deg, 1 * u.deg], wcs=self.wcs)
+        np.testing.assert_equal(lower, [0,0,0])
+        np.testing.assert_equal(upper, self.data.shape)
+
+    def test_openings(self):
+        centers = [self.center, [2.3e11 * u.Hz, -5.4 * u.deg, 83.8 * u.deg + 10 * u.arcsec]]
+        windows = [[3 * u.MHz, 3.6 * u.arcsec, 3.6 * u.arcsec], [1e6 * u.Hz, 2e-4 * u.deg, 2e-4 * u.deg]]
+        lowers, uppers = acaax.openings(self.data, centers, windows, wcs=self.wcs)
+        for i in range(2):
+            lower, upper = acaax.opening(self.data, centers[i], windows[i], wcs=self.wcs)
+            np.testing.assert_equal(lowers[i], lower)
+            np.testing.assert_equal(uppers[i], upper)
+        # plain values are in the units of the WCS
+        plain = acaax.openings(self.data, np.array([[2.3e11, -5.4, 83.8]]), np.array([[3e6, 1e-3, 1e-3]]), wcs=self.wcs)
+        np.testing.assert_equal(plain[0], [[1,9,9]])
+        np.testing.assert_equal(plain[1], [[7,29,29]])
+
+    def test_cut(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            data = np.memmap(path, dtype=np.float64, mode='w+', shape=self.data.shape)
+            data[...] = self.data
+            mask = self.data > 1
+            cube = NDData(data, wcs=self.wcs, mask=mask, unit=u.Jy, meta={'OBJECT': 'test'})
+            result = acaax.cut(cube, lower=(1,5,10), upper=(4,15,30))
+            # a view of the (memory-mapped) data, with the mask, unit and meta
+            self.assertTrue(np.shares_memory(result.data, data))
+            np.testing.assert_equal(result.data, self.data[1:4,5:15,10:30])
+            np.testing.assert_equal(result.mask, mask[1:4,5:15,10:30])
+            self.assertEqual(result.unit, u.Jy)
+            self.assertEqual(result.meta['OBJECT'], 'test')
+            # the lazy WCS is the sliced WCS
+            expected = self.wcs.slice((slice(1,4),slice(5,15),slice(10,30)), numpy_order=True)
+            np.testing.assert_allclose(result.wcs.wcs.crpix, expected.wcs.crpix)
+            np.testing.assert_allclose(result.wcs.pixel_to_world_values(0, 0, 0),
+                                       self.wcs.pixel_to_world_values(10, 5, 1))
+            # slicing the cut slices data and mask together
+            sub = result[1:, 2:4]
+            np.testing.assert_equal(sub.data, self.data[2:4,7:9,10:30])
+            np.testing.assert_equal(sub.mask, mask[2:4,7:9,10:30])
+            del data, cube, result, sub
+        finally:
+            os.remove(path)
+
+    def test_cuts(self):
+        cube = NDData(self.data, wcs=self.wcs, mask=self.data > 1)
+        lowers = [(0,0,0), (1,5,10), (0,0,0)]
+        uppers = [(2,3,4), (4,15,30), (2,3,4)]
+        results = acaax.cuts(cube, lowers=lowers, uppers=uppers)
+        self.assertEqual(len(results), 3)
+        for result, lower, upper in zip(results, lowers, uppers):
+            expected = acaax.cut(cube, lower=lower, upper=upper)
+            np.testing.assert_equal(result.data, expected.data)
+            np.testing.assert_equal(result.mask, expected.mask)
+        # cuts of the same box share their WCS
+        self.assertIs(results[0].wcs, results[2].wcs)
+        self.assertIsNot(results[0].wcs, results[1].wcs)
+        # boxes in world coordinates
+        windows = [[3 * u.MHz, 3.6 * u.arcsec, 3.6 * u.arcsec]]
+        result = acaax.cuts(cube, centers=[self.center], windows=windows)[0]
+        np.testing.assert_equal(result.data, self.data[1:7,9:29,9:29])
+        self.assertRaises(ValueError, acaax.cuts, cube)
+        self.assertRaises(ValueError, acaax.cuts, cube, centers=[self.center])
+        self.assertRaises(ValueError, acaax.cuts, cube, lowers=lowers, uppers=uppers[:2])
+
+    def test_features_chunks(self):
+        rotated = _wcs()
+        angle = np.radians(30)
+        rotated.wcs.pc = [[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]]
+        rotated.wcs.set()
+        for wcs in (self.wcs, rotated):
+            for lower, upper in ((None, None), ((2,5,10), (6,12,30))):
+                table = acaax.features(self.data, wcs=wcs, lower=lower, upper=upper)
+                expected = np.column_stack([table[name] for name in table.colnames])
+                for chunk_size in (7, 1000, None):
+                    chunks = list(acaax.features_chunks(self.data, wcs=wcs, lower=lower, upper=upper,
+                                                        chunk_size=chunk_size))
+                    np.testing.assert_allclose(np.concatenate(chunks), expected)
+                # every voxel, through the full WCS transformation
+                lower = (0,0,0) if lower is None else lower
+                upper = self.data.shape if upper is None else upper
+                pix = np.indices(np.subtract(upper, lower)).reshape(3, -1).T + lower
+                np.testing.assert_allclose(expected[:, ::-1], wcs.wcs_pix2world(pix[:, ::-1], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
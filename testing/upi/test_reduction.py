@@ -0,0 +1,48 @@
+import unittest
+import sys
+import warnings
+import numpy as np
+from astropy.wcs import WCS
+sys.path.append("../..")
+import acalib.upi.reduction as acared
+from acalib.core.utils import da
+
+
+def _wcs():
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN', 'FREQ']
+    wcs.wcs.cunit = ['deg', 'deg', 'Hz']
+    wcs.wcs.crpix = [5, 5, 4]
+    wcs.wcs.crval = [83.8, -5.4, 2.3e11]
+    wcs.wcs.cdelt = [-1e-4, 1e-4, 1e6]
+    wcs.wcs.restfrq = 2.3e11
+    wcs.wcs.set()
+    return wcs
+
+
+class TestReduction(unittest.TestCase):
+    wcs = _wcs()
+
+    @unittest.skipIf(da is None, "dask not installed")
+    def test_moments_dask(self):
+        random = np.random.RandomState(0)
+        # negative values give negative moment 2 variances in some pixels
+        data = random.normal(0.5, 1.0, size=(8,10,10))
+        mask = random.rand(8,10,10) < 0.2
+        mask[:,0,0] = True
+        lazy = da.from_array(data, chunks=(3,5,5))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for moment in (acared.moment0, acared.moment1, acared.moment2):
+                expected = moment(data, wcs=self.wcs, mask=mask)
+                result = moment(lazy, wcs=self.wcs, mask=mask)
+                self.assertIsInstance(result.data, da.Array)
+                self.assertEqual(result.unit, expected.unit)
+                valid = ~np.broadcast_to(np.asarray(expected.mask, dtype=bool), expected.data.shape)
+                np.testing.assert_equal(~np.asarray(result.mask.compute()), valid)
+                np.testing.assert_allclose(np.asarray(result.data.compute())[valid], expected.data[valid])
+        # besides the pixel without values, the negative variances are masked
+        self.assertGreater(np.asarray(result.mask.compute()).sum(), 1)
+
+if __name__ == '__main__':
+    unittest.main()